@@ -13,7 +13,7 @@ const char* password = "11223344";
 // ============================
 const char* ws_server_host = "10.162.211.102";  // 🔁 CHANGE if server IP changes
 const uint16_t ws_server_port = 8000;           // 🔁 CHANGE if port changes
-const char* ws_server_path = "/ws/camera/";
+const char* ws_server_path = "/ws/camera/";           // or "/ws/camera/<robot_id>/publish" with several robots
 
 // WebSocket client
 WebSocketsClient webSocket;
@@ -72,7 +72,7 @@ void setupCamera() {
   config.xclk_freq_hz = 20000000;      // Camera clock (20 MHz stable)
   config.pixel_format = PIXFORMAT_JPEG;
 
-  config.frame_size = FRAMESIZE_QQVGA; // ✅ 160x120 (VERY FAST)
+  config.frame_size = FRAMESIZE_VGA;   // Buffer sized for the largest framesize the server may ask for
   // Other options you can try:
   // FRAMESIZE_QQVGA2 (128x160)
   // FRAMESIZE_QCIF   (176x144)
@@ -90,6 +90,41 @@ void setupCamera() {
     Serial.println("Camera init failed!");
     ESP.restart();
   }
+
+  // Start small, the server steps it up if the viewers can keep up
+  sensor_t* s = esp_camera_sensor_get();
+  s->set_framesize(s, FRAMESIZE_QQVGA); // ✅ 160x120 (VERY FAST)
+}
+
+// ============================
+// Settings from the server
+// ============================
+// Text message on the WebSocket, same parameters as the HTTP /set:
+//   framesize=QVGA&quality=30
+void applyCameraSettings(String params) {
+  sensor_t* s = esp_camera_sensor_get();
+  int start = 0;
+  while (start < params.length()) {
+    int end = params.indexOf('&', start);
+    if (end < 0) end = params.length();
+    String pair = params.substring(start, end);
+    int eq = pair.indexOf('=');
+    if (eq > 0) {
+      String key = pair.substring(0, eq);
+      String value = pair.substring(eq + 1);
+      if (key == "framesize") {
+        if (value == "QQVGA") s->set_framesize(s, FRAMESIZE_QQVGA);      // 160x120
+        else if (value == "HQVGA") s->set_framesize(s, FRAMESIZE_HQVGA); // 240x176
+        else if (value == "QVGA") s->set_framesize(s, FRAMESIZE_QVGA);   // 320x240
+        else if (value == "CIF") s->set_framesize(s, FRAMESIZE_CIF);     // 400x296
+        else if (value == "VGA") s->set_framesize(s, FRAMESIZE_VGA);     // 640x480
+      } else if (key == "quality") {
+        s->set_quality(s, constrain(value.toInt(), 10, 63));
+      }
+    }
+    start = end + 1;
+  }
+  Serial.println("Camera settings: " + params);
 }
 
 // ============================
@@ -100,6 +135,8 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
     Serial.println("WebSocket connected");
   } else if (type == WStype_DISCONNECTED) {
     Serial.println("WebSocket disconnected");
+  } else if (type == WStype_TEXT) {
+    applyCameraSettings(String((char*)payload));
   }
 }
 
@@ -0,0 +1,122 @@
+# Adaptive quality harness: a simulated ESP32 that honours the server's
+# framesize/quality messages, and browsers behind a slow link.
+# The controller should step the camera up until the link is full, back
+# off when the viewers fall behind, and settle under the target latency.
+#
+#   python bench_adaptive_quality.py
+import asyncio
+import contextlib
+import io
+import os
+from urllib.parse import parse_qs
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+django.setup()
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.urls import path
+
+from camera.consumers import TARGET_LATENCY, CameraConsumer
+from camera.hub import get_stream
+from camera.quality import PIXELS
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+FPS = 20
+SECONDS = 60
+VIEWERS = 3
+LINK_BYTES_PER_SECOND = 150_000    # each browser's bandwidth
+# -------------------------
+
+
+class SlowLinkConsumer(CameraConsumer):
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if bytes_data:
+            await asyncio.sleep(len(bytes_data) / LINK_BYTES_PER_SECOND)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+
+ROBOT = {'robot_id': 'adaptive'}
+
+application = URLRouter([
+    path('publish', CameraConsumer.as_asgi(), {**ROBOT, 'role': 'publish'}),
+    path('view', SlowLinkConsumer.as_asgi(), {**ROBOT, 'role': 'view'}),
+])
+
+
+class SimulatedESP32:
+    """Sends JPEG-sized frames for its current framesize/quality."""
+
+    def __init__(self, communicator):
+        self.ws = communicator
+        self.framesize = 'VGA'      # until the server says otherwise
+        self.quality = 20
+
+    def frame_size(self):
+        # Rough JPEG size: more bytes per pixel at better (lower) quality
+        bytes_per_pixel = 0.05 + (63 - self.quality) / 63 * 0.35
+        return int(PIXELS[self.framesize] * bytes_per_pixel)
+
+    async def read_commands(self):
+        while not await self.ws.receive_nothing(timeout=0.01, interval=0.005):
+            params = parse_qs(await self.ws.receive_from())
+            self.framesize = params.get('framesize', [self.framesize])[0]
+            self.quality = int(params.get('quality', [self.quality])[0])
+
+
+async def drain(browser):
+    while True:
+        await browser.receive_from(timeout=5)
+
+
+async def main():
+    esp32_ws = WebsocketCommunicator(application, "/publish")
+    browsers = [WebsocketCommunicator(application, "/view") for _ in range(VIEWERS)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for browser in browsers:
+            await browser.connect()
+        await esp32_ws.connect()
+    esp32 = SimulatedESP32(esp32_ws)
+    drains = [asyncio.create_task(drain(b)) for b in browsers]
+    viewers = get_stream(ROBOT['robot_id']).viewers
+
+    print(f"target latency {TARGET_LATENCY * 1000:.0f} ms, link {LINK_BYTES_PER_SECOND / 1000:.0f} kB/s per viewer")
+    print(f"{'t':>4} {'setting':>10} {'frame':>8} {'latency ms':>11} {'drops':>6}")
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    last_print = -1
+    last_drops = 0
+    latency = 0.0
+    lines = []
+    # Quiet the consumers' own prints
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(FPS * SECONDS):
+            await esp32.read_commands()
+            await esp32_ws.send_to(bytes_data=os.urandom(esp32.frame_size()))
+            await asyncio.sleep(max(0.0, start + (i + 1) / FPS - loop.time()))
+            second = int(loop.time() - start)
+            if second != last_print:
+                last_print = second
+                latency = max(v.latency for v in viewers)
+                drops = sum(v.frames_dropped for v in viewers)
+                lines.append(f"{second:>4} {esp32.framesize + '/' + str(esp32.quality):>10} "
+                             f"{esp32.frame_size():>8} {latency * 1000:>11.0f} {drops - last_drops:>6}")
+                last_drops = drops
+    print("\n".join(lines))
+    print("PASS: viewers under the target latency" if latency <= TARGET_LATENCY
+          else "FAIL: viewers still over the target latency")
+
+    for task in drains:
+        task.cancel()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await esp32_ws.disconnect()
+        for browser in browsers:
+            await browser.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+# Camera relay benchmark: one simulated ESP32 and N simulated browsers.
+# Measures delivered frames/s and the relay's CPU, binary vs Base64 frames.
+#
+# The relay is a Daphne worker in its own process (as in
+# loadtest_workers.py) and the ESP32 publishes at a fixed frame rate, so
+# the CPU figure is the relay's alone: the browsers here don't count.
+# Reads the worker's CPU time from /proc, so Linux only.
+#
+#   python bench_broadcast.py
+import asyncio
+import os
+import time
+
+import websockets
+
+from loadtest_workers import start_workers
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+VIEWER_COUNTS = [1, 10, 50]
+FPS = 30
+SECONDS = 5
+FRAME_SIZE = 6000          # bytes, about one QQVGA JPEG
+PORT = 8190
+URL = f"ws://127.0.0.1:{PORT}/ws/camera/{{robot}}/{{role}}"
+# -------------------------
+
+frame = b"\xff\xd8" + os.urandom(FRAME_SIZE - 4) + b"\xff\xd9"
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process so far."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def view(url, ready):
+    frames = 0
+    async with websockets.connect(url, max_size=None) as ws:
+        ready.release()
+        while True:
+            try:
+                # Read frames until the relay has gone quiet
+                await asyncio.wait_for(ws.recv(), 1.0)
+            except asyncio.TimeoutError:
+                return frames
+            frames += 1
+
+
+async def publish(url):
+    sent = 0
+    async with websockets.connect(url) as ws:
+        start = time.monotonic()
+        while sent < FPS * SECONDS:
+            await ws.send(frame)
+            sent += 1
+            await asyncio.sleep(max(0.0, start + sent / FPS - time.monotonic()))
+    return sent
+
+
+async def run(pid, viewers, base64_frames):
+    mode = "base64" if base64_frames else "binary"
+    # A robot per run, so no browser starts with the last run's frame
+    robot = f"bench-{viewers}-{mode}"
+    ready = asyncio.Semaphore(0)
+    view_url = URL.format(robot=robot, role='view') + f"?format={mode}"
+    browsers = [asyncio.create_task(view(view_url, ready)) for _ in range(viewers)]
+    for _ in range(viewers):
+        await ready.acquire()
+
+    cpu_start = cpu_seconds(pid)
+    await publish(URL.format(robot=robot, role='publish'))
+    counts = await asyncio.gather(*browsers)
+    # The browsers waited a second for more: that's idle time on the relay
+    cpu = cpu_seconds(pid) - cpu_start
+    delivered = sum(counts)
+    return delivered / viewers / SECONDS, cpu / SECONDS * 100, cpu / max(delivered, 1) * 1e6
+
+
+def main():
+    worker, = start_workers(1, PORT)
+    try:
+        print(f"{FPS} fps for {SECONDS} s, {FRAME_SIZE} byte frames, relay in its own process (pid {worker.pid})")
+        print(f"{'viewers':>8} {'mode':>7} {'fps/viewer':>11} {'relay cpu %':>12} {'us/frame':>9}")
+        for viewers in VIEWER_COUNTS:
+            for base64_frames in (False, True):
+                fps, cpu, per_frame = asyncio.run(run(worker.pid, viewers, base64_frames))
+                mode = "base64" if base64_frames else "binary"
+                print(f"{viewers:>8} {mode:>7} {fps:>11.1f} {cpu:>12.1f} {per_frame:>9.0f}")
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+if __name__ == "__main__":
+    main()
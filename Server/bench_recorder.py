@@ -0,0 +1,112 @@
+# Recorder benchmark: several 30 fps camera streams written at once.
+# Shows that recording doesn't hold up the event loop (the ESP32 ingest)
+# and how fast the segments are written, then checks seek and retention.
+#
+#   python bench_recorder.py [streams] [seconds]
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+django.setup()
+
+from camera.hub import Frame
+from camera.recorder import FrameRecorder
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+STREAMS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+FPS = 30
+FRAME_SIZE = 20000          # bytes, about one VGA JPEG
+SEGMENT_SECONDS = 2
+# -------------------------
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def camera(recorder, jpeg, add_times, lateness):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for i in range(int(FPS * SECONDS)):
+        due = start + i / FPS
+        await asyncio.sleep(max(0.0, due - loop.time()))
+        lateness.append(loop.time() - due)
+        t = time.perf_counter()
+        recorder.add(Frame(jpeg, ('bench', i)))
+        add_times.append(time.perf_counter() - t)
+
+
+async def main():
+    root = tempfile.mkdtemp(prefix='camera_rec_')
+    jpeg = b"\xff\xd8" + os.urandom(FRAME_SIZE - 4) + b"\xff\xd9"
+    recorders = [FrameRecorder(os.path.join(root, f'robot{i}'), segment_seconds=SEGMENT_SECONDS)
+                 for i in range(STREAMS)]
+    add_times = []
+    lateness = []
+
+    print(f"{STREAMS} streams x {FPS} fps x {SECONDS:.0f} s, {FRAME_SIZE} byte frames -> {root}")
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(camera(r, jpeg, add_times, lateness) for r in recorders))
+    for recorder in recorders:
+        await recorder.close()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    written = sum(r.frames_written for r in recorders)
+    dropped = sum(r.frames_dropped for r in recorders)
+    size = sum(r.bytes_written for r in recorders)
+    print(f"frames written: {written} ({written / elapsed:.0f} frames/s), dropped: {dropped}")
+    print(f"disk throughput: {size / elapsed / 1e6:.1f} MB/s, process CPU: {cpu / elapsed * 100:.0f} %")
+    print(f"add() on the event loop: p50 {percentile(add_times, 0.5) * 1e6:.1f} us, "
+          f"p99 {percentile(add_times, 0.99) * 1e6:.1f} us, max {max(add_times) * 1e6:.1f} us")
+    print(f"frame tick lateness: p50 {percentile(lateness, 0.5) * 1e3:.2f} ms, "
+          f"p99 {percentile(lateness, 0.99) * 1e3:.2f} ms, max {max(lateness) * 1e3:.2f} ms")
+
+    # Seek: a frame from the middle of the recording
+    recorder = recorders[0]
+    segments = recorder.segments()
+    middle = (segments[0] + segments[-1]) / 2000
+    t = time.perf_counter()
+    found = recorder.frame_at(middle)
+    print(f"segments per stream: {len(segments)}, seek to the middle: "
+          f"{(time.perf_counter() - t) * 1e3:.2f} ms, found: {found is not None and found[1] == jpeg}")
+
+    # Retention: pretend a day has gone by
+    recorder.apply_retention(now=time.time() + recorder.retention_seconds + 1)
+    print(f"segments left after retention: {len(recorder.segments())}")
+
+    # close() while the writer thread is still on a batch
+    recorder = FrameRecorder(os.path.join(root, 'closing'), batch_frames=1)
+    write_batch = recorder._write_batch
+    delays = iter([0.3])
+
+    def slow_write_batch(batch):
+        time.sleep(next(delays, 0))     # the first batch is slow
+        write_batch(batch)
+
+    recorder._write_batch = slow_write_batch
+    recorder.add(Frame(jpeg, ('bench', 0)))
+    await asyncio.sleep(0.05)
+    recorder.add(Frame(jpeg, ('bench', 1)))
+    await recorder.close()
+    closed = recorder.frames_written, recorder._data_file is None
+    await asyncio.sleep(0.5)
+    print(f"close() during a write: {closed[0]} of 2 frames written by then, segment closed: {closed[1]}, "
+          f"still closed after: {recorder._data_file is None}")
+
+    shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
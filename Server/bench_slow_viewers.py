@@ -0,0 +1,93 @@
+# Camera relay harness: fast and artificially slow browsers on one stream.
+# Fast browsers must keep the full frame rate while slow ones drop frames.
+#
+#   python bench_slow_viewers.py
+import asyncio
+import contextlib
+import io
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+django.setup()
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.urls import path
+
+from camera.consumers import CameraConsumer
+from camera.hub import get_stream
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+FPS = 30
+SECONDS = 5
+FAST_VIEWERS = 5
+SLOW_VIEWERS = 2
+SLOW_SEND_DELAY = 0.2      # seconds per frame, like a bad ngrok link
+# -------------------------
+
+
+class SlowCameraConsumer(CameraConsumer):
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        await asyncio.sleep(SLOW_SEND_DELAY)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+
+ROBOT = {'robot_id': 'bench'}
+
+application = URLRouter([
+    path('ws/camera/publish', CameraConsumer.as_asgi(), {**ROBOT, 'role': 'publish'}),
+    path('ws/camera/view', CameraConsumer.as_asgi(), {**ROBOT, 'role': 'view'}),
+    path('ws/slow/view', SlowCameraConsumer.as_asgi(), {**ROBOT, 'role': 'view'}),
+])
+
+
+async def drain(browser):
+    while not await browser.receive_nothing(timeout=0.5):
+        await browser.receive_from()
+
+
+async def main():
+    fast = [WebsocketCommunicator(application, "/ws/camera/view") for _ in range(FAST_VIEWERS)]
+    slow = [WebsocketCommunicator(application, "/ws/slow/view") for _ in range(SLOW_VIEWERS)]
+    esp32 = WebsocketCommunicator(application, "/ws/camera/publish")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for browser in fast + slow:
+            await browser.connect()
+        await esp32.connect()
+
+    drains = [asyncio.create_task(drain(b)) for b in fast + slow]
+    frames = FPS * SECONDS
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for i in range(frames):
+        await esp32.send_to(bytes_data=b"\xff\xd8" + os.urandom(4000) + b"\xff\xd9")
+        await asyncio.sleep(max(0.0, start + (i + 1) / FPS - loop.time()))
+    await asyncio.sleep(SLOW_SEND_DELAY * 2)
+    elapsed = loop.time() - start
+
+    browsers = get_stream(ROBOT['robot_id']).viewers
+    print(f"ESP32 sent {frames} frames in {elapsed:.2f} s")
+    print(f"{'viewer':>8} {'sent':>6} {'dropped':>8} {'fps':>6}")
+    ok = True
+    for browser in sorted(browsers, key=lambda b: -b.frames_sent):
+        kind = "slow" if isinstance(browser, SlowCameraConsumer) else "fast"
+        fps = browser.frames_sent / elapsed
+        print(f"{kind:>8} {browser.frames_sent:>6} {browser.frames_dropped:>8} {fps:>6.1f}")
+        if kind == "fast" and browser.frames_sent < frames * 0.95:
+            ok = False
+    print("PASS: fast viewers kept full frame rate" if ok else "FAIL: fast viewers were held back")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await esp32.disconnect()
+        for browser in fast + slow:
+            await browser.disconnect()
+    for task in drains:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
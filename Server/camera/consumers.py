@@ -1,33 +1,249 @@
-import base64
+import asyncio
+import collections
+import itertools
+import json
+import time
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .hub import DEFAULT_ROBOT, get_stream
+from .metrics import StageMetrics
+from .quality import QualityController
+
+# Old pages expect every frame as a Base64 text message. New pages get the
+# JPEG bytes untouched as binary messages. A single page can still ask for
+# Base64 with ?format=base64 in the WebSocket URL.
+BASE64_FRAMES = getattr(settings, 'CAMERA_BASE64_FRAMES', False)
+
+# A cached frame older than this isn't shown to a new browser
+LAST_FRAME_MAX_AGE = getattr(settings, 'CAMERA_LAST_FRAME_MAX_AGE', 10)
+
+# Step the ESP32's framesize/quality to keep viewers under the target latency
+ADAPTIVE_QUALITY = getattr(settings, 'CAMERA_ADAPTIVE_QUALITY', True)
+TARGET_LATENCY = getattr(settings, 'CAMERA_TARGET_LATENCY', 0.25)
+
+# How often each browser reports its latency and drops to the ESP32's worker
+STATS_INTERVAL = 1.0
+
+# Ingest times of the last frames sent to a browser, to match its render reports
+RENDER_WINDOW = 100
+
+# Viewer ids for the metrics, per worker
+viewer_ids = itertools.count(1)
 
-# Keep track of all connected browsers
-connected_browsers = set()
 
 class CameraConsumer(AsyncWebsocketConsumer):
+    """
+    ws/camera/<robot_id>/publish   the robot's ESP32 sends JPEG frames
+    ws/camera/<robot_id>/view      a browser watches that robot only
+    ws/camera/                     old single-camera URL for both
+    """
+
     async def connect(self):
+        kwargs = self.scope['url_route']['kwargs']
+        self.stream = get_stream(kwargs.get('robot_id', DEFAULT_ROBOT))
+        # 'publish', 'view', or None on the old URL (ESP32 found by its first frame)
+        self.role = kwargs.get('role')
+        self.is_camera = self.role == 'publish'
+        self.frame_seq = 0
+        self.last_ingest = None
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        frame_format = query.get('format', [''])[0]
+        if frame_format:
+            self.base64_frames = frame_format == 'base64'
+        else:
+            self.base64_frames = BASE64_FRAMES
+
+        # Outbox of depth 1: only the newest frame waits to be sent
+        self.pending_frame = None
+        self.pending_since = 0.0
+        self.frame_ready = asyncio.Event()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.sender = None
+        self.quality = None
+
+        # Seconds from ingest until the frame is sent, smoothed
+        self.latency = 0.0
+        self._stats_time = time.monotonic()
+        self._stats_sent = 0
+        self._stats_dropped = 0
+
+        # Where this browser's frames spend their time, see /camera/metrics
+        self.viewer_id = next(viewer_ids)
+        self.metrics = StageMetrics()
+        self.sent_ingest_times = collections.deque(maxlen=RENDER_WINDOW)
+
+        if not self.is_camera:
+            self.sender = asyncio.create_task(self.send_frames())
+            await self.channel_layer.group_add(self.stream.group, self.channel_name)
+            self.stream.viewers.add(self)
+
         await self.accept()
-        connected_browsers.add(self)
-        print(f"Browser connected! Total: {len(connected_browsers)}")
+        if self.is_camera:
+            await self.start_camera()
+        else:
+            print(f"Browser connected to '{self.stream.robot_id}'! Total: {len(self.stream.viewers)}")
+            # Show the last frame right away instead of waiting for the next one
+            frame = self.stream.last_frame
+            if frame is not None and time.time() - frame.timestamp < LAST_FRAME_MAX_AGE:
+                self.offer(frame)
 
     async def disconnect(self, close_code):
-        connected_browsers.discard(self)
-        print(f"Browser disconnected. Total: {len(connected_browsers)}")
+        self.stream.last_used = time.monotonic()
+        if self.is_camera:
+            self.stream.cameras -= 1
+            if self.quality is not None:
+                await self.channel_layer.group_discard(self.stream.control_group, self.channel_name)
+            if self.stream.recorder is not None and not self.stream.cameras:
+                await self.stream.recorder.close()
+            print(f"Camera '{self.stream.robot_id}' disconnected.")
+            return
+        await self.channel_layer.group_discard(self.stream.group, self.channel_name)
+        self.stream.viewers.discard(self)
+        self.sender.cancel()
+        self.stream.closed_viewer_metrics.merge(self.metrics)
+        # HTTP viewers on this worker may still need the frames
+        follow_seconds = self.stream.follow_until - time.monotonic()
+        if follow_seconds > 0:
+            self.stream.follow(follow_seconds)
+        print(f"Browser disconnected from '{self.stream.robot_id}'. Total: {len(self.stream.viewers)} "
+              f"(sent {self.frames_sent}, dropped {self.frames_dropped})")
 
     async def receive(self, text_data=None, bytes_data=None):
         """
         Receive data from ESP32 (binary) or other clients
-        and broadcast to all connected browsers.
+        and broadcast to the browsers watching this robot.
+        """
+        if text_data is not None and not self.is_camera:
+            self.frame_rendered(text_data)
+            return
+        if not bytes_data or self.role == 'view':
+            return
+        start = time.perf_counter()
+        if not self.is_camera:
+            # First frame on the old URL: this is the ESP32, which doesn't
+            # need its own frames back
+            self.is_camera = True
+            await self.channel_layer.group_discard(self.stream.group, self.channel_name)
+            self.stream.viewers.discard(self)
+            self.sender.cancel()
+            await self.start_camera()
+        await self.broadcast(bytes_data)
+        self.stream.metrics.observe('camera_ingest_seconds', time.perf_counter() - start)
+
+    def frame_rendered(self, text_data):
+        """
+        The browser's report for a frame it put on screen:
+        {"type": "rendered", "frame": <n-th frame it got>, "decode": <seconds>}
         """
-        if bytes_data:
-            # Convert JPEG bytes to Base64
-            frame_base64 = base64.b64encode(bytes_data).decode('utf-8')
-            await self.broadcast(frame_base64)
+        try:
+            report = json.loads(text_data)
+            number = int(report['frame'])
+            decode = float(report.get('decode', 0))
+        except (ValueError, TypeError, KeyError):
+            return
+        # Frames arrive in the order they were sent, so the n-th frame
+        # the browser got is the n-th one sent
+        index = number - (self.frames_sent - len(self.sent_ingest_times)) - 1
+        if not 0 <= index < len(self.sent_ingest_times):
+            return
+        self.metrics.observe('camera_browser_decode_seconds', decode)
+        # Includes the report's own trip back to the server
+        self.metrics.observe('camera_render_latency_seconds', time.time() - self.sent_ingest_times[index])
 
-    async def broadcast(self, frame_base64):
-        for browser in connected_browsers.copy():
+    async def start_camera(self):
+        self.stream.cameras += 1
+        print(f"Camera '{self.stream.robot_id}' connected!")
+        if ADAPTIVE_QUALITY:
+            self.quality = QualityController(target_latency=TARGET_LATENCY)
+            await self.channel_layer.group_add(self.stream.control_group, self.channel_name)
+            # Start the ESP32 from a known setting
+            await self.send(text_data=self.quality.command())
+
+    async def broadcast(self, jpeg):
+        # Never waits on a browser, so the ESP32 is read at full speed
+        self.frame_seq += 1
+        frame = self.stream.add_frame(jpeg, (self.channel_name, self.frame_seq))
+        if self.last_ingest is not None:
+            self.stream.metrics.observe('camera_frame_interval_seconds', frame.timestamp - self.last_ingest)
+        self.last_ingest = frame.timestamp
+        if self.stream.recorder is not None:
+            self.stream.recorder.add(frame)
+        await self.channel_layer.group_send(self.stream.group, {
+            'type': 'camera.frame',
+            'jpeg': jpeg,
+            'camera': self.channel_name,
+            'seq': self.frame_seq,
+            'time': frame.timestamp,
+        })
+
+    async def camera_frame(self, event):
+        frame = self.stream.add_frame(event['jpeg'], (event['camera'], event['seq']), event['time'])
+        self.metrics.observe('camera_fanout_seconds', time.time() - event['time'])
+        if frame is not None:
+            self.offer(frame)
+
+    async def camera_viewer_stats(self, event):
+        # Only the ESP32's consumer is in the control group
+        self.quality.report(event['viewer'], event['latency'], event['drop_rate'])
+        if self.quality.update():
+            print(f"Camera '{self.stream.robot_id}' -> {self.quality.command()}")
+            await self.send(text_data=self.quality.command())
+
+    def offer(self, frame):
+        if self.pending_frame is not None:
+            # The browser hasn't taken the last frame yet, drop it
+            self.frames_dropped += 1
+        self.pending_frame = frame
+        self.pending_since = time.perf_counter()
+        self.frame_ready.set()
+
+    async def send_frames(self):
+        # One sender per browser, so a slow one only delays itself
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            frame, self.pending_frame = self.pending_frame, None
+            start = time.perf_counter()
+            self.metrics.observe('camera_queue_seconds', start - self.pending_since)
             try:
-                await browser.send(text_data=frame_base64)
-            except:
+                if self.base64_frames:
+                    encoded = frame.encode_time is None
+                    data = frame.base64
+                    if encoded:
+                        # Only the first browser to need it pays for the encoding
+                        self.metrics.observe('camera_encode_seconds', frame.encode_time)
+                        start = time.perf_counter()
+                    await self.send(text_data=data)
+                else:
+                    await self.send(bytes_data=frame.jpeg)
+            except Exception:
                 # If a browser disconnected, remove it
-                connected_browsers.discard(browser)
\ No newline at end of file
+                self.stream.viewers.discard(self)
+                return
+            self.metrics.observe('camera_send_seconds', time.perf_counter() - start)
+            self.frames_sent += 1
+            self.sent_ingest_times.append(frame.timestamp)
+            latency = time.time() - frame.timestamp
+            self.metrics.observe('camera_server_latency_seconds', latency)
+            self.latency += 0.2 * (latency - self.latency)
+            if time.monotonic() - self._stats_time >= STATS_INTERVAL:
+                await self.report_stats()
+
+    async def report_stats(self):
+        sent = self.frames_sent - self._stats_sent
+        dropped = self.frames_dropped - self._stats_dropped
+        self._stats_time = time.monotonic()
+        self._stats_sent = self.frames_sent
+        self._stats_dropped = self.frames_dropped
+        if ADAPTIVE_QUALITY:
+            await self.channel_layer.group_send(self.stream.control_group, {
+                'type': 'camera.viewer_stats',
+                'viewer': self.channel_name,
+                'latency': self.latency,
+                'drop_rate': dropped / max(sent + dropped, 1),
+            })
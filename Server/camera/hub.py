@@ -0,0 +1,206 @@
+import asyncio
+import base64
+import time
+import zlib
+
+from channels.layers import get_channel_layer
+
+from .metrics import StageMetrics
+from .recorder import recorder_for
+
+# Robot id used by the old single-camera URL ws/camera/
+DEFAULT_ROBOT = 'default'
+
+# How long a worker without the ESP32 or any browser keeps receiving a
+# stream after an HTTP request for it, so polling stays cheap
+FOLLOW_SECONDS = 30
+
+# A stream nothing has used on this worker for this long (no ESP32,
+# browser, follower or HTTP request) is dropped, so requests for made up
+# robot ids don't pile up; looked for at most every STREAM_SWEEP_SECONDS
+STREAM_IDLE_SECONDS = 300
+STREAM_SWEEP_SECONDS = 10
+
+# No frame for this long and the stream's frame rate reads 0
+FPS_STALE_SECONDS = 2.0
+
+
+class Frame:
+    """One JPEG from the ESP32, shared by every browser it is sent to."""
+
+    def __init__(self, jpeg, frame_id=None, timestamp=None):
+        self.jpeg = jpeg
+        self.frame_id = frame_id
+        # Wall clock time the relay got the frame from the ESP32
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self._base64 = None
+        # Seconds it took to build .base64, None until then
+        self.encode_time = None
+
+    @property
+    def size(self):
+        return len(self.jpeg)
+
+    @property
+    def etag(self):
+        camera, seq = self.frame_id
+        return f'"{zlib.crc32(camera.encode()):08x}-{seq}"'
+
+    @property
+    def base64(self):
+        # Only built once per frame, and only if a browser needs it
+        if self._base64 is None:
+            start = time.perf_counter()
+            self._base64 = base64.b64encode(self.jpeg).decode('ascii')
+            self.encode_time = time.perf_counter() - start
+        return self._base64
+
+
+class CameraStream:
+    """One robot's camera: its browsers on this worker, last frame and frame rate."""
+
+    def __init__(self, robot_id):
+        self.robot_id = robot_id
+        self.group = f'camera_{robot_id}'
+        # Viewer stats for the ESP32's quality controller
+        self.control_group = f'camera_{robot_id}_control'
+        self.viewers = set()
+        self.cameras = 0
+        # FrameRecorder, fed by the worker the ESP32 is connected to
+        self.recorder = None
+        self.last_frame = None
+        # Highest seq seen from each camera (ESP32 connection)
+        self.newest_seq = {}
+        self.waiters = []
+        self.follower = None
+        self.follow_until = 0.0
+        self.last_used = time.monotonic()
+        # For /camera/metrics: frames this worker got, and their rate
+        self.frames_received = 0
+        self._fps = 0.0
+        self._last_frame_at = None
+        # Latency histograms: the ESP32's ingest here, and browsers that left
+        self.metrics = StageMetrics()
+        self.closed_viewer_metrics = StageMetrics()
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+
+    def add_frame(self, jpeg, frame_id, timestamp=None):
+        """
+        Return the Frame for frame_id, the same object for every local
+        browser, or None if a newer frame from that camera is already in:
+        a browser's copy of the group message can come after another one's.
+        """
+        frame = self.last_frame
+        if frame is not None and frame.frame_id == frame_id:
+            return frame
+        camera, seq = frame_id
+        if seq <= self.newest_seq.get(camera, 0):
+            return None
+        self.newest_seq[camera] = seq
+
+        frame = Frame(jpeg, frame_id, timestamp)
+        self.last_frame = frame
+        self.frames_received += 1
+
+        if self.waiters:
+            waiters, self.waiters = self.waiters, []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(frame)
+
+        # Frame rate over roughly the last second
+        self._window_frames += 1
+        now = self._last_frame_at = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._fps = self._window_frames / (now - self._window_start)
+            self._window_start = now
+            self._window_frames = 0
+        return frame
+
+    @property
+    def fps(self):
+        """Frames per second lately, 0 once the camera has gone quiet."""
+        if self._last_frame_at is None or time.monotonic() - self._last_frame_at > FPS_STALE_SECONDS:
+            return 0.0
+        return self._fps
+
+    async def next_frame(self, timeout=None):
+        """Wait for the frame after the current one."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def follow(self, seconds=FOLLOW_SECONDS):
+        """
+        Make sure this worker gets the stream's frames for a while, even
+        when the ESP32 and every browser are on other Daphne workers.
+        Returns False if frames weren't arriving here until now.
+        """
+        self.last_used = time.monotonic()
+        self.follow_until = self.last_used + seconds
+        if self.cameras or self.viewers:
+            return True
+        if self.follower is not None and not self.follower.done():
+            return True
+        self.follower = asyncio.create_task(self._follow())
+        return False
+
+    def idle(self, now):
+        if self.cameras or self.viewers or self.waiters:
+            return False
+        if self.follower is not None and not self.follower.done():
+            return False
+        return now - self.last_used > STREAM_IDLE_SECONDS
+
+    async def _follow(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(self.group, channel)
+        try:
+            while True:
+                remaining = self.follow_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(layer.receive(channel), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                self.add_frame(event['jpeg'], (event['camera'], event['seq']), event['time'])
+        finally:
+            await layer.group_discard(self.group, channel)
+
+
+# Every camera stream this worker is using, by robot id
+streams = {}
+_last_sweep = 0.0
+
+
+def find_stream(robot_id):
+    """The robot's stream if this worker has it, else None."""
+    return streams.get(robot_id)
+
+
+def get_stream(robot_id):
+    stream = streams.get(robot_id)
+    if stream is None:
+        sweep()
+        stream = streams[robot_id] = CameraStream(robot_id)
+        stream.recorder = recorder_for(robot_id)
+    stream.last_used = time.monotonic()
+    return stream
+
+
+def sweep(now=None):
+    """Drop the streams that have been idle for STREAM_IDLE_SECONDS."""
+    global _last_sweep
+    now = time.monotonic() if now is None else now
+    if now - _last_sweep < STREAM_SWEEP_SECONDS:
+        return
+    _last_sweep = now
+    for robot_id in [robot_id for robot_id, stream in streams.items() if stream.idle(now)]:
+        del streams[robot_id]
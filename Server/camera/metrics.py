@@ -0,0 +1,106 @@
+import bisect
+import os
+
+# Histogram bucket upper bounds, seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Where a frame's time goes, in pipeline order. The ESP32 has no clock we
+# share, so its capture and uplink only show up as jitter in the interval.
+STAGES = {
+    'camera_frame_interval_seconds': "Time between frames from the ESP32 (capture and uplink jitter)",
+    'camera_ingest_seconds': "Relay handling of one ESP32 frame until it is on the channel layer",
+    'camera_fanout_seconds': "Ingest until the viewer's consumer got the frame from the channel layer",
+    'camera_queue_seconds': "Time the frame waited in the viewer's outbox",
+    'camera_encode_seconds': "Base64 encoding of one frame",
+    'camera_send_seconds': "Writing one frame to the viewer's WebSocket",
+    'camera_server_latency_seconds': "Ingest until the frame was sent to the viewer",
+    'camera_browser_decode_seconds': "Browser time from the frame arriving to it being on screen",
+    'camera_render_latency_seconds': "Ingest until the browser said it rendered the frame",
+}
+
+
+# Per stream gauges and counters: (name, type, help, value of a CameraStream)
+STREAM_VALUES = (
+    ('camera_frames_received_total', 'counter', "Frames from the ESP32 this worker got for the stream",
+     lambda stream: stream.frames_received),
+    ('camera_fps', 'gauge', "Frames per second from the ESP32 lately, 0 once it has gone quiet",
+     lambda stream: stream.fps),
+)
+
+
+class Histogram:
+    """Prometheus style histogram, counts per bucket plus sum and count."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class StageMetrics:
+    """Histograms by stage name, for one camera or one viewer."""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+
+def exposition(streams):
+    """
+    Prometheus text format for every stream on this worker. Viewers that
+    left are added up under viewer="closed" so the counters never go back.
+    """
+    series = {name: [] for name in STAGES}
+    values = {name: [] for name, _, _, _ in STREAM_VALUES}
+    pid = os.getpid()
+    for stream in streams.values():
+        labels = f'robot="{stream.robot_id}",worker="{pid}"'
+        for name, _, _, value in STREAM_VALUES:
+            values[name].append((labels, value(stream)))
+        for name, histogram in stream.metrics.histograms.items():
+            series[name].append((labels, histogram))
+        viewer_sets = [('closed', stream.closed_viewer_metrics)]
+        viewer_sets += [(str(viewer.viewer_id), viewer.metrics) for viewer in stream.viewers]
+        for viewer_id, metrics in viewer_sets:
+            for name, histogram in metrics.histograms.items():
+                series[name].append((f'{labels},viewer="{viewer_id}"', histogram))
+
+    lines = []
+    for name, help_text in STAGES.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series[name]:
+            lines.extend(histogram.lines(name, labels))
+    for name, kind, help_text, _ in STREAM_VALUES:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{{{labels}}} {value:g}' for labels, value in values[name])
+    return '\n'.join(lines) + '\n'
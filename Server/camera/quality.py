@@ -0,0 +1,120 @@
+import time
+
+# ESP32-CAM settings the controller moves between, worst to best.
+# Quality is the ESP32 JPEG quality: 63 is the most compression.
+FRAMESIZES = ['QQVGA', 'HQVGA', 'QVGA', 'CIF', 'VGA']
+QUALITIES = [63, 50, 40, 30, 20]
+
+# Rough JPEG size of a setting, to put the levels in order of bytes
+PIXELS = {'QQVGA': 160 * 120, 'HQVGA': 240 * 176, 'QVGA': 320 * 240, 'CIF': 400 * 296, 'VGA': 640 * 480}
+BYTES_PER_PIXEL = {63: 0.05, 50: 0.12, 40: 0.18, 30: 0.23, 20: 0.29}
+
+
+def expected_bytes(framesize, quality):
+    return int(PIXELS[framesize] * BYTES_PER_PIXEL[quality])
+
+
+def ladder():
+    """
+    Each framesize from its worst quality up, leaving out the settings
+    that are no bigger than the one before: a step up always costs more
+    bytes (QQVGA/20 is bigger than HQVGA/63).
+    """
+    levels = []
+    for framesize in FRAMESIZES:
+        for quality in QUALITIES:
+            if not levels or expected_bytes(framesize, quality) > expected_bytes(*levels[-1]):
+                levels.append((framesize, quality))
+    return levels
+
+
+LEVELS = ladder()
+
+# Viewer reports older than this are ignored (the viewer probably left)
+REPORT_TIMEOUT = 3.0
+
+
+class QualityController:
+    """
+    Steps one ESP32's framesize/quality down when the viewers fall behind
+    and back up when they have room to spare.
+
+    Viewers report their frame latency (seconds from ingest to sent) and
+    the share of frames they had to drop. The controller looks at the
+    90th percentile viewer, so one bad link doesn't drag everybody down.
+    """
+
+    def __init__(self, target_latency=0.25, max_drop_rate=0.2, framesize='QQVGA',
+                 quality=63, cooldown=2.0, up_after=3.0, retry_after=30.0):
+        self.target_latency = target_latency
+        self.max_drop_rate = max_drop_rate
+        self.cooldown = cooldown
+        self.up_after = up_after
+        self.retry_after = retry_after
+        self.level = LEVELS.index((framesize, quality))
+        self.reports = {}
+        self._last_change = 0.0
+        self._good_since = None
+        # Level that was too much -> when it may be tried again
+        self._too_high = {}
+
+    @property
+    def framesize(self):
+        return LEVELS[self.level][0]
+
+    @property
+    def quality(self):
+        return LEVELS[self.level][1]
+
+    def command(self):
+        """Control message for the ESP32, same parameters as its HTTP /set."""
+        return f'framesize={self.framesize}&quality={self.quality}'
+
+    def report(self, viewer, latency, drop_rate, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.reports[viewer] = (latency, drop_rate, now)
+
+    def update(self, now=None):
+        """Returns True if the ESP32 should get a new command()."""
+        if now is None:
+            now = time.monotonic()
+        for viewer, (_, _, at) in list(self.reports.items()):
+            if now - at >= REPORT_TIMEOUT:
+                del self.reports[viewer]
+        reports = [(latency, drops) for latency, drops, _ in self.reports.values()]
+        if not reports or now - self._last_change < self.cooldown:
+            return False
+
+        latencies = sorted(r[0] for r in reports)
+        drop_rates = sorted(r[1] for r in reports)
+        p90 = int(len(reports) * 0.9)
+        latency = latencies[min(p90, len(reports) - 1)]
+        drop_rate = drop_rates[min(p90, len(reports) - 1)]
+
+        if latency > self.target_latency or drop_rate > self.max_drop_rate:
+            self._good_since = None
+            if self.level > 0:
+                # Don't bounce straight back up to a level that didn't work
+                self._too_high[self.level] = now + self.retry_after
+                return self._step(-1, now)
+            return False
+
+        # Only go up when latency has stayed well under the target
+        if latency < self.target_latency / 2 and drop_rate < self.max_drop_rate / 2:
+            if self._good_since is None:
+                self._good_since = now
+            elif (now - self._good_since >= self.up_after and self.level < len(LEVELS) - 1
+                  and self._too_high.get(self.level + 1, 0) <= now):
+                self._good_since = None
+                return self._step(1, now)
+        else:
+            self._good_since = None
+        return False
+
+    def _step(self, direction, now):
+        self.level += direction
+        self._last_change = now
+        # Old reports describe the old setting
+        self.reports.clear()
+        return True
@@ -0,0 +1,224 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import os
+import struct
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# Segment files, per robot:
+#   <start_ms>.mjpeg   the JPEGs back to back (ffplay -f mjpeg can play it)
+#   <start_ms>.idx     one entry per frame: timestamp, offset, length
+INDEX_ENTRY = struct.Struct('<dII')
+
+# Frames waiting for the disk before the oldest ones are dropped
+MAX_PENDING_FRAMES = 600
+
+
+class FrameRecorder:
+    """
+    Records one robot's camera to rolling segment files.
+
+    add() only queues the frame, the files are written in batches on a
+    worker thread so the event loop (and the ESP32 ingest) never waits
+    on the disk.
+    """
+
+    def __init__(self, directory, segment_seconds=60, retention_seconds=24 * 3600,
+                 batch_frames=30, flush_interval=1.0):
+        self.directory = Path(directory)
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        self.batch_frames = batch_frames
+        self.flush_interval = flush_interval
+
+        self.pending = collections.deque()
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self._wake = None
+        self._writer = None
+        self._flush_lock = None
+        self._closing = False
+
+        # Only touched from the writer thread
+        self._segment_start = None
+        self._data_file = None
+        self._index_file = None
+        self._offset = 0
+        self._last_retention = 0.0
+
+    # -----------------------------
+    # Recording
+    # -----------------------------
+    def add(self, frame):
+        if self._writer is None:
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._closing = False
+            self._writer = asyncio.create_task(self._write_loop())
+        if len(self.pending) >= MAX_PENDING_FRAMES:
+            # The disk can't keep up, lose the oldest frame, not the newest
+            self.pending.popleft()
+            self.frames_dropped += 1
+        self.pending.append((frame.timestamp, frame.jpeg))
+        if len(self.pending) >= self.batch_frames:
+            self._wake.set()
+
+    async def _write_loop(self):
+        # wait_for() can swallow a cancel that lands as the wait ends, so close() sets this too
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            return
+        # One batch on the disk at a time, in order
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self.pending:
+            return
+        batch = list(self.pending)
+        self.pending.clear()
+        write = asyncio.ensure_future(asyncio.to_thread(self._write_batch, batch))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # The thread can't be stopped, so hold the lock until it's done
+            await write
+            raise
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._closing = True
+        self._writer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._writer
+        async with self._flush_lock:
+            await self._flush()
+            await asyncio.to_thread(self._close_segment)
+        self._writer = None
+
+    def _write_batch(self, batch):
+        entries = []
+        chunks = []
+        for timestamp, jpeg in batch:
+            if self._data_file is None or timestamp - self._segment_start >= self.segment_seconds:
+                self._write_out(chunks, entries)
+                chunks, entries = [], []
+                self._open_segment(timestamp)
+            entries.append(INDEX_ENTRY.pack(timestamp, self._offset, len(jpeg)))
+            chunks.append(jpeg)
+            self._offset += len(jpeg)
+        self._write_out(chunks, entries)
+        self.frames_written += len(batch)
+
+        if time.time() - self._last_retention > 60:
+            self._last_retention = time.time()
+            self.apply_retention()
+
+    def _write_out(self, chunks, entries):
+        if not chunks:
+            return
+        # Data first, so every index entry points at bytes already on disk
+        self._data_file.writelines(chunks)
+        self._data_file.flush()
+        self._index_file.write(b''.join(entries))
+        self._index_file.flush()
+        self.bytes_written += sum(len(c) for c in chunks)
+
+    def _open_segment(self, timestamp):
+        self._close_segment()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = str(int(timestamp * 1000))
+        self._segment_start = timestamp
+        self._data_file = open(self.directory / f'{name}.mjpeg', 'ab')
+        self._index_file = open(self.directory / f'{name}.idx', 'ab')
+        self._offset = self._data_file.tell()
+
+    def _close_segment(self):
+        if self._data_file is not None:
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = self._index_file = None
+
+    def apply_retention(self, now=None):
+        """Delete segments that haven't been written to for retention_seconds."""
+        cutoff = (now or time.time()) - self.retention_seconds
+        for start in self.segments():
+            index_path = self.directory / f'{start}.idx'
+            try:
+                if index_path.stat().st_mtime >= cutoff:
+                    continue
+                index_path.unlink()
+                (self.directory / f'{start}.mjpeg').unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+
+    # -----------------------------
+    # Playback
+    # -----------------------------
+    def segments(self):
+        """Start times (ms) of the segments on disk, oldest first."""
+        if not self.directory.is_dir():
+            return []
+        return sorted(int(p.stem) for p in self.directory.glob('*.idx'))
+
+    def _read_index(self, start):
+        with open(self.directory / f'{start}.idx', 'rb') as f:
+            data = f.read()
+        # Ignore a half written last entry
+        data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+        return list(INDEX_ENTRY.iter_unpack(data))
+
+    def frame_at(self, timestamp):
+        """(timestamp, jpeg) of the last frame recorded at or before timestamp, or None."""
+        segments = self.segments()
+        i = bisect.bisect_right(segments, timestamp * 1000) - 1
+        while i >= 0:
+            index = self._read_index(segments[i])
+            j = bisect.bisect_right([entry[0] for entry in index], timestamp) - 1
+            if j >= 0:
+                frame_time, offset, length = index[j]
+                with open(self.directory / f'{segments[i]}.mjpeg', 'rb') as f:
+                    f.seek(offset)
+                    return frame_time, f.read(length)
+            i -= 1
+        return None
+
+    def frames_from(self, timestamp):
+        """Yield (timestamp, jpeg) for every recorded frame from timestamp on."""
+        segments = self.segments()
+        i = max(bisect.bisect_right(segments, timestamp * 1000) - 1, 0)
+        for start in segments[i:]:
+            index = self._read_index(start)
+            j = bisect.bisect_left([entry[0] for entry in index], timestamp)
+            if j == len(index):
+                continue
+            with open(self.directory / f'{start}.mjpeg', 'rb') as f:
+                for frame_time, offset, length in index[j:]:
+                    f.seek(offset)
+                    yield frame_time, f.read(length)
+
+
+def recorder_for(robot_id):
+    """A FrameRecorder for the robot if CAMERA_RECORD_DIR is set, else None."""
+    directory = getattr(settings, 'CAMERA_RECORD_DIR', None)
+    if not directory:
+        return None
+    return FrameRecorder(
+        os.path.join(directory, robot_id),
+        segment_seconds=getattr(settings, 'CAMERA_RECORD_SEGMENT_SECONDS', 60),
+        retention_seconds=getattr(settings, 'CAMERA_RECORD_RETENTION_HOURS', 24) * 3600,
+    )
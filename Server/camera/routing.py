@@ -1,6 +1,13 @@
-from django.urls import path
+from django.urls import path, re_path
 from .consumers import CameraConsumer
+from .hub import DEFAULT_ROBOT
+
+# Robot ids end up in channel layer group names, so keep them to ASCII
+ROBOT_ID = r'(?P<robot_id>[-a-zA-Z0-9_]{1,64})'
 
 websocket_urlpatterns = [
-    path('ws/camera/', CameraConsumer.as_asgi()),
-]
\ No newline at end of file
+    re_path(rf'^ws/camera/{ROBOT_ID}/publish/?$', CameraConsumer.as_asgi(), {'role': 'publish'}),
+    re_path(rf'^ws/camera/{ROBOT_ID}/view/?$', CameraConsumer.as_asgi(), {'role': 'view'}),
+    # Old single-camera URL, shared by the ESP32 and the browsers
+    path('ws/camera/', CameraConsumer.as_asgi(), {'robot_id': DEFAULT_ROBOT}),
+]
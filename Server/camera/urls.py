@@ -1,8 +1,14 @@
-from django.urls import path
+from django.urls import path, re_path
 
 from . import views
+from .routing import ROBOT_ID
 
 
 urlpatterns = [
     path('view/', views.view_camera, name='view_camera'),
+    path('camera/metrics', views.metrics, name='camera_metrics'),
+    re_path(rf'^camera/{ROBOT_ID}/latest\.jpg$', views.latest_frame, name='latest_frame'),
+    re_path(rf'^camera/{ROBOT_ID}/stream\.mjpg$', views.mjpeg_stream, name='mjpeg_stream'),
+    re_path(rf'^camera/{ROBOT_ID}/recording\.jpg$', views.recorded_frame, name='recorded_frame'),
+    re_path(rf'^camera/{ROBOT_ID}/recording\.mjpg$', views.recorded_stream, name='recorded_stream'),
 ]
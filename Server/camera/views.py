@@ -1,5 +1,151 @@
+import asyncio
+import time
+
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.http import http_date, parse_etags
+
+from . import hub
+from .hub import find_stream, get_stream
+from .metrics import exposition
+from .recorder import recorder_for
+
+# How long latest.jpg waits for a fresh frame on a worker that wasn't
+# receiving the stream yet
+LATEST_FRAME_WAIT = 1.0
+
+MJPEG_BOUNDARY = 'frame'
+
+# A cached frame older than this doesn't start an MJPEG stream
+MJPEG_FIRST_FRAME_MAX_AGE = 10
+
 
 # Create your views here.
 def view_camera(request):
-    return render(request, 'webPage.html')
\ No newline at end of file
+    return render(request, 'webPage.html')
+
+
+async def latest_frame(request, robot_id):
+    """Newest JPEG of one robot's camera. Polling with If-None-Match gets a 304 until it changes."""
+    stream = get_stream(robot_id)
+    if not stream.follow():
+        # Don't serve an old cached frame from a worker that just woke up
+        try:
+            await stream.next_frame(timeout=LATEST_FRAME_WAIT)
+        except asyncio.TimeoutError:
+            pass
+
+    frame = stream.last_frame
+    if frame is None:
+        raise Http404("No frame from this camera yet")
+
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if frame.etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(frame.jpeg, content_type='image/jpeg')
+    response['ETag'] = frame.etag
+    response['Last-Modified'] = http_date(frame.timestamp)
+    response['Cache-Control'] = 'no-cache'
+    response['X-Frame-Size'] = str(frame.size)
+    return response
+
+
+async def mjpeg_stream(request, robot_id):
+    """
+    One robot's camera as multipart/x-mixed-replace, for <img> tags,
+    ffmpeg and OpenCV. No Base64 and no JavaScript.
+    """
+    stream = get_stream(robot_id)
+    return StreamingHttpResponse(
+        mjpeg_frames(stream),
+        content_type=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}',
+        headers={'Cache-Control': 'no-cache'},
+    )
+
+
+def mjpeg_part_header(size):
+    return (f'\r\n--{MJPEG_BOUNDARY}\r\n'
+            f'Content-Type: image/jpeg\r\n'
+            f'Content-Length: {size}\r\n\r\n').encode()
+
+
+async def mjpeg_frames(stream):
+    frame = stream.last_frame
+    if frame is not None and time.time() - frame.timestamp > MJPEG_FIRST_FRAME_MAX_AGE:
+        frame = None
+    while True:
+        if frame is not None:
+            # The JPEG itself is yielded as is, every viewer shares the same bytes
+            yield mjpeg_part_header(frame.size)
+            yield frame.jpeg
+        stream.follow()
+        try:
+            frame = await stream.next_frame(timeout=5)
+        except asyncio.TimeoutError:
+            frame = None    # camera is quiet, keep the connection open
+
+
+async def metrics(request):
+    """
+    Frame latency histograms of this worker, in Prometheus text format.
+    Async so it reads the streams and their viewers on the event loop,
+    which changes them, not from a worker thread.
+    """
+    return HttpResponse(exposition(hub.streams), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def get_recorder(robot_id):
+    stream = find_stream(robot_id)
+    # Recordings outlive the stream: read them without adding one
+    recorder = stream.recorder if stream is not None else recorder_for(robot_id)
+    if recorder is None:
+        raise Http404("Recording is off (set CAMERA_RECORD_DIR)")
+    return recorder
+
+
+async def recorded_frame(request, robot_id):
+    """Recorded frame at ?t=<unix time>."""
+    recorder = get_recorder(robot_id)
+    try:
+        timestamp = float(request.GET['t'])
+    except (KeyError, ValueError):
+        return HttpResponse("Give the time as ?t=<unix time>", status=400)
+    found = await asyncio.to_thread(recorder.frame_at, timestamp)
+    if found is None:
+        raise Http404("Nothing recorded before that time")
+    frame_time, jpeg = found
+    response = HttpResponse(jpeg, content_type='image/jpeg')
+    response['Last-Modified'] = http_date(frame_time)
+    response['X-Frame-Time'] = f'{frame_time:.3f}'
+    return response
+
+
+async def recorded_stream(request, robot_id):
+    """Replay of the recording as MJPEG, in real time from ?start=<unix time>."""
+    recorder = get_recorder(robot_id)
+    try:
+        start = float(request.GET.get('start', time.time() - 60))
+    except ValueError:
+        return HttpResponse("Give the start as ?start=<unix time>", status=400)
+    return StreamingHttpResponse(
+        replay_frames(recorder, start),
+        content_type=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}',
+        headers={'Cache-Control': 'no-cache'},
+    )
+
+
+async def replay_frames(recorder, start):
+    frames = recorder.frames_from(start)
+    previous = None
+    while True:
+        # File reads stay off the event loop
+        found = await asyncio.to_thread(next, frames, None)
+        if found is None:
+            return
+        frame_time, jpeg = found
+        if previous is not None:
+            await asyncio.sleep(min(max(frame_time - previous, 0), 1.0))
+        previous = frame_time
+        yield mjpeg_part_header(len(jpeg))
+        yield jpeg
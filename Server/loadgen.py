@@ -0,0 +1,331 @@
+# Synthetic load for the camera relay, to run before every deploy.
+#
+# N simulated ESP32s publish JPEG sequences (random or recorded) at a set
+# fps, one robot each. M simulated browsers watch them, check that every
+# robot's frames arrive in order and measure ingest-to-browser latency.
+# The result is a JSON report; the exit code is 1 if the run failed.
+#
+#   python loadgen.py --publishers 4 --viewers 100 --seconds 30 --report report.json
+#   python loadgen.py --url ws://relay:8000 --server-pid 1234 --frames recording/robot1/1700000000000.mjpeg
+#
+# Without --url it starts its own Daphne worker(s) (see loadtest_workers.py).
+# Needs: websockets (and daphne for local workers)
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+from loadtest_workers import start_workers
+
+# Every frame carries a JPEG comment segment (FF FE) right after the start
+# of image: run id, publisher, sequence number and the send time.
+# Browsers ignore it, the relay passes it through untouched.
+MARKER = struct.Struct('>4sIId')
+COMMENT = b'\xff\xfe' + struct.pack('>H', MARKER.size + 2)
+
+
+# -----------------------------
+# Frames
+# -----------------------------
+def synthetic_frames(size, count=30):
+    return [b'\xff\xd8' + os.urandom(size - 4) + b'\xff\xd9' for _ in range(count)]
+
+
+def recorded_frames(path):
+    """JPEGs from a directory of .jpg files, or a recorder segment (.mjpeg + .idx)."""
+    path = Path(path)
+    if path.is_dir():
+        return [p.read_bytes() for p in sorted(path.glob('*.jp*g'))]
+    data = path.read_bytes()
+    index_path = path.with_suffix('.idx')
+    if index_path.exists():
+        entry = struct.Struct('<dII')   # camera/recorder.py INDEX_ENTRY
+        index = index_path.read_bytes()
+        index = index[:len(index) - len(index) % entry.size]
+        return [data[offset:offset + length] for _, offset, length in entry.iter_unpack(index)]
+    # Plain MJPEG: split on the start of image markers
+    return [b'\xff\xd8' + part for part in data.split(b'\xff\xd8')[1:]]
+
+
+def stamp(jpeg, run_id, publisher, seq):
+    return jpeg[:2] + COMMENT + MARKER.pack(run_id, publisher, seq, time.time()) + jpeg[2:]
+
+
+def read_stamp(message):
+    if isinstance(message, str):
+        # Base64 viewers: only the start is needed
+        need = 2 + len(COMMENT) + MARKER.size
+        message = base64.b64decode(message[:4 * (need // 3 + 1)])
+    if message[2:4] != b'\xff\xfe':
+        return None
+    return MARKER.unpack_from(message, 2 + len(COMMENT))
+
+
+# -----------------------------
+# Publishers (simulated ESP32s)
+# -----------------------------
+async def publish(url, frames, run_id, publisher, fps, seconds):
+    sent = 0
+    sent_bytes = 0
+    async with websockets.connect(url, max_size=None) as ws:
+        # framesize/quality messages from the relay aren't acted on
+        drain = asyncio.create_task(drain_messages(ws))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while loop.time() - start < seconds:
+            frame = stamp(frames[sent % len(frames)], run_id, publisher, sent)
+            await ws.send(frame)
+            sent += 1
+            sent_bytes += len(frame)
+            await asyncio.sleep(max(0.0, start + sent / fps - loop.time()))
+        drain.cancel()
+    return sent, sent_bytes
+
+
+async def drain_messages(ws):
+    async for _ in ws:
+        pass
+
+
+# -----------------------------
+# Viewers (simulated browsers)
+# -----------------------------
+async def view(url, run_id, seconds):
+    result = {'frames': 0, 'bytes': 0, 'out_of_order': 0, 'duplicates': 0,
+              'skipped': 0, 'latencies': []}
+    last_seq = {}
+    async with websockets.connect(url, max_size=None) as ws:
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(ws.recv(), remaining)
+            except asyncio.TimeoutError:
+                break
+            received = time.time()
+            marker = read_stamp(message)
+            if marker is None or marker[0] != run_id:
+                continue    # the relay's cached frame from an earlier run
+            _, publisher, seq, sent_at = marker
+            result['frames'] += 1
+            result['bytes'] += len(message)
+            result['latencies'].append(received - sent_at)
+            previous = last_seq.get(publisher)
+            if previous is not None:
+                if seq == previous:
+                    result['duplicates'] += 1
+                elif seq < previous:
+                    result['out_of_order'] += 1
+                else:
+                    # Slow viewers are allowed to skip frames, not reorder them
+                    result['skipped'] += seq - previous - 1
+            last_seq[publisher] = max(seq, previous if previous is not None else seq)
+    return result
+
+
+async def view_many(urls, run_id, seconds):
+    return await asyncio.gather(*(view(url, run_id, seconds) for url in urls))
+
+
+def viewer_process(urls, run_id, seconds):
+    # Client side runs in several processes, so it isn't the bottleneck
+    return asyncio.run(view_many(urls, run_id, seconds))
+
+
+# -----------------------------
+# Server memory
+# -----------------------------
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            return None
+    return total
+
+
+async def sample_rss(pids, samples, interval=0.5):
+    while True:
+        rss = rss_bytes(pids)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(interval)
+
+
+# -----------------------------
+# Run
+# -----------------------------
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_publishers(args, frames, run_id, pids, rss_samples):
+    sampler = asyncio.create_task(sample_rss(pids, rss_samples)) if pids else None
+    results = await asyncio.gather(*(
+        publish(f'{args.base_urls[0]}/ws/camera/{args.robot_prefix}{i}/publish',
+                frames, run_id, i, args.fps, args.seconds)
+        for i in range(args.publishers)))
+    # Keep sampling while the viewers catch the tail
+    await asyncio.sleep(args.tail)
+    if sampler is not None:
+        sampler.cancel()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic load generator for the camera relay")
+    parser.add_argument('--url', action='append', dest='urls',
+                        help="relay to test, e.g. ws://127.0.0.1:8000 (repeat for several workers); "
+                             "default: start local Daphne workers")
+    parser.add_argument('--workers', type=int, default=1, help="local Daphne workers to start")
+    parser.add_argument('--server-pid', type=int, action='append', default=[],
+                        help="relay process to measure RSS of, when using --url")
+    parser.add_argument('--publishers', type=int, default=1)
+    parser.add_argument('--viewers', type=int, default=10)
+    parser.add_argument('--fps', type=float, default=20)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--frames', help="directory of .jpg files or a recorded .mjpeg segment")
+    parser.add_argument('--frame-size', type=int, default=8000, help="synthetic frame size, bytes")
+    parser.add_argument('--format', choices=['binary', 'base64'], default='binary')
+    parser.add_argument('--client-procs', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--robot-prefix', default='loadgen')
+    parser.add_argument('--base-port', type=int, default=8300)
+    parser.add_argument('--tail', type=float, default=2.0, help="seconds viewers stay after the publishers")
+    parser.add_argument('--max-p99', type=float, help="fail if p99 latency is over this (ms)")
+    parser.add_argument('--report', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    if args.publishers < 1:
+        parser.error("--publishers must be at least 1")
+    if args.viewers < 0:
+        parser.error("--viewers can't be negative")
+
+    frames = recorded_frames(args.frames) if args.frames else synthetic_frames(args.frame_size)
+    if not frames:
+        sys.exit(f"No frames found in {args.frames}")
+    run_id = os.urandom(4)
+
+    workers = []
+    if args.urls:
+        args.base_urls = [url.rstrip('/') for url in args.urls]
+        pids = args.server_pid
+    else:
+        if args.workers > 1 and not os.environ.get('CAMERA_REDIS_URL'):
+            sys.exit("More than one worker needs a shared channel layer: set CAMERA_REDIS_URL")
+        workers = start_workers(args.workers, args.base_port)
+        args.base_urls = [f'ws://127.0.0.1:{args.base_port + i}' for i in range(args.workers)]
+        pids = [worker.pid for worker in workers]
+
+    query = '?format=base64' if args.format == 'base64' else ''
+    viewer_urls = [f'{args.base_urls[i % len(args.base_urls)]}/ws/camera/'
+                   f'{args.robot_prefix}{i % args.publishers}/view{query}'
+                   for i in range(args.viewers)]
+    chunks = [viewer_urls[i::args.client_procs] for i in range(args.client_procs)]
+    chunks = [chunk for chunk in chunks if chunk]
+
+    rss_samples = []
+    try:
+        rss_before = rss_bytes(pids) if pids else None
+        with multiprocessing.Pool(len(chunks)) as pool:
+            pending = pool.starmap_async(
+                viewer_process, [(chunk, run_id, args.seconds + args.tail + 1) for chunk in chunks])
+            time.sleep(1)   # let every viewer connect first
+            published = asyncio.run(run_publishers(args, frames, run_id, pids, rss_samples))
+            viewers = [result for chunk in pending.get() for result in chunk]
+        rss_after = rss_bytes(pids) if pids else None
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+    sent = sum(n for n, _ in published)
+    received = sum(v['frames'] for v in viewers)
+    latencies = [latency for v in viewers for latency in v['latencies']]
+    out_of_order = sum(v['out_of_order'] for v in viewers)
+    duplicates = sum(v['duplicates'] for v in viewers)
+    starved = sum(1 for v in viewers if not v['frames'])
+    p99 = percentile(latencies, 0.99)
+
+    failures = []
+    if out_of_order:
+        failures.append(f"{out_of_order} frame(s) out of order")
+    if duplicates:
+        failures.append(f"{duplicates} duplicate frame(s)")
+    if starved:
+        failures.append(f"{starved} viewer(s) got no frames")
+    if args.max_p99 is not None and (p99 is None or p99 * 1000 > args.max_p99):
+        failures.append(f"p99 latency over {args.max_p99} ms")
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    def mb(value):
+        return None if value is None else round(value / 1e6, 1)
+
+    report = {
+        'config': {
+            'servers': args.base_urls, 'publishers': args.publishers, 'viewers': args.viewers,
+            'fps': args.fps, 'seconds': args.seconds, 'format': args.format,
+            'frames': args.frames or f'synthetic {args.frame_size} bytes',
+        },
+        'published': {
+            'frames': sent,
+            'fps': round(sent / args.seconds, 1),
+            'mbit_per_s': round(sum(b for _, b in published) * 8 / args.seconds / 1e6, 2),
+        },
+        'delivered': {
+            'frames': received,
+            'frames_per_s': round(received / args.seconds, 1),
+            'mbit_per_s': round(sum(v['bytes'] for v in viewers) * 8 / args.seconds / 1e6, 2),
+            'per_viewer_min': min(v['frames'] for v in viewers),
+            'per_viewer_max': max(v['frames'] for v in viewers),
+            # Skipped frames are the relay dropping for slow viewers, not errors
+            'skipped': sum(v['skipped'] for v in viewers),
+            'out_of_order': out_of_order,
+            'duplicates': duplicates,
+            'viewers_without_frames': starved,
+        },
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 0.5)),
+            'p90': ms(percentile(latencies, 0.9)),
+            'p99': ms(p99),
+            'max': ms(max(latencies) if latencies else None),
+        },
+        'server_rss_mb': {
+            'before': mb(rss_before),
+            'peak': mb(max(rss_samples) if rss_samples else None),
+            'after': mb(rss_after),
+        },
+        'failures': failures,
+        'passed': not failures,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(text + '\n')
+        print(f"Report written to {args.report}: {'PASS' if report['passed'] else 'FAIL'}")
+    else:
+        print(text)
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
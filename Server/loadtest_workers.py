@@ -0,0 +1,143 @@
+# Multi-process load test for the camera relay on one Linux box.
+#
+# Starts several Daphne workers sharing one channel layer, connects a
+# simulated ESP32 to the first worker and spreads simulated browsers over
+# all of them. Every browser should see the frames, whichever worker it
+# landed on.
+#
+#   redis-server --port 6379 &
+#   CAMERA_REDIS_URL=redis://127.0.0.1:6379 python loadtest_workers.py --workers 4 --viewers 200
+#
+# Needs: daphne, websockets (and channels_redis for more than one worker)
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_workers(count, base_port):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='server.settings')
+    workers = []
+    for i in range(count):
+        workers.append(subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(base_port + i),
+             'server.asgi:application'],
+            cwd=SERVER_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+    for i in range(count):
+        wait_for_port(base_port + i)
+    return workers
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Daphne worker on port {port} did not start")
+
+
+async def view(url, seconds):
+    frames = 0
+    async with websockets.connect(url, max_size=None) as ws:
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(ws.recv(), remaining)
+            except asyncio.TimeoutError:
+                break
+            frames += 1
+    return frames
+
+
+async def view_many(urls, seconds):
+    return await asyncio.gather(*(view(url, seconds) for url in urls))
+
+
+def viewer_process(urls, seconds):
+    # Client side runs in several processes too, so it isn't the bottleneck
+    return asyncio.run(view_many(urls, seconds))
+
+
+async def publish(url, fps, seconds, frame_size):
+    frame = b"\xff\xd8" + os.urandom(frame_size - 4) + b"\xff\xd9"
+    sent = 0
+    async with websockets.connect(url) as ws:
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            await ws.send(frame)
+            sent += 1
+            await asyncio.sleep(max(0.0, start + sent / fps - time.monotonic()))
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Camera relay multi-worker load test")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--viewers', type=int, default=100)
+    parser.add_argument('--client-procs', type=int, default=4)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--frame-size', type=int, default=6000)
+    parser.add_argument('--base-port', type=int, default=8200)
+    args = parser.parse_args()
+
+    if args.workers > 1 and not os.environ.get('CAMERA_REDIS_URL'):
+        sys.exit("More than one worker needs a shared channel layer: set CAMERA_REDIS_URL")
+
+    print(f"Starting {args.workers} Daphne worker(s)...")
+    workers = start_workers(args.workers, args.base_port)
+    try:
+        urls = [f"ws://127.0.0.1:{args.base_port + i % args.workers}/ws/camera/loadtest/view"
+                for i in range(args.viewers)]
+        chunks = [urls[i::args.client_procs] for i in range(args.client_procs)]
+        # Viewers stay a little longer than the publisher to catch the tail
+        view_seconds = args.seconds + 2
+
+        with multiprocessing.Pool(args.client_procs) as pool:
+            results = pool.starmap_async(viewer_process, [(c, view_seconds) for c in chunks])
+            time.sleep(1)   # let every viewer connect first
+            publish_url = f"ws://127.0.0.1:{args.base_port}/ws/camera/loadtest/publish"
+            sent = asyncio.run(publish(publish_url, args.fps, args.seconds, args.frame_size))
+            counts = [n for chunk in results.get() for n in chunk]
+        viewer_urls = [url for chunk in chunks for url in chunk]
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+    received = sum(counts)
+    print(f"Publisher sent {sent} frames ({sent / args.seconds:.1f} fps)")
+    print(f"Viewers: {len(counts)} | frames delivered: {received} "
+          f"({received / args.seconds:.0f} frames/s in total)")
+    print(f"Per viewer: min {min(counts)}  avg {received / len(counts):.1f}  max {max(counts)}")
+    for i in range(args.workers):
+        port = f":{args.base_port + i}/"
+        on_worker = [n for url, n in zip(viewer_urls, counts) if port in url]
+        if on_worker:
+            print(f"  worker {i}: {len(on_worker)} viewers, avg {sum(on_worker) / len(on_worker):.1f} frames")
+    missing = sum(1 for n in counts if n == 0)
+    if missing:
+        print(f"FAIL: {missing} viewer(s) got no frames")
+    else:
+        print("PASS: every viewer got frames")
+
+
+if __name__ == '__main__':
+    main()
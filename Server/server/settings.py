@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -128,3 +129,50 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ASGI_APPLICATION = 'server.asgi.application'
+
+# Camera relay
+# Send frames to browsers as Base64 text (old pages) instead of binary JPEG
+
+CAMERA_BASE64_FRAMES = False
+
+# Step the ESP32's framesize/quality so viewers stay under this latency (s)
+
+CAMERA_ADAPTIVE_QUALITY = True
+CAMERA_TARGET_LATENCY = 0.25
+
+# Record every camera to CAMERA_RECORD_DIR/<robot_id>/ (off when not set)
+
+CAMERA_RECORD_DIR = os.environ.get('CAMERA_RECORD_DIR')
+CAMERA_RECORD_SEGMENT_SECONDS = 60
+CAMERA_RECORD_RETENTION_HOURS = 24
+
+
+# Channel layer
+# https://channels.readthedocs.io/en/stable/topics/channel_layers.html
+#
+# One Daphne worker: frames are passed around in memory.
+# Several workers: set CAMERA_REDIS_URL (any Redis-compatible server, e.g.
+# redis://127.0.0.1:6379 or unix:///run/redis/redis.sock) and every worker
+# gets the frames through Redis pub/sub.
+
+CAMERA_REDIS_URL = os.environ.get('CAMERA_REDIS_URL')
+
+if CAMERA_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [CAMERA_REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {
+                'capacity': 20,     # frames waiting per browser before new ones are dropped
+                'expiry': 2,        # seconds, an old frame is useless
+            },
+        },
+    }
@@ -1,8 +1,11 @@
 import sounddevice as sd
 import socket
 import threading
-import numpy as np
-import queue
+from audio_codec import PayloadDecoder, make_codec
+from audio_dsp import Capture, Playback
+from audio_protocol import MAX_PACKET, AudioEncoder, RtpSession
+from jitter_buffer import JitterBuffer
+from sample_fifo import SampleFifo
 import pygame
 
 # -------------------------
@@ -14,8 +17,13 @@ UDP_PORT = 7000
 INPUT_DEVICE = None   # default mic
 OUTPUT_DEVICE = None  # default speaker
 
-FRAMESIZE = 1024
 SAMPLERATE = 48000
+AUDIO_CODEC = 'opus'        # or 'pcm', uncompressed (audio_codec.py)
+AUDIO_BITRATE = 24000       # bit/s, Opus
+AUDIO_FRAME_MS = 20         # per packet, 10 or 20 (less delay, more overhead); the ends needn't agree
+FRAMESIZE = SAMPLERATE * AUDIO_FRAME_MS // 1000     # samples per packet
+BLOCKSIZE = FRAMESIZE       # samples per sound card callback: any size (sample_fifo.py), 0 for the card's own
+AUDIO_REPORT_EVERY = 60     # s between link stats printouts; RTCP reports go every ~5 s
 GAIN = 4
 
 # -------------------------
@@ -29,7 +37,15 @@ speaker_on = True
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(("0.0.0.0", UDP_PORT))
 
-audio_queue = queue.Queue()
+audio_buffer = JitterBuffer(FRAMESIZE, SAMPLERATE, decoder=PayloadDecoder(SAMPLERATE))
+audio_session = RtpSession(AudioEncoder(make_codec(AUDIO_CODEC, SAMPLERATE, AUDIO_FRAME_MS, bitrate=AUDIO_BITRATE)),
+                           sock, (PEER_IP, UDP_PORT), SAMPLERATE).start(AUDIO_REPORT_EVERY)
+# Gain, saturation and stereo into buffers made once (audio_dsp.py)
+speaker = Playback(BLOCKSIZE, GAIN)
+mic = Capture(BLOCKSIZE, GAIN)
+# Packets and sound card blocks needn't be the same size: these cut one into the other
+speaker_fifo = SampleFifo()
+mic_fifo = SampleFifo()
 
 # -------------------------
 # UDP Receiver Thread
@@ -37,9 +53,10 @@ audio_queue = queue.Queue()
 def udp_receiver():
     while True:
         # if speaker_on:
-        data, _ = sock.recvfrom(FRAMESIZE * 2)
-        samples = np.frombuffer(data, dtype=np.int16)
-        audio_queue.put(samples)
+        data, _ = sock.recvfrom(MAX_PACKET)
+        packet = audio_session.receive(data)
+        if packet is not None:
+            audio_buffer.put(packet.seq, packet.timestamp, packet, source=packet.ssrc, marker=packet.marker)
 
 threading.Thread(target=udp_receiver, daemon=True).start()
 
@@ -47,32 +64,25 @@ threading.Thread(target=udp_receiver, daemon=True).start()
 # Playback Callback
 # -------------------------
 def playback_callback(outdata, frames, time, status):
+    # Taken from the buffer either way, so it keeps its place in the stream
+    chunk = speaker_fifo.read(frames, source=audio_buffer.get)
     if speaker_on:
-        try:
-            chunk = audio_queue.get_nowait()
-            chunk = np.clip(chunk * GAIN, -32768, 32767).astype(np.int16)
-            stereo = np.column_stack([chunk, chunk]).astype(np.int16)
-            outdata[:] = stereo
-        except queue.Empty:
-            outdata.fill(0)
+        speaker.write(chunk, outdata)
     else:
-        # outdata.fill(0)
-        try:
-            chunk = audio_queue.get_nowait()
-            chunk = np.clip(chunk * 0, -32768, 32767).astype(np.int16)
-            stereo = np.column_stack([chunk, chunk]).astype(np.int16)
-            outdata[:] = stereo
-        except queue.Empty:
-            outdata.fill(0)
+        outdata.fill(0)
 
 # -------------------------
 # Record Callback
 # -------------------------
 def record_callback(indata, frames, time, status):
     if mic_on:
-        mono = indata[:, 0].astype(np.int16)
-        mono = np.clip(mono * GAIN, -32768, 32767).astype(np.int16)
-        sock.sendto(mono.tobytes(), (PEER_IP, UDP_PORT))
+        mic_fifo.write(mic.read(indata))
+        for packet in mic_fifo.blocks(FRAMESIZE):
+            audio_session.send(packet)
+    else:
+        # Muted: the timestamp still counts the samples, for the receiver's jitter buffer
+        audio_session.encoder.skip(frames + mic_fifo.available)
+        mic_fifo.clear()
 
 # -------------------------
 # Initialize pygame for key press
@@ -88,7 +98,7 @@ input_stream = sd.InputStream(
     samplerate=SAMPLERATE,
     channels=1,
     dtype='int16',
-    blocksize=FRAMESIZE,
+    blocksize=BLOCKSIZE,
     device=INPUT_DEVICE,
     callback=record_callback
 )
@@ -96,7 +106,7 @@ output_stream = sd.OutputStream(
     samplerate=SAMPLERATE,
     channels=2,
     dtype='int16',
-    blocksize=FRAMESIZE,
+    blocksize=BLOCKSIZE,
     device=OUTPUT_DEVICE,
     callback=playback_callback
 )
@@ -126,4 +136,6 @@ while running:
 # -------------------------
 input_stream.stop()
 output_stream.stop()
+sock.sendto(audio_session.bye(), (PEER_IP, UDP_PORT))
+print(audio_session.format())
 pygame.quit()
@@ -1,20 +1,32 @@
 import sounddevice as sd
 import socket
-import numpy as np
+import threading
+from audio_codec import PcmCodec
+from audio_dsp import Capture
+from audio_protocol import MAX_PACKET, AudioEncoder, RtpSession
 
 PI_IP = "192.168.192.103"  # Pi IP
 UDP_PORT = 7000
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.bind(("0.0.0.0", 0))    # any port: the receiver's RTCP reports come back to it
 
 samplerate = 48000
 framesize = 1024
 
+# Uncompressed L16 over RTP
+audio_session = RtpSession(AudioEncoder(PcmCodec(samplerate)), sock, (PI_IP, UDP_PORT), samplerate)
+mic = Capture(framesize)
+
 def callback(indata, frames, time, status):
     # if status:
     #     print(status)
-    mono = indata[:, 0].astype(np.int16)
-    sock.sendto(mono.tobytes(), (PI_IP, UDP_PORT))
+    audio_session.send(mic.read(indata))
+
+def udp_listener():
+    while True:
+        data, _ = sock.recvfrom(MAX_PACKET)
+        audio_session.receive(data)
 
 with sd.InputStream(
     samplerate=samplerate,
@@ -24,4 +36,8 @@ with sd.InputStream(
     callback=callback
 ):
     print("🎤 Sending mic audio to Pi...")
+    threading.Thread(target=udp_listener, daemon=True).start()
+    audio_session.start(log_every=10)
     input("Press Enter to stop.\n")
+    sock.sendto(audio_session.bye(), (PI_IP, UDP_PORT))
+    print(audio_session.format())
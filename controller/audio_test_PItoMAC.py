@@ -1,35 +1,38 @@
 import sounddevice as sd
 import socket
-import numpy as np
-import queue
 import threading
+from audio_codec import PayloadDecoder
+from audio_dsp import Playback
+from audio_protocol import MAX_PACKET, RtpSession
+from jitter_buffer import JitterBuffer
+from sample_fifo import SampleFifo
 
 UDP_PORT = 7000
 framesize = 1024
 samplerate = 48000
 device_index = 1  # Mac output device (usually your speakers)
 
-audio_queue = queue.Queue()
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(("0.0.0.0", UDP_PORT))
+audio_buffer = JitterBuffer(framesize, samplerate, decoder=PayloadDecoder(samplerate))
+audio_session = RtpSession(sock=sock, sample_rate=samplerate)
 
 def udp_listener():
     while True:
-        data, _ = sock.recvfrom(framesize * 2)
-        samples = np.frombuffer(data, dtype=np.int16)
-        audio_queue.put(samples)
+        data, addr = sock.recvfrom(MAX_PACKET)
+        audio_session.address = addr        # RTCP reports go back where the audio comes from
+        packet = audio_session.receive(data)
+        if packet is not None:
+            audio_buffer.put(packet.seq, packet.timestamp, packet, source=packet.ssrc, marker=packet.marker)
+
+speaker = Playback(framesize, gain=4)   # Amplify audio
+speaker_fifo = SampleFifo()            # whatever size the sender's packets are
 
 def audio_callback(outdata, frames, time, status):
-    try:
-        vol_mult = 4    # Amplify audio
-        chunk = audio_queue.get_nowait()
-        chunk = np.clip(chunk * vol_mult, -32768, 32767).astype(np.int16)
-        stereo = np.column_stack([chunk, chunk]).astype(np.int16)
-        outdata[:] = stereo
-    except queue.Empty:
-        outdata.fill(0)
+    speaker.write(speaker_fifo.read(frames, source=audio_buffer.get), outdata)
 
 threading.Thread(target=udp_listener, daemon=True).start()
+audio_session.start(log_every=10)
 print("🔊 Mac is ready to play audio...")
 
 with sd.OutputStream(
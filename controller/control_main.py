@@ -1,12 +1,16 @@
 # laptop_controller_combined.py
 import socket
 import threading
-import queue
-import numpy as np
 import pygame
 import sounddevice as sd
 import sys
 import time
+from audio_codec import PayloadDecoder, make_codec
+from audio_dsp import Capture, Playback
+from audio_protocol import MAX_PACKET, AudioEncoder, RtpSession
+from control_sender import ControlSender
+from jitter_buffer import JitterBuffer
+from sample_fifo import SampleFifo
 
 # -----------------------------
 # Pi ZeroTier IP / Ports setup
@@ -14,7 +18,9 @@ import time
 PI_IP = "192.168.192.103"   # Pi ZeroTier IP
 PI_PORT = 6000              # robot control port (send)
 MAC_PORT  = 6001            # telemetry receive (bind)
-INTERVAL = 0.05             # 50ms repeat
+INTERVAL = 0.05             # 50ms dashboard redraw
+STICK_THRESHOLD = 0.3       # camera axes below this count as centred
+CAMERA_SPEED = 100          # camera degrees per second while a key is held
 
 # Audio settings (kept original names where possible)
 PEER_IP = PI_IP             # peer for audio is same Pi
@@ -23,8 +29,13 @@ UDP_PORT = 7000             # audio TX/RX port (bind + send)
 # -----------------------------
 # Audio config
 # -----------------------------
-FRAMESIZE = 1024
 SAMPLERATE = 48000
+AUDIO_CODEC = 'opus'        # or 'pcm', uncompressed (audio_codec.py)
+AUDIO_BITRATE = 24000       # bit/s, Opus
+AUDIO_FRAME_MS = 20         # per packet, 10 or 20 (less delay, more overhead); the ends needn't agree
+FRAMESIZE = SAMPLERATE * AUDIO_FRAME_MS // 1000     # samples per packet
+BLOCKSIZE = FRAMESIZE       # samples per sound card callback: any size (sample_fifo.py), 0 for the card's own
+AUDIO_REPORT_EVERY = 60     # s between link stats printouts; RTCP reports go every ~5 s
 GAIN = 4
 
 INPUT_DEVICE = None   # default mic
@@ -36,18 +47,22 @@ OUTPUT_DEVICE = None  # default speaker
 mic_on = False
 speaker_on = True
 
-# last command / statuses for dashboard
-last_movement_cmd = None
-last_camera_cmd = None
+# current command state (sent every loop) and statuses for dashboard
+throttle = 0.0
+steer = 0.0
+pan_angle = 90
+tilt_angle = 90
 last_telemetry = "No data yet"
 joystick_present = False
 
 # -----------------------------
 # Socket setup
 # -----------------------------
-# Control socket used to send single-char commands to PI
+# Control socket used to send binary control packets to PI,
+# on every change plus a heartbeat (see control_sender.py)
 control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 control_sock.setblocking(False)
+control_sender = ControlSender(control_sock, (PI_IP, PI_PORT))
 
 # Telemetry socket (bind to receive telemetry from PI)
 telemetry_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -87,16 +102,25 @@ else:
     print("🎧 Press 'M' to toggle Mic/Speaker on/off.")
 
 # -----------------------------
-# Audio queue and functions
+# Audio jitter buffer and functions
 # -----------------------------
-audio_queue = queue.Queue()
+audio_buffer = JitterBuffer(FRAMESIZE, SAMPLERATE, decoder=PayloadDecoder(SAMPLERATE))
+audio_session = RtpSession(AudioEncoder(make_codec(AUDIO_CODEC, SAMPLERATE, AUDIO_FRAME_MS, bitrate=AUDIO_BITRATE)),
+                           audio_sock, (PEER_IP, UDP_PORT), SAMPLERATE).start(AUDIO_REPORT_EVERY)
+# Gain, saturation and stereo into buffers made once (audio_dsp.py)
+speaker = Playback(BLOCKSIZE, GAIN)
+mic = Capture(BLOCKSIZE, GAIN)
+# Packets and sound card blocks needn't be the same size: these cut one into the other
+speaker_fifo = SampleFifo()
+mic_fifo = SampleFifo()
 
 def udp_receiver_audio():
-    """Receive audio frames and push to queue"""
+    """Receive audio packets into the jitter buffer"""
     while True:
-        data, _ = audio_sock.recvfrom(FRAMESIZE * 2)
-        samples = np.frombuffer(data, dtype=np.int16)
-        audio_queue.put(samples)
+        data, _ = audio_sock.recvfrom(MAX_PACKET)
+        packet = audio_session.receive(data)
+        if packet is not None:
+            audio_buffer.put(packet.seq, packet.timestamp, packet, source=packet.ssrc, marker=packet.marker)
 
 audio_thread = threading.Thread(target=udp_receiver_audio, daemon=True)
 audio_thread.start()
@@ -104,35 +128,28 @@ audio_thread.start()
 def playback_callback(outdata, frames, time_info, status):
     global speaker_on
     # outdata shape (frames, 2)
+    # Taken from the buffer either way, so it keeps its place in the stream
+    chunk = speaker_fifo.read(frames, source=audio_buffer.get)
     if speaker_on:
-        try:
-            chunk = audio_queue.get_nowait()
-            chunk = np.clip(chunk.astype(np.int32) * GAIN, -32768, 32767).astype(np.int16)  # remove the astype(np.int32) part if needed
-            stereo = np.column_stack([chunk, chunk]).astype(np.int16)
-            outdata[:] = stereo
-        except queue.Empty:
-            outdata.fill(0)
+        speaker.write(chunk, outdata)
     else:
-        # outdata.fill(0)
-        try:
-            chunk = audio_queue.get_nowait()
-            chunk = np.clip(chunk * 0, -32768, 32767).astype(np.int16)
-            stereo = np.column_stack([chunk, chunk]).astype(np.int16)
-            outdata[:] = stereo
-        except queue.Empty:
-            outdata.fill(0)
+        outdata.fill(0)
 
 def record_callback(indata, frames, time_info, status):
     global mic_on
     # indata shape (frames, channels)
     if mic_on:
-        mono = indata[:, 0].astype(np.int16)
-        mono = np.clip(mono.astype(np.int32) * GAIN, -32768, 32767).astype(np.int16)    # remove the astype(np.int32) part if needed
+        mic_fifo.write(mic.read(indata))
         try:
-            audio_sock.sendto(mono.tobytes(), (PEER_IP, UDP_PORT))
+            for packet in mic_fifo.blocks(FRAMESIZE):
+                audio_session.send(packet)
         except Exception as e:
             # network issue shouldn't crash callback
             pass
+    else:
+        # Muted: the timestamp still counts the samples, for the receiver's jitter buffer
+        audio_session.encoder.skip(frames + mic_fifo.available)
+        mic_fifo.clear()
 
 # Start audio streams (safe try/except)
 input_stream = None
@@ -142,7 +159,7 @@ try:
         samplerate=SAMPLERATE,
         channels=1,
         dtype='int16',
-        blocksize=FRAMESIZE,
+        blocksize=BLOCKSIZE,
         device=INPUT_DEVICE,
         callback=record_callback
     )
@@ -150,7 +167,7 @@ try:
         samplerate=SAMPLERATE,
         channels=2,
         dtype='int16',
-        blocksize=FRAMESIZE,
+        blocksize=BLOCKSIZE,
         device=OUTPUT_DEVICE,
         callback=playback_callback
     )
@@ -173,35 +190,23 @@ def recv_telemetry():
 telemetry_thread = threading.Thread(target=recv_telemetry, daemon=True)
 telemetry_thread.start()
 
-# -----------------------------
-# Helper: send control command
-# -----------------------------
-def send_control(cmd_char):
-    global last_movement_cmd, last_camera_cmd
-    if cmd_char is None:
-        return
-    try:
-        control_sock.sendto(cmd_char.encode(), (PI_IP, PI_PORT))
-    except Exception as e:
-        # ignore send errors
-        pass
-
-    # Update last command display
-    if cmd_char in ['w','a','s','d']:
-        last_movement_cmd = cmd_char
-    elif cmd_char in ['U','D','L','R']:
-        last_camera_cmd = cmd_char
-
 # -----------------------------
 # Main loop
 # -----------------------------
 running = True
-clock = pygame.time.Clock()
-current_key = None
+last_loop = next_draw = time.monotonic()
 
 while running:
+    # --- wait for input, the next redraw or the next heartbeat ---
+    timeout = min(next_draw - time.monotonic(), control_sender.next_wakeup())
+    event = pygame.event.wait(max(1, int(timeout * 1000)))
+    events = [event] if event.type != pygame.NOEVENT else []
+    events += pygame.event.get()
+    now = time.monotonic()
+    dt, last_loop = now - last_loop, now
+
     # --- handle events ---
-    for event in pygame.event.get():
+    for event in events:
         if event.type == pygame.QUIT:
             running = False
         elif event.type == pygame.KEYDOWN:
@@ -209,22 +214,13 @@ while running:
             if event.key == pygame.K_m:
                 mic_on = not mic_on
                 speaker_on = not speaker_on
-            # Arrow keys map to camera
-            elif event.key == pygame.K_UP:
-                current_key = 'U'
-            elif event.key == pygame.K_DOWN:
-                current_key = 'B'
-            elif event.key == pygame.K_LEFT:
-                current_key = 'L'
-            elif event.key == pygame.K_RIGHT:
-                current_key = 'R'
-            # WASD movement
-            elif event.key in (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d):
-                current_key = event.unicode  # 'w','a','s','d'
-            else:
-                current_key = 'x'
-        elif event.type == pygame.KEYUP:
-            current_key = 'x'
+
+    # --- keyboard: WASD movement, arrow keys camera (while held) ---
+    keys = pygame.key.get_pressed()
+    throttle = float(keys[pygame.K_w] - keys[pygame.K_s])
+    steer = float(keys[pygame.K_d] - keys[pygame.K_a])
+    camera_tilt = keys[pygame.K_UP] - keys[pygame.K_DOWN]
+    camera_pan = keys[pygame.K_LEFT] - keys[pygame.K_RIGHT]
 
     # --- joystick handling (if present) ---
     if joystick is not None:
@@ -248,23 +244,24 @@ while running:
             axis_0 = axis_1 = axis_2 = axis_3 = 0.0
 
         # Map joystick to commands:
-        # Left stick controls robot movement: up -> w, down -> s, left -> a, right -> d
-        if abs(axis_3) > 0.3:
-            current_key = 'w' if axis_3 < 0 else 's'
-        elif abs(axis_2) > 0.3:
-            current_key = 'a' if axis_2 < 0 else 'd'
-        # Right stick controls camera: up/down/left/right -> U/D/L/R
-        elif abs(axis_1) > 0.3:
-            current_key = 'U' if axis_1 < 0 else 'B'
-        elif abs(axis_0) > 0.3:
-            current_key = 'L' if axis_0 < 0 else 'R'
-        else:
-            # no stick displacement
-            current_key = 'x'
-            
-    # --- send command if present ---
-    if current_key:
-        send_control(current_key)
+        # Right stick (axes 2/3) drives the robot, sent as is: the robot's
+        # mixer does the deadband and expo
+        throttle = -axis_3
+        steer = axis_2
+        # Left stick (axes 0/1) moves the camera
+        camera_tilt = -axis_1 if abs(axis_1) > STICK_THRESHOLD else 0.0
+        camera_pan = -axis_0 if abs(axis_0) > STICK_THRESHOLD else 0.0
+
+    # Camera angles are kept here and sent as targets
+    tilt_angle = min(170, max(10, tilt_angle + camera_tilt * CAMERA_SPEED * dt))
+    pan_angle = min(170, max(10, pan_angle + camera_pan * CAMERA_SPEED * dt))
+
+    # --- send right away if anything changed, else only the heartbeat ---
+    control_sender.update(throttle, steer, pan_angle, tilt_angle)
+
+    if now < next_draw:
+        continue
+    next_draw = now + INTERVAL
 
     # --- draw dashboard ---
     screen.fill((45, 45, 45))  # beige-like background
@@ -283,8 +280,8 @@ while running:
     draw_box(12, 60, 180, 60, "Audio", f"Mic: {'ON' if mic_on else 'OFF'} | Speaker: {'ON' if speaker_on else 'OFF'}")
     draw_box(208, 60, 180, 60, "Joystick", f"Present: {joystick_present}")
 
-    draw_box(12, 132, 180, 60, "Last Movement", f"{last_movement_cmd if last_movement_cmd else '—'}")
-    draw_box(208, 132, 180, 60, "Last Camera", f"{last_camera_cmd if last_camera_cmd else '—'}")
+    draw_box(12, 132, 180, 60, "Movement", f"Throttle: {throttle:+.2f} | Steer: {steer:+.2f}")
+    draw_box(208, 132, 180, 60, "Camera", f"Pan: {pan_angle:.0f} | Tilt: {tilt_angle:.0f}")
 
     # Telemetry area (multi-line)
     pygame.draw.rect(screen, (55,55,55), (12, 204, SCREEN_W-24, 84))
@@ -302,9 +299,6 @@ while running:
 
     pygame.display.flip()
 
-    # cap the loop
-    clock.tick(20)
-
 # -----------------------------
 # Shutdown
 # -----------------------------
@@ -319,6 +313,8 @@ except Exception as e:
     pass
 
 try:
+    audio_sock.sendto(audio_session.bye(), (PEER_IP, UDP_PORT))
+    print(audio_session.format())
     telemetry_sock.close()
     audio_sock.close()
     control_sock.close()
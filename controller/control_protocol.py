@@ -0,0 +1,148 @@
+# control_protocol.py
+# Binary control packets, laptop -> Pi (UDP port 6000).
+# Keep robot/control_protocol.py and controller/control_protocol.py the same.
+import os
+import struct
+import time
+from collections import namedtuple
+
+# -----------------------------
+# Packet layout (22 bytes, little endian)
+# -----------------------------
+#   magic      2s  b'RC'
+#   version    B   VERSION
+#   flags      B   reserved, 0
+#   session    H   random per controller start, resets the robot's seq check
+#   seq        I   +1 per packet, wraps
+#   time_ms    I   controller's monotonic clock, wraps
+#   throttle   h   -1.0 .. 1.0 as -32767 .. 32767 (forward is +)
+#   steer      h   -1.0 .. 1.0 as -32767 .. 32767 (right is +)
+#   pan        h   camera pan target, degrees * 100
+#   tilt       h   camera tilt target, degrees * 100
+PACKET = struct.Struct('<2sBBHIIhhhh')
+MAGIC = b'RC'
+VERSION = 1
+
+AXIS_SCALE = 32767
+ANGLE_SCALE = 100
+U32 = 0xFFFFFFFF
+
+# Packets older than this (seconds) are not acted on
+MAX_AGE = 0.25
+# Every packet stale for this long (seconds, and at least REBASE_PACKETS
+# of them) is a lasting step in latency (a new route, a relay), not a
+# queue: the newest packet becomes the fastest trip
+REBASE_AFTER = 1.0
+REBASE_PACKETS = 3
+
+ControlCommand = namedtuple('ControlCommand', 'seq time_ms throttle steer pan tilt')
+
+
+def monotonic_ms():
+    return int(time.monotonic() * 1000) & U32
+
+
+def _axis(value):
+    return int(round(max(-1.0, min(1.0, value)) * AXIS_SCALE))
+
+
+def _angle(degrees):
+    return int(round(max(0.0, min(180.0, degrees)) * ANGLE_SCALE))
+
+
+class ControlEncoder:
+    """Builds the controller's packets: one per send, seq counting up."""
+
+    def __init__(self, session=None):
+        self.session = session if session is not None else int.from_bytes(os.urandom(2), 'little')
+        self.seq = 0
+
+    def encode(self, throttle, steer, pan, tilt, time_ms=None):
+        self.seq = (self.seq + 1) & U32
+        if time_ms is None:
+            time_ms = monotonic_ms()
+        return PACKET.pack(MAGIC, VERSION, 0, self.session, self.seq, time_ms,
+                           _axis(throttle), _axis(steer), _angle(pan), _angle(tilt))
+
+
+class ControlDecoder:
+    """
+    Checks the robot's incoming packets. decode() returns a ControlCommand,
+    or None for a packet that is malformed, stale or older than one already
+    acted on (UDP can reorder and duplicate).
+
+    The two clocks are never compared directly: the smallest
+    (robot time - controller time) seen is the fastest trip, and a packet
+    that took more than max_age longer than that is stale. If every
+    packet has been stale for rebase_after, the trip got longer for good
+    and the base starts over from the latest packet.
+    """
+
+    def __init__(self, max_age=MAX_AGE, rebase_after=REBASE_AFTER):
+        self.max_age_ms = max_age * 1000
+        self.rebase_after_ms = rebase_after * 1000
+        self.session = None
+        self.last_seq = 0
+        self.base = None
+        self.base_at = 0
+        self.accepted = 0
+        self.malformed = 0
+        self.reordered = 0
+        self.stale = 0
+        self.rebased = 0
+        self._stale_since = None    # now_ms of the first of a run of stale packets
+        self._stale_run = 0
+
+    def decode(self, data, now_ms=None):
+        if len(data) != PACKET.size:
+            self.malformed += 1
+            return None
+        magic, version, _, session, seq, time_ms, throttle, steer, pan, tilt = PACKET.unpack(data)
+        if magic != MAGIC or version != VERSION:
+            self.malformed += 1
+            return None
+        if now_ms is None:
+            now_ms = monotonic_ms()
+
+        if session != self.session:
+            # New controller (or a restart): start over
+            self.session = session
+            self.base = None
+        elif not 0 < (seq - self.last_seq) & U32 < 0x80000000:
+            self.reordered += 1
+            return None
+
+        delta = (now_ms - time_ms) & U32
+        if self.base is None or _wrapped(delta - self.base) < 0:
+            self.base = delta
+            self.base_at = now_ms
+        else:
+            # Let the base creep up 1 ms per second, so clock drift
+            # between the laptop and the Pi doesn't make everything stale
+            creep = ((now_ms - self.base_at) & U32) // 1000
+            if creep:
+                self.base = (self.base + min(_wrapped(delta - self.base), creep)) & U32
+                self.base_at = (self.base_at + creep * 1000) & U32
+        self.last_seq = seq
+        if _wrapped(delta - self.base) > self.max_age_ms:
+            if self._stale_since is None:
+                self._stale_since = now_ms
+            self._stale_run += 1
+            if (self._stale_run < REBASE_PACKETS
+                    or _wrapped(now_ms - self._stale_since) < self.rebase_after_ms):
+                self.stale += 1
+                return None
+            self.base = delta
+            self.base_at = now_ms
+            self.rebased += 1
+        self._stale_since = None
+        self._stale_run = 0
+
+        self.accepted += 1
+        return ControlCommand(seq, time_ms, throttle / AXIS_SCALE, steer / AXIS_SCALE,
+                              pan / ANGLE_SCALE, tilt / ANGLE_SCALE)
+
+
+def _wrapped(diff):
+    """A difference of two wrapping uint32 values, as a signed number."""
+    return ((diff + 0x80000000) & U32) - 0x80000000
@@ -0,0 +1,77 @@
+# control_sender.py
+# Sends control packets when the control state changes, plus a slow
+# heartbeat in between, instead of the same packet every 50 ms.
+import time
+
+from control_protocol import ControlEncoder
+
+HEARTBEAT = 0.2             # seconds between packets while nothing changes
+MIN_SEND_INTERVAL = 0.01    # at most 100 packets/s while a stick is moving
+AXIS_EPSILON = 0.01         # smaller stick changes are noise
+ANGLE_EPSILON = 0.5         # degrees
+
+
+class ControlSender:
+    """
+    update() with the current throttle/steer/pan/tilt as often as you like,
+    and poll() from the main loop. A change is sent straight away (or
+    after MIN_SEND_INTERVAL if a packet just went out), the last state
+    again every HEARTBEAT so the robot knows the link is up.
+    """
+
+    def __init__(self, sock, address, heartbeat=HEARTBEAT, min_interval=MIN_SEND_INTERVAL):
+        self.sock = sock
+        self.address = address
+        self.heartbeat = heartbeat
+        self.min_interval = min_interval
+        self.encoder = ControlEncoder()
+        self.state = (0.0, 0.0, 90.0, 90.0)
+        self.sent_state = None
+        self.last_send = 0.0
+        self.packets_sent = 0
+        self.bytes_sent = 0
+
+    def update(self, throttle, steer, pan, tilt):
+        self.state = (throttle, steer, pan, tilt)
+        self.poll()
+
+    def changed(self):
+        if self.sent_state is None:
+            return True
+        for new, old, epsilon in zip(self.state, self.sent_state,
+                                     (AXIS_EPSILON, AXIS_EPSILON, ANGLE_EPSILON, ANGLE_EPSILON)):
+            # Going back to exactly 0 (stick released) always counts
+            if abs(new - old) >= epsilon or (new == 0) != (old == 0):
+                return True
+        return False
+
+    def poll(self, now=None):
+        """Send if there is a change or a heartbeat is due. Returns True if sent."""
+        if now is None:
+            now = time.monotonic()
+        since = now - self.last_send
+        if (self.changed() and since >= self.min_interval) or since >= self.heartbeat:
+            self.send(now)
+            return True
+        return False
+
+    def next_wakeup(self, now=None):
+        """Seconds until poll() may have something to send."""
+        if now is None:
+            now = time.monotonic()
+        since = now - self.last_send
+        if self.changed():
+            return max(0.0, self.min_interval - since)
+        return max(0.0, self.heartbeat - since)
+
+    def send(self, now):
+        packet = self.encoder.encode(*self.state)
+        try:
+            self.sock.sendto(packet, self.address)
+        except Exception:
+            # ignore send errors, the next change or heartbeat retries
+            pass
+        self.sent_state = self.state
+        self.last_send = now
+        self.packets_sent += 1
+        self.bytes_sent += len(packet)
@@ -0,0 +1,125 @@
+# control_test_latency.py
+# Control latency and bandwidth over a loopback UDP link: the old way
+# (send the state every 50 ms tick) against ControlSender (send on change
+# plus a heartbeat). A simulated driver changes the sticks at random
+# times; latency is from the change until the robot side decodes it.
+#
+#   python control_test_latency.py [seconds]
+import random
+import socket
+import sys
+import threading
+import time
+
+from control_protocol import ControlDecoder, ControlEncoder
+from control_sender import ControlSender
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+TICK = 0.05                 # old main loop period
+MEAN_CHANGE_GAP = 0.3       # seconds between stick changes, on average
+IDLE_SHARE = 0.5            # part of the run with the sticks left alone
+PORT = 6101
+UDP_IP_HEADER = 28          # bytes per packet on top of the payload
+# -------------------------
+
+
+class Driver:
+    """Random stick changes, then a quiet spell, like someone driving."""
+
+    def __init__(self):
+        self.state = (0.0, 0.0, 90.0, 90.0)
+        self.changes = []           # (time, throttle)
+        self.changed = threading.Event()
+
+    def run(self, seconds):
+        busy_until = time.monotonic() + seconds * (1 - IDLE_SHARE)
+        while time.monotonic() < busy_until:
+            time.sleep(random.expovariate(1 / MEAN_CHANGE_GAP))
+            # A throttle nobody has used yet, so the receiver can tell them apart
+            throttle = round(random.uniform(-1, 1), 2)
+            while throttle in (c[1] for c in self.changes) or throttle == self.state[0]:
+                throttle = round(random.uniform(-1, 1), 2)
+            self.state = (throttle, 0.0, 90.0, 90.0)
+            self.changes.append((time.monotonic(), throttle))
+            self.changed.set()
+        time.sleep(seconds * IDLE_SHARE)
+
+
+def receive(sock, stop, arrivals):
+    decoder = ControlDecoder()
+    while not stop.is_set():
+        try:
+            data, _ = sock.recvfrom(64)
+        except socket.timeout:
+            continue
+        cmd = decoder.decode(data)
+        if cmd is not None:
+            arrivals.append((time.monotonic(), round(cmd.throttle, 2)))
+
+
+def tick_sender(sock, driver, stop, sent):
+    encoder = ControlEncoder()
+    next_tick = time.monotonic()
+    while not stop.is_set():
+        sock.sendto(encoder.encode(*driver.state), ("127.0.0.1", PORT))
+        sent.append(1)
+        next_tick += TICK
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+def event_sender(sock, driver, stop, sent):
+    sender = ControlSender(sock, ("127.0.0.1", PORT))
+    while not stop.is_set():
+        # Same shape as control_main.py: sleep until input or a heartbeat
+        driver.changed.wait(sender.next_wakeup())
+        driver.changed.clear()
+        sender.update(*driver.state)
+    sent.append(sender.packets_sent)
+
+
+def run(mode):
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(("127.0.0.1", PORT))
+    rx.settimeout(0.1)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    driver = Driver()
+    stop = threading.Event()
+    arrivals = []
+    sent = []
+    receiver = threading.Thread(target=receive, args=(rx, stop, arrivals))
+    sender = threading.Thread(target=tick_sender if mode == 'tick' else event_sender,
+                              args=(tx, driver, stop, sent))
+    receiver.start()
+    sender.start()
+    driver.run(SECONDS)
+    stop.set()
+    driver.changed.set()
+    sender.join()
+    receiver.join()
+    rx.close()
+    tx.close()
+
+    latencies = []
+    for changed_at, throttle in driver.changes:
+        seen = [t for t, value in arrivals if value == throttle and t >= changed_at]
+        if seen:
+            latencies.append(seen[0] - changed_at)
+    latencies.sort()
+    packets = sum(sent)
+    print(f"{mode:>5}: {len(driver.changes)} changes, {len(latencies)} seen | latency "
+          f"p50 {latencies[len(latencies) // 2] * 1000:5.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:5.1f} ms, "
+          f"max {latencies[-1] * 1000:5.1f} ms | {packets / SECONDS:5.1f} packets/s, "
+          f"{packets * (22 + UDP_IP_HEADER) / SECONDS:6.0f} B/s")
+    return latencies, packets
+
+
+print(f"{SECONDS:.0f} s, sticks busy for the first {(1 - IDLE_SHARE) * 100:.0f} %")
+tick_latencies, tick_packets = run('tick')
+event_latencies, event_packets = run('event')
+ok = (event_latencies[len(event_latencies) // 2] < tick_latencies[len(tick_latencies) // 2]
+      and event_packets < tick_packets)
+print("PASS: lower latency and fewer packets" if ok else "FAIL")
@@ -0,0 +1,307 @@
+# jitter_buffer.py
+# Receive side of the UDP audio: packets in any order from the network
+# thread, one packet's samples out per get(), in order, for the sound
+# card callback (through sample_fifo.py, which cuts them into blocks of
+# its size). Replaces the unbounded queue.Queue, which grew without limit
+# when the sender's clock ran fast and clicked every time it ran dry.
+# Keep robot/jitter_buffer.py and controller/jitter_buffer.py the same.
+#
+#   buffer = JitterBuffer(FRAMESIZE, SAMPLERATE, decoder=PayloadDecoder())
+#   buffer.put(packet.seq, packet.timestamp, packet, source=packet.ssrc,   # receiver thread
+#              marker=packet.marker)
+#   chunk = buffer.get()                                                    # a packet's worth, any length
+import collections
+import math
+import threading
+import time
+
+import numpy as np
+
+U16 = 0xFFFF
+U32 = 0xFFFFFFFF
+
+MAX_DELAY = 0.24            # s of playout delay past the quickest packet, at most, and of packets held
+DELAY_WINDOW = 500          # packets the playout delay is worked out over (~10 s)
+DELAY_PERCENTILE = 99       # of their transit time past the quickest one
+MARGIN = 0.005              # s on top of that
+SHRINK_AFTER = 25           # frames spent 1.5 frames over the target before one is dropped
+MAX_CONCEALED = 3           # lost frames in a row repeated (fading) before silence
+FADE = 96                   # samples, 2 ms at 48 kHz: fades in, cross fades
+RESTART_GAP = 1000          # a seq jump bigger than this is a new stream
+SPURT_SKIP = 2              # frames the timestamp jumps past what the seq says: a new talk spurt
+
+
+def _wrapped(diff, mask, half):
+    return ((diff + half) & mask) - half
+
+
+class JitterBuffer:
+    """
+    put() files each packet under its sequence number; get() plays them
+    back in order, one frame (a packet's samples, however many the
+    sender put in) per call. `frame` is the packet size to expect; the
+    timestamps tell the real one, which the delays are worked out in.
+
+    Playout delay: every packet's transit time (arrival on our clock
+    against its timestamp, so the clock offset cancels) is measured, and
+    frames play DELAY_PERCENTILE of the last DELAY_WINDOW packets' spread
+    past the quickest one, plus MARGIN (the target, in frames; at most
+    max_delay). The
+    frame due is played if it's in. If not: while it's still inside the
+    target it is waited for (a concealed frame, counted as an underrun,
+    and the delay grows by a frame); past the target it counts as lost
+    and playback moves on. A packet that comes after its turn is dropped
+    as late, and so are duplicates. A new `source` (RTP SSRC) or a big
+    jump in seq starts over.
+
+    Talk spurts: a sender that stops (a muted mic) carries on with the
+    next seq, but its timestamp skips the samples it didn't send and the
+    packet has the marker bit (RFC 3550 5.1). Either one starts a new
+    spurt: it plays next, instead of being late behind the frames get()
+    counted lost meanwhile, and the delay is measured afresh.
+
+    Drift: a sender whose clock is fast makes the quickest transit creep
+    down, so the frames being played drift past the target. Once they
+    have been 1.5 frames over it for SHRINK_AFTER frames one is dropped,
+    cross faded. A slow sender is the other way round and costs an
+    underrun now and then.
+
+    put() takes the payload as it came. With a decoder
+    (audio_codec.PayloadDecoder) get() decodes it in playout order, as a
+    stateful codec like Opus needs, and a missing frame is the codec's
+    concealment (Opus: its loss concealment, or the copy in the next
+    packet). Without one the payload is int16 samples already. Otherwise
+    concealment is the last frame repeated, fading out over MAX_CONCEALED
+    frames, then silence, and the next real frame fades back in.
+    stats() has the counts.
+    """
+
+    def __init__(self, frame=1024, sample_rate=48000, max_delay=MAX_DELAY, decoder=None,
+                 clock=time.monotonic):
+        self.frame = frame
+        self.sample_rate = sample_rate
+        self.max_delay = max_delay
+        self.decoder = decoder
+        self.clock = clock
+        self.target = 0             # frames of delay past the quickest packet
+        self.jitter = 0.0           # RFC 3550 interarrival jitter estimate, seconds
+
+        self.received = 0
+        self.played = 0
+        self.late = 0
+        self.duplicates = 0
+        self.lost = 0               # frames concealed for a packet that never came in time
+        self.underruns = 0          # frames concealed waiting for one that might
+        self.shrunk = 0             # frames dropped to bring the delay down
+        self.overflows = 0          # dropped past max_delay buffered
+        self.restarts = 0
+        self.spurts = 0             # talk spurts started (the sender paused)
+        self.muted = 0              # frames the sender didn't send, once counted lost
+        self.playing = None         # extended seq of the frame get() just returned, None if concealed
+
+        self._lock = threading.Lock()
+        self._packets = {}          # extended seq -> (extended timestamp, payload)
+        self._next = None           # extended seq to play next
+        self._source = None         # the sender's SSRC: a new one is a new stream
+        self._last_seq = None       # seq, extended seq and timestamp of the newest arrival
+        self._last_ext = None
+        self._last_ts = None
+        self._packet_samples = frame
+        self._last_transit = None
+        self._transits = collections.deque(maxlen=DELAY_WINDOW)
+        self._quickest = None
+        self._playout = None        # transit time frames play at
+        self._over = 0
+        self._last = np.zeros(frame, dtype=np.float32)
+        self._concealed = 0
+        self._faded = False
+
+    # -----------------------------
+    # Network side
+    # -----------------------------
+    def put(self, seq, timestamp, payload, arrival=None, source=None, marker=False):
+        arrival = self.clock() if arrival is None else arrival
+        with self._lock:
+            if (self._last_seq is None or source != self._source
+                    or abs(_wrapped(seq - self._last_seq, U16, 0x8000)) > RESTART_GAP):
+                if self._last_seq is not None:
+                    self.restarts += 1
+                self._source = source
+                self._start(seq, timestamp)
+            ext = self._last_ext + _wrapped(seq - self._last_seq, U16, 0x8000)
+            ts = self._last_ts + _wrapped(timestamp - self._last_ts, U32, 0x80000000)
+            spurt = marker
+            if ext > self._last_ext:
+                skipped = ts - self._last_ts - (ext - self._last_ext) * self._packet_samples
+                if skipped > SPURT_SKIP * self._packet_samples:
+                    spurt = True
+                elif ts > self._last_ts:
+                    self._packet_samples = (ts - self._last_ts) // (ext - self._last_ext)
+                self._last_seq, self._last_ext, self._last_ts = seq, ext, ts
+            self.received += 1
+            if spurt and ext == self._last_ext and ext > 0:      # not the stream's first
+                self._talk_spurt(ext)
+            self._measure(ts / self.sample_rate, arrival)
+
+            if ext < self._next:
+                self.late += 1
+                return
+            if ext in self._packets:
+                self.duplicates += 1
+                return
+            self._packets[ext] = (ts, payload)
+            while len(self._packets) > self.max_depth:
+                self._packets.pop(self._next, None)
+                self._next += 1
+                self.overflows += 1
+
+    def _start(self, seq, timestamp):
+        self._packets.clear()
+        self._last_seq, self._last_ext, self._last_ts = seq, 0, timestamp
+        self._next = 0
+        self._last_transit = None
+        self._transits.clear()
+        self._concealed = 0
+
+    def _talk_spurt(self, ext):
+        self.spurts += 1
+        # get() took the pause for lost frames; the sender's seq doesn't count
+        # them, so from this packet on they were never sent
+        if self._next > ext:
+            self.lost -= self._next - ext
+            self.muted += self._next - ext
+        # Still to play from the last spurt: keep it, the new one follows on
+        if not any(key < ext for key in self._packets):
+            self._next = ext
+        self._last_transit = None
+        self._transits.clear()
+
+    def _measure(self, sent, arrival):
+        transit = arrival - sent
+        if self._last_transit is not None:
+            self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+        self._last_transit = transit
+        self._transits.append(transit)
+        spread = sorted(self._transits)
+        self._quickest = spread[0]
+        excess = spread[min(len(spread) - 1, len(spread) * DELAY_PERCENTILE // 100)] - spread[0]
+        excess = min(excess + MARGIN, self.max_delay)
+        self.target = math.ceil(excess / self.frame_time - 1e-9)
+        self._playout = self._quickest + excess
+
+    # -----------------------------
+    # Playback side
+    # -----------------------------
+    def get(self, now=None):
+        """The next frame, int16 samples: audio, concealment or silence."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            self.playing = None
+            if self._last_seq is None:
+                return self._conceal()
+            entry = self._packets.pop(self._next, None)
+            if entry is None:
+                # Where the missing frame is against the target delay
+                sent = (self._last_ts + (self._next - self._last_ext) * self._packet_samples) / self.sample_rate
+                if now - sent < self._playout:
+                    self.underruns += self.played > 0   # might still come: wait for it
+                else:
+                    self.lost += 1                      # should be here by now: it's gone
+                    self._next += 1
+                following = self._packets.get(self._next)
+                return self._conceal(following[1] if following else None)
+            ts, payload = entry
+            seq = self._next
+            self._next += 1
+            samples = self._decode(payload)
+            if samples is None:
+                self.lost += 1
+                return self._conceal()
+            out = self._fit(samples)
+
+            if now - ts / self.sample_rate > self._playout + 1.5 * self.frame_time:
+                self._over += 1
+                if self._over >= SHRINK_AFTER and self._next in self._packets:
+                    # Too late for too long (fast sender): skip a frame
+                    ts, payload = self._packets.pop(self._next)
+                    samples = self._decode(payload)
+                    seq = self._next
+                    self._next += 1
+                    if samples is not None:
+                        following = self._fit(samples)
+                        n = min(FADE, len(out), len(following))
+                        ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+                        following[:n] = out[:n] * (1 - ramp) + following[:n] * ramp
+                        out = following
+                    self.shrunk += 1
+                    self._over = 0
+            else:
+                self._over = 0
+
+            if self._faded:
+                n = min(FADE, len(out))
+                out[:n] *= np.linspace(0.0, 1.0, n, dtype=np.float32)
+                self._faded = False
+            self._concealed = 0
+            self._last = out
+            self.played += 1
+            self.playing = seq
+            return out.astype(np.int16)
+
+    def _decode(self, payload):
+        return payload if self.decoder is None else self.decoder.decode(payload)
+
+    def _fit(self, samples):
+        return np.array(samples, dtype=np.float32)
+
+    def _conceal(self, following=None):
+        if self.played == 0:
+            return np.zeros(self._packet_samples, dtype=np.int16)
+        self._concealed += 1
+        if self.decoder is not None:
+            samples = self.decoder.conceal(following)
+            if samples is not None:
+                self._last = self._fit(samples)
+                return self._last.astype(np.int16)
+        self._faded = True
+        if self._concealed > MAX_CONCEALED:
+            return np.zeros(self._packet_samples, dtype=np.int16)
+        start = 1 - (self._concealed - 1) / MAX_CONCEALED
+        end = 1 - self._concealed / MAX_CONCEALED
+        return (self._last * np.linspace(start, end, len(self._last), dtype=np.float32)).astype(np.int16)
+
+    # -----------------------------
+    # Stats
+    # -----------------------------
+    @property
+    def frame_time(self):
+        """Seconds per packet, from the timestamps."""
+        return self._packet_samples / self.sample_rate
+
+    @property
+    def max_depth(self):
+        """Packets held, at most: max_delay of them."""
+        return max(1, math.ceil(self.max_delay / self.frame_time - 1e-9))
+
+    @property
+    def depth(self):
+        return len(self._packets)
+
+    def latency(self):
+        """Seconds of audio waiting to play (network jitter not included)."""
+        return len(self._packets) * self.frame_time
+
+    def stats(self):
+        return {
+            'received': self.received, 'played': self.played, 'late': self.late,
+            'duplicates': self.duplicates, 'lost': self.lost, 'underruns': self.underruns,
+            'shrunk': self.shrunk, 'overflows': self.overflows, 'restarts': self.restarts, 'spurts': self.spurts,
+            'muted': self.muted,
+            'depth': self.depth, 'target': self.target, 'jitter_ms': self.jitter * 1000,
+        }
+
+    def format(self, stats=None):
+        s = stats or self.stats()
+        return (f"audio: depth {s['depth']}/{s['target']} ({s['depth'] * self.frame_time * 1000:.0f} ms), "
+                f"jitter {s['jitter_ms']:.1f} ms, {s['played']} played, {s['lost']} lost, "
+                f"{s['muted']} muted, {s['late']} late, {s['underruns']} underruns, {s['shrunk']} dropped for drift")
@@ -0,0 +1,86 @@
+# sample_fifo.py
+# A ring buffer of int16 samples between packets and sound card blocks,
+# so the two can be different sizes: packets of AUDIO_FRAME_MS (what the
+# codec and the latency want) in, blocks of whatever the sound card
+# callback asks for out, and the other way round on the record side.
+# Keep robot/sample_fifo.py and controller/sample_fifo.py the same.
+#
+#   speaker.write(speaker_fifo.read(frames, source=audio_buffer.get), outdata)  # playback callback
+#   mic_fifo.write(mic.read(indata))                                            # record callback
+#   for packet in mic_fifo.blocks(FRAMESIZE):
+#       audio_session.send(packet)
+import numpy as np
+
+CAPACITY = 48000            # samples, 1 s at 48 kHz
+
+
+class SampleFifo:
+    """
+    write() takes any number of samples; read(n) gives exactly n, the
+    oldest first, topped up with silence if there aren't enough (an
+    underrun). With a source (JitterBuffer.get: a packet, any length, per
+    call) read() pulls from it until there are. Past `capacity` the
+    oldest samples are dropped (an overflow).
+
+    read() and blocks() give a view of a buffer the next one overwrites.
+    Nothing is allocated after the first read of the biggest size. For
+    one thread: the sound card callback's.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.available = 0
+        self.underruns = 0          # reads topped up with silence
+        self.overflows = 0          # samples dropped for want of room
+        self._ring = np.zeros(capacity, dtype=np.int16)
+        self._head = 0              # the oldest sample
+        self._out = np.zeros(0, dtype=np.int16)
+
+    def write(self, samples):
+        n = len(samples)
+        if n > self.capacity:
+            self.overflows += n - self.capacity
+            samples, n = samples[n - self.capacity:], self.capacity
+        excess = self.available + n - self.capacity
+        if excess > 0:
+            self._drop(excess)
+            self.overflows += excess
+        tail = (self._head + self.available) % self.capacity
+        first = min(n, self.capacity - tail)
+        np.copyto(self._ring[tail:tail + first], samples[:first], casting='unsafe')
+        np.copyto(self._ring[:n - first], samples[first:], casting='unsafe')
+        self.available += n
+
+    def read(self, n, source=None):
+        while source is not None and self.available < n:
+            samples = source()
+            if samples is None or len(samples) == 0:
+                break
+            self.write(samples)
+        if n > len(self._out):
+            self._out = np.zeros(n, dtype=np.int16)
+        out = self._out[:n]
+        m = min(n, self.available)
+        first = min(m, self.capacity - self._head)
+        out[:first] = self._ring[self._head:self._head + first]
+        out[first:m] = self._ring[:m - first]
+        if m < n:
+            out[m:] = 0
+            self.underruns += 1
+        self._drop(m)
+        return out
+
+    def blocks(self, n):
+        """Exactly n samples at a time while there are that many."""
+        while self.available >= n:
+            yield self.read(n)
+
+    def clear(self):
+        self._drop(self.available)
+
+    def _drop(self, n):
+        self._head = (self._head + n) % self.capacity
+        self.available -= n
+
+    def stats(self):
+        return {'available': self.available, 'underruns': self.underruns, 'overflows': self.overflows}
@@ -2,52 +2,23 @@ import smbus
 import time
 import math
 
+from imu_calibration import calibrate
+from mpu6050 import MPU6050
+
 bus = smbus.SMBus(1)
 ADDR = 0x68
 
-bus.write_byte_data(ADDR, 0x6B, 0)   # wake sensor
-
-ACCEL_XOUT_H = 0x3B
-GYRO_XOUT_H  = 0x43
-
-def read_word(reg):
-    high = bus.read_byte_data(ADDR, reg)
-    low = bus.read_byte_data(ADDR, reg + 1)
-    val = (high << 8) | low
-    if val > 32767:
-        val -= 65536
-    return val
+mpu = MPU6050(bus, ADDR)   # wake sensor, 200 Hz
 
 # ------------------------------ CALIBRATION ------------------------------
-print("Calibrating... Keep MPU6050 totally still!")
-time.sleep(2)
-
-ax_off = ay_off = az_off = 0
-gx_off = gy_off = gz_off = 0
-samples = 200
-
 pitch = 0
 roll = 0
 yaw = 0
 
-for i in range(samples):
-    ax_off += read_word(ACCEL_XOUT_H)
-    ay_off += read_word(ACCEL_XOUT_H+2)
-    az_off += read_word(ACCEL_XOUT_H+4)
-
-    gx_off += read_word(GYRO_XOUT_H)
-    gy_off += read_word(GYRO_XOUT_H+2)
-    gz_off += read_word(GYRO_XOUT_H+4)
-    time.sleep(0.005)
+# Cached offsets (imu_calibration.py), measured afresh if missing or off
+(ax_off, ay_off, az_off, gx_off, gy_off, gz_off), source = calibrate(mpu)
 
-ax_off /= samples
-ay_off /= samples
-az_off = (az_off / samples) - 16384   # remove gravity
-gx_off /= samples
-gy_off /= samples
-gz_off /= samples
-
-print("Calibration Done!")
+print(f"Calibration Done! ({source})")
 print("Accel offsets:", ax_off, ay_off, az_off)
 print("Gyro offsets : ", gx_off, gy_off, gz_off)
 print("---------------------------------------")
@@ -60,14 +31,15 @@ while True:
     dt = now - last_time
     last_time = now
     
-    # read raw
-    ax = read_word(ACCEL_XOUT_H) - ax_off
-    ay = read_word(ACCEL_XOUT_H+2) - ay_off
-    az = read_word(ACCEL_XOUT_H+4) - az_off
+    # read raw (one burst read)
+    ax, ay, az, gx, gy, gz = mpu.read_raw()
+    ax -= ax_off
+    ay -= ay_off
+    az -= az_off
 
-    gx = read_word(GYRO_XOUT_H) - gx_off
-    gy = read_word(GYRO_XOUT_H+2) - gy_off
-    gz = read_word(GYRO_XOUT_H+4) - gz_off
+    gx -= gx_off
+    gy -= gy_off
+    gz -= gz_off
 
     # convert to g?s and deg/sec
     ax /= 16384.0
@@ -102,46 +74,18 @@ import smbus
 import time
 import math
 
+from imu_calibration import calibrate
+from mpu6050 import MPU6050
+
 # ------------------ MPU SETUP ------------------
 bus = smbus.SMBus(1)
 ADDR = 0x68
-bus.write_byte_data(ADDR, 0x6B, 0)
-
-ACCEL_XOUT_H = 0x3B
-GYRO_XOUT_H  = 0x43
-
-def read_word(reg):
-    high = bus.read_byte_data(ADDR, reg)
-    low  = bus.read_byte_data(ADDR, reg+1)
-    val = (high << 8) | low
-    if val > 32767: val -= 65536
-    return val
+mpu = MPU6050(bus, ADDR)
 
 # ------------------ OFFSETS (CALIBRATE ON START) ------------------
-print("Calibrating MPU6050...")
-time.sleep(2)
-
-ax_off = ay_off = az_off = 0
-gx_off = gy_off = gz_off = 0
-samples = 200
-
-for i in range(samples):
-    ax_off += read_word(ACCEL_XOUT_H)
-    ay_off += read_word(ACCEL_XOUT_H+2)
-    az_off += read_word(ACCEL_XOUT_H+4)
-    gx_off += read_word(GYRO_XOUT_H)
-    gy_off += read_word(GYRO_XOUT_H+2)
-    gz_off += read_word(GYRO_XOUT_H+4)
-    time.sleep(0.005)
-
-ax_off /= samples
-ay_off /= samples
-az_off = (az_off / samples) - 16384   # remove gravity
-gx_off /= samples
-gy_off /= samples
-gz_off /= samples
-
-print("Calibration complete.")
+(ax_off, ay_off, az_off, gx_off, gy_off, gz_off), source = calibrate(mpu)
+
+print(f"Calibration complete ({source}).")
 
 # ------------------ STATE VARIABLES ------------------
 pitch = 0.0
@@ -170,12 +114,13 @@ def get_xy():
     last_t = now
 
     # ---- read raw ----
-    ax = read_word(ACCEL_XOUT_H)   - ax_off
-    ay = read_word(ACCEL_XOUT_H+2) - ay_off
-    az = read_word(ACCEL_XOUT_H+4) - az_off
-    gx = read_word(GYRO_XOUT_H)    - gx_off
-    gy = read_word(GYRO_XOUT_H+2)  - gy_off
-    gz = read_word(GYRO_XOUT_H+4)  - gz_off
+    ax, ay, az, gx, gy, gz = mpu.read_raw()
+    ax -= ax_off
+    ay -= ay_off
+    az -= az_off
+    gx -= gx_off
+    gy -= gy_off
+    gz -= gz_off
 
     # ---- convert units ----
     ax /= 16384.0
@@ -0,0 +1,140 @@
+# audio_codec.py
+# What goes in the audio packets' payload (audio_protocol.py): Opus, or
+# plain 16 bit PCM. Opus at 24 kbit/s is ~1/30 of the PCM bandwidth.
+# Keep robot/audio_codec.py and controller/audio_codec.py the same.
+#
+#   codec = make_codec('opus', bitrate=24000, frame_ms=20)
+#   payload = codec.encode(samples)             # codec.frame int16 samples
+#   decoder = PayloadDecoder()                  # receiver: any payload type
+#   samples = decoder.decode(packet)
+#
+# Opus needs opuslib (pip install opuslib) and libopus (apt install
+# libopus0); without them the sender falls back to PCM.
+import numpy as np
+
+SAMPLERATE = 48000
+PCM_PT = 96                 # L16/48000/1, as in stream.sdp
+OPUS_PT = 97                # opus/48000/1
+OPUS_FRAMES_MS = (2.5, 5, 10, 20, 40, 60)
+MAX_FRAME = SAMPLERATE * 120 // 1000    # longest Opus packet, samples
+
+
+class PcmCodec:
+    """L16 (RFC 3551): big endian int16, as RTP tools expect it."""
+    name = 'pcm'
+    payload_type = PCM_PT
+
+    def __init__(self, sample_rate=SAMPLERATE, frame_ms=20, **options):
+        self.sample_rate = sample_rate
+        self.frame = int(sample_rate * frame_ms / 1000)
+
+    def encode(self, samples):
+        return np.asarray(samples, dtype='>i2').tobytes()
+
+    def decode(self, payload):
+        return np.frombuffer(payload, dtype='>i2').astype(np.int16)
+
+    def conceal(self, following=None):
+        return None         # jitter_buffer.py repeats and fades instead
+
+
+class OpusCodec:
+    """
+    Mono VoIP Opus at `bitrate`, one frame_ms frame per packet. With fec
+    each packet also carries a low bitrate copy of the one before, which
+    conceal() uses when that one is lost and this one is in; otherwise
+    conceal() is Opus's own loss concealment.
+    """
+    name = 'opus'
+    payload_type = OPUS_PT
+
+    def __init__(self, sample_rate=SAMPLERATE, frame_ms=20, bitrate=24000, fec=True,
+                 expected_loss=5, complexity=5):
+        import opuslib
+        if frame_ms not in OPUS_FRAMES_MS:
+            raise ValueError(f"Opus frames are {OPUS_FRAMES_MS} ms, not {frame_ms}")
+        self.sample_rate = sample_rate
+        self.frame = int(sample_rate * frame_ms / 1000)
+        self.bitrate = bitrate
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self.encoder.bitrate = bitrate
+        self.encoder.complexity = complexity
+        self.encoder.inband_fec = int(fec)
+        self.encoder.packet_loss_perc = expected_loss
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+        self.last_frame = self.frame
+
+    def encode(self, samples):
+        pcm = np.zeros(self.frame, dtype=np.int16)
+        n = min(self.frame, len(samples))
+        pcm[:n] = samples[:n]
+        return self.encoder.encode(pcm.tobytes(), self.frame)
+
+    def decode(self, payload):
+        pcm = np.frombuffer(self.decoder.decode(bytes(payload), MAX_FRAME), dtype=np.int16)
+        self.last_frame = len(pcm)
+        return pcm
+
+    def conceal(self, following=None):
+        # An empty packet is a lost one to libopus
+        data, fec = (bytes(following), True) if following else (b'', False)
+        return np.frombuffer(self.decoder.decode(data, self.last_frame, decode_fec=fec), dtype=np.int16)
+
+
+CODECS = {codec.name: codec for codec in (PcmCodec, OpusCodec)}
+
+
+def make_codec(name='opus', sample_rate=SAMPLERATE, frame_ms=20, **options):
+    """The sender's codec; PCM if Opus was asked for and isn't installed."""
+    try:
+        return CODECS[name](sample_rate, frame_ms, **options)
+    except (ImportError, OSError) as e:
+        print(f"Audio: can't use {name} ({e}), sending PCM.")
+        return PcmCodec(sample_rate, frame_ms)
+
+
+class PayloadDecoder:
+    """
+    The receiver's side: decodes audio_protocol packets by payload type,
+    so it plays whatever the peer sends. Made for JitterBuffer(decoder=),
+    which calls it in playout order, as a stateful codec like Opus needs.
+    """
+
+    def __init__(self, sample_rate=SAMPLERATE):
+        self.sample_rate = sample_rate
+        self.codecs = {}
+        self.current = None
+        self.errors = 0
+
+    def _codec(self, payload_type):
+        if payload_type not in self.codecs:
+            codec = None
+            for cls in CODECS.values():
+                if cls.payload_type == payload_type:
+                    try:
+                        codec = cls(self.sample_rate)
+                    except (ImportError, OSError) as e:
+                        print(f"Audio: can't decode {cls.name} ({e}), it will be silent.")
+            self.codecs[payload_type] = codec
+        return self.codecs[payload_type]
+
+    def decode(self, packet):
+        codec = self._codec(packet.payload_type)
+        if codec is None:
+            return None
+        self.current = codec
+        try:
+            return codec.decode(packet.payload)
+        except Exception:       # opuslib.OpusError on a corrupt packet
+            self.errors += 1
+            return None
+
+    def conceal(self, following=None):
+        if self.current is None:
+            return None
+        same = following is not None and following.payload_type == self.current.payload_type
+        try:
+            return self.current.conceal(following.payload if same else None)
+        except Exception:
+            self.errors += 1
+            return None
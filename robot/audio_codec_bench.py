@@ -0,0 +1,106 @@
+# audio_codec_bench.py
+# Bandwidth and CPU of the voice link's codecs (audio_codec.py) on a
+# recording: the old bare 1024 sample PCM packets, PCM over RTP, and Opus
+# at a few bitrates with 10 and 20 ms frames. Every packet also goes
+# through the RTP layer and the jitter buffer and must come out the same.
+# One CPU core, like the Pi Zero. Opus needs opuslib and libopus.
+#
+#   python audio_codec_bench.py [file.wav]
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+from audio_codec import PCM_PT, CODECS, PayloadDecoder
+from audio_protocol import AudioDecoder, AudioEncoder
+from jitter_buffer import JitterBuffer
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+WAV = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'test1.wav')
+SAMPLERATE = 48000
+OVERHEAD = 8 + 20           # UDP + IPv4 header bytes per packet (ZeroTier adds its own on top)
+RUNS = [                    # codec, frame ms, bitrate
+    ('pcm', 20, None),
+    ('pcm', 10, None),
+    ('opus', 20, 12000),
+    ('opus', 20, 24000),
+    ('opus', 20, 32000),
+    ('opus', 20, 64000),
+    ('opus', 10, 24000),
+    ('opus', 10, 32000),
+]
+# -------------------------
+
+
+def load(path):
+    """Mono int16 at 48 kHz: the first channel, whatever the sample width."""
+    with wave.open(path) as w:
+        if w.getframerate() != SAMPLERATE:
+            raise SystemExit(f"{path} is {w.getframerate()} Hz, {SAMPLERATE} needed")
+        width, channels = w.getsampwidth(), w.getnchannels()
+        data = w.readframes(w.getnframes())
+    dtype = {1: np.uint8, 2: '<i2', 4: '<i4'}[width]
+    samples = np.frombuffer(data, dtype=dtype).reshape(-1, channels)[:, 0].astype(np.int64)
+    if width == 1:
+        samples = (samples - 128) << 8
+    return (samples >> (8 * width - 16)).astype(np.int16)
+
+
+def run(samples, name, frame_ms, bitrate):
+    options = {} if bitrate is None else {'bitrate': bitrate}
+    codec = CODECS[name](SAMPLERATE, frame_ms, **options)
+    frame = codec.frame
+    frames = [samples[i:i + frame] for i in range(0, len(samples) - frame + 1, frame)]
+    encoder = AudioEncoder(codec)
+    start = time.process_time()
+    packets = [encoder.encode(f) for f in frames]
+    encode = time.process_time() - start
+
+    rtp = AudioDecoder()
+    buffer = JitterBuffer(frame, SAMPLERATE, decoder=PayloadDecoder(SAMPLERATE))
+    out = []
+    start = time.process_time()
+    for i, data in enumerate(packets):
+        packet = rtp.decode(data)
+        buffer.put(packet.seq, packet.timestamp, packet, arrival=i * frame / SAMPLERATE)
+        out.append(buffer.get(now=i * frame / SAMPLERATE + 0.001))
+    decode = time.process_time() - start
+
+    seconds = len(frames) * frame / SAMPLERATE
+    wire = sum(len(p) + OVERHEAD for p in packets) * 8 / seconds / 1000
+    played = np.concatenate(out)
+    reference = np.concatenate(frames)
+    if codec.payload_type == PCM_PT:
+        quality = 'bit exact' if np.array_equal(played, reference) else 'MISMATCH'
+    else:
+        # Opus has ~6.5 ms of delay: line up before comparing
+        delay = int(np.argmax(np.correlate(played[:SAMPLERATE].astype(float),
+                                           reference[:SAMPLERATE // 2].astype(float), 'valid')))
+        error = played[delay:].astype(float) - reference[:len(played) - delay]
+        quality = f"SNR {10 * np.log10(np.mean(reference.astype(float) ** 2) / np.mean(error ** 2)):5.1f} dB"
+    label = f"{name} {frame_ms} ms" + (f" {bitrate // 1000} kbit/s" if bitrate else "")
+    print(f"{label:<22} {np.mean([len(p) for p in packets]):7.0f} B/packet {wire:7.1f} kbit/s on the wire  "
+          f"encode {encode / len(frames) * 1e6:6.0f} us  decode+buffer {decode / len(frames) * 1e6:6.0f} us/frame  "
+          f"{(encode + decode) / seconds * 100:5.2f}% of a core  {quality}")
+    return quality != 'MISMATCH'
+
+
+if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+samples = load(WAV)
+print(f"{os.path.basename(WAV)}: {len(samples) / SAMPLERATE:.1f} s, per direction, one core")
+# What the link sent before: bare 1024 sample packets, no header
+old = (1024 * 2 + OVERHEAD) * 8 * SAMPLERATE / 1024 / 1000
+print(f"{'old bare PCM 1024':<22} {1024 * 2:7d} B/packet {old:7.1f} kbit/s on the wire")
+failures = 0
+for name, frame_ms, bitrate in RUNS:
+    try:
+        failures += not run(samples, name, frame_ms, bitrate)
+    except (ImportError, OSError) as e:
+        print(f"{name} {frame_ms} ms{f' {bitrate // 1000} kbit/s' if bitrate else ''}: skipped, {e} "
+              f"(pip install opuslib; apt install libopus0)")
+print("All checks passed" if not failures else f"{failures} check(s) failed")
@@ -0,0 +1,84 @@
+# audio_dsp.py
+# The sample work in the sound card callbacks: gain, saturation to int16
+# and mono to stereo, done in arrays made once, straight into outdata.
+# The old chunk * GAIN, np.clip, astype, np.column_stack, astype made five
+# new arrays a block, in a thread that has a few ms to spare.
+# audio_dsp_bench.py has the numbers.
+# Keep robot/audio_dsp.py and controller/audio_dsp.py the same.
+#
+#   speaker = Playback(FRAMESIZE, GAIN)
+#   speaker.write(audio_buffer.get(), outdata)      # playback callback
+#   mic = Capture(FRAMESIZE, GAIN)
+#   audio_session.send(mic.read(indata))            # record callback
+import numpy as np
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+def _work(frames, gain):
+    # int32 holds any int16 times a gain up to 65536 exactly; else float32
+    return np.empty(frames, dtype=np.int32 if float(gain).is_integer() else np.float32)
+
+
+def _gain(work, gain):
+    """work *= gain, saturated to int16, in place. np.clip(out=) is ~3x slower."""
+    dtype = work.dtype.type
+    np.multiply(work, dtype(gain), out=work)
+    np.minimum(work, dtype(INT16_MAX), out=work)
+    np.maximum(work, dtype(INT16_MIN), out=work)
+
+
+class Playback:
+    """
+    write() puts `chunk` (int16 mono) times gain, saturated, in every
+    channel of outdata (frames x channels int16, as sounddevice gives
+    it). Frames past the end of the chunk are silence.
+    """
+
+    def __init__(self, frames, gain=1):
+        self.gain = gain
+        self._work = _work(frames, gain)
+
+    def write(self, chunk, outdata):
+        n = min(len(chunk), len(outdata))
+        if n > len(self._work):
+            self._work = _work(n, self.gain)    # a bigger block than asked for: once
+        work = self._work[:n]
+        np.copyto(work, chunk[:n])
+        if self.gain != 1:
+            _gain(work, self.gain)
+        # A channel at a time: quicker than one broadcast copy into interleaved samples
+        for channel in range(outdata.shape[1]):
+            np.copyto(outdata[:n, channel], work, casting='unsafe')
+        if n < len(outdata):
+            outdata[n:] = 0
+
+
+class Capture:
+    """
+    read() gives one channel of indata times gain, saturated, as int16:
+    a view of a buffer that the next read() overwrites, so use it (send
+    it) before then.
+    """
+
+    def __init__(self, frames, gain=1, channel=0):
+        self.gain = gain
+        self.channel = channel
+        self._work = _work(frames, gain)
+        self._out = np.empty(frames, dtype=np.int16)
+
+    def read(self, indata):
+        n = len(indata)
+        if n > len(self._out):
+            self._work = _work(n, self.gain)
+            self._out = np.empty(n, dtype=np.int16)
+        out = self._out[:n]
+        if self.gain == 1:
+            np.copyto(out, indata[:, self.channel], casting='unsafe')
+            return out
+        work = self._work[:n]
+        np.copyto(work, indata[:, self.channel])
+        _gain(work, self.gain)
+        np.copyto(out, work, casting='unsafe')
+        return out
@@ -0,0 +1,124 @@
+# audio_dsp_bench.py
+# The sound card callbacks' sample work, the old way (a new array per
+# step) against audio_dsp.py (into buffers made once): time per block,
+# a histogram of callback durations, how much of the block period that
+# is, and the memory each callback allocates. The playback callback is
+# also timed with the jitter buffer's get() in front, as bot_main runs it.
+# One CPU core, like the Pi Zero; run it on the Pi for its own numbers.
+#
+#   python audio_dsp_bench.py [calls]
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio_dsp import Capture, Playback
+from jitter_buffer import JitterBuffer
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+SAMPLERATE = 48000
+BLOCKS = (960, 1024)        # 20 ms frames (bot_main, control_main) and the audio_test scripts' 1024
+GAIN = 4
+BUCKETS_US = (5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+# -------------------------
+
+
+# The callbacks as they were
+def old_playback(chunk, outdata):
+    chunk = np.clip(chunk.astype(np.int32) * GAIN, -32768, 32767).astype(np.int16)
+    stereo = np.column_stack([chunk, chunk]).astype(np.int16)
+    outdata[:] = stereo
+
+
+def old_record(indata):
+    mono = indata[:, 0].astype(np.int16)
+    return np.clip(mono.astype(np.int32) * GAIN, -32768, 32767).astype(np.int16)
+
+
+def durations(call, calls):
+    out = np.empty(calls)
+    for i in range(calls):
+        start = time.perf_counter_ns()
+        call()
+        out[i] = time.perf_counter_ns() - start
+    return out / 1000
+
+
+def allocated(call):
+    """Most bytes a call has allocated at once (numpy's arrays included)."""
+    call()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - before
+
+
+def histogram(times):
+    edges = (0,) + BUCKETS_US + (np.inf,)
+    counts, _ = np.histogram(times, edges)
+    return counts
+
+
+def run(label, call, calls, period_us, rows):
+    gc.collect()
+    times = durations(call, calls)
+    rows.append((label, times))
+    print(f"  {label:<34} mean {times.mean():7.1f} p50 {np.percentile(times, 50):7.1f} "
+          f"p99 {np.percentile(times, 99):7.1f} max {times.max():8.1f} us  "
+          f"{times.mean() / period_us * 100:5.2f}% of the block  {allocated(call):6d} B allocated")
+
+
+def print_histogram(rows):
+    names = [f"<{b}" for b in BUCKETS_US] + [f">={BUCKETS_US[-1]}"]
+    print(f"  {'callback durations, us':<34} " + ' '.join(f"{n:>7}" for n in names))
+    for label, times in rows:
+        print(f"  {label:<34} " + ' '.join(f"{c:7d}" for c in histogram(times)))
+
+
+if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+rng = np.random.default_rng(1)
+failures = 0
+print(f"{CALLS} calls each, gain {GAIN}, one core")
+for frames in BLOCKS:
+    period_us = frames / SAMPLERATE * 1e6
+    print(f"{frames} sample blocks ({period_us / 1000:.1f} ms):")
+    chunk = (rng.normal(0, 6000, frames)).clip(-32768, 32767).astype(np.int16)   # some of it clips at gain 4
+    indata = np.column_stack([chunk, chunk[::-1]])
+    outdata = np.zeros((frames, 2), dtype=np.int16)
+    speaker = Playback(frames, GAIN)
+    mic = Capture(frames, GAIN)
+
+    # Same samples out either way
+    expected = outdata.copy()
+    old_playback(chunk, expected)
+    speaker.write(chunk, outdata)
+    failures += not np.array_equal(outdata, expected)
+    failures += not np.array_equal(mic.read(indata), old_record(indata))
+
+    buffer = JitterBuffer(frames, SAMPLERATE)
+    seq = [0]
+
+    def from_buffer():
+        # One packet in, one frame out: the jitter buffer's share of the callback
+        buffer.put(seq[0] & 0xFFFF, seq[0] * frames & 0xFFFFFFFF, chunk, arrival=seq[0] * frames / SAMPLERATE)
+        seq[0] += 1
+        return buffer.get(now=seq[0] * frames / SAMPLERATE)
+
+    rows = []
+    run("playback, old", lambda: old_playback(chunk, outdata), CALLS, period_us, rows)
+    run("playback, audio_dsp", lambda: speaker.write(chunk, outdata), CALLS, period_us, rows)
+    run("record, old", lambda: old_record(indata), CALLS, period_us, rows)
+    run("record, audio_dsp", lambda: mic.read(indata), CALLS, period_us, rows)
+    run("jitter buffer + playback, old", lambda: old_playback(from_buffer(), outdata), CALLS, period_us, rows)
+    run("jitter buffer + playback, audio_dsp", lambda: speaker.write(from_buffer(), outdata), CALLS, period_us, rows)
+    print_histogram(rows)
+print("All checks passed" if not failures else f"{failures} check(s) failed: output differs")
@@ -0,0 +1,431 @@
+# audio_protocol.py
+# Audio packets, both ways (UDP port 7000): RTP (RFC 3550) carrying the
+# payload types in stream.sdp, so ffplay/ffmpeg can listen in
+# (ffplay -protocol_whitelist file,udp,rtp -i stream.sdp, with the
+# sender's PEER_IP pointed at that machine):
+#   97  opus/48000/1    audio_codec.OpusCodec
+#   96  L16/48000/1     audio_codec.PcmCodec, uncompressed
+# The sequence number and timestamp let the receiver's jitter buffer
+# (jitter_buffer.py) put packets back in order and tell lost from late.
+# RTCP (RFC 3550 section 6) shares the socket (RFC 5761, a=rtcp-mux in
+# stream.sdp): each end reports what it receives, loss and interarrival
+# jitter, back to the other every ~5 s, with a sender report mapping its
+# RTP timestamps to its wall clock.
+# Keep robot/audio_protocol.py and controller/audio_protocol.py the same.
+#
+#   session = RtpSession(AudioEncoder(codec), sock, (PEER_IP, UDP_PORT)).start()
+#   session.send(samples)                   # record callback
+#   packet = session.receive(data)          # receiver thread: RtpPacket, or None
+import getpass
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# -----------------------------
+# RTP fixed header (12 bytes, network byte order), then the payload
+# -----------------------------
+#   V P X CC   B   version 2, no padding, no extension, no CSRCs
+#   M PT       B   marker (first packet of a talk spurt), payload type
+#   seq        H   +1 per packet, wraps, random start
+#   timestamp  I   48 kHz sample count of the first sample, random start
+#   ssrc       I   random per sender start
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_VERSION = 2
+# recvfrom() size: more than any packet the peers send (20 ms of PCM is 1932)
+MAX_PACKET = 8192
+
+U16 = 0xFFFF
+U32 = 0xFFFFFFFF
+
+RtpPacket = namedtuple('RtpPacket', 'payload_type marker seq timestamp ssrc payload')
+
+# -----------------------------
+# RTCP: compound packets of these, each a 4 byte header then 32 bit words
+# -----------------------------
+#   V P RC     B   version 2, no padding, count of report blocks (or SDES chunks, BYE sources)
+#   PT         B   packet type
+#   length     H   in 32 bit words, minus one
+#   ssrc       I   the sender of the report
+RTCP_HEADER = struct.Struct('!BBHI')
+RTCP_SR = 200               # sender report: SENDER_INFO, then report blocks
+RTCP_RR = 201               # receiver report: report blocks
+RTCP_SDES = 202             # source description: the CNAME
+RTCP_BYE = 203              # leaving
+RTCP_APP = 204
+#   NTP time   II  wall clock when the report was sent, seconds since 1900, 32.32 fixed point
+#   timestamp  I   the RTP timestamp of the same instant
+#   packets    I   sent so far
+#   octets     I   payload bytes sent so far
+SENDER_INFO = struct.Struct('!IIIII')
+#   ssrc       I   the source reported on
+#   lost       I   fraction lost since the last report (8 bits, /256), then cumulative lost (24 bit signed)
+#   highest    I   extended highest seq received: wrap count << 16 | seq
+#   jitter     I   interarrival jitter, timestamp units
+#   LSR        I   middle 32 bits of the NTP time in the last sender report from that source
+#   DLSR       I   1/65536 s since it came in
+REPORT_BLOCK = struct.Struct('!IIIIII')
+NTP_EPOCH = 2208988800      # 1900 to 1970, s
+
+REPORT_INTERVAL = 5.0       # s between reports, randomised 0.5-1.5x (RFC 3550 6.2)
+SOURCE_TIMEOUT = 2.0        # s the peer's stream is silent before another SSRC can take over
+MAX_DROPOUT = 3000          # RFC 3550 A.1: seq jumps ahead of this many are a resync...
+MAX_MISORDER = 100          # ...and this many behind are late packets
+
+ReportBlock = namedtuple('ReportBlock', 'ssrc fraction_lost lost highest_seq jitter lsr dlsr')
+
+
+def _ntp(t):
+    return int(t) + NTP_EPOCH, int(t % 1 * (1 << 32))
+
+
+def _ntp_middle(t):
+    seconds, fraction = _ntp(t)
+    return (seconds & U16) << 16 | fraction >> 16
+
+
+def is_rtcp(data):
+    """RTCP or RTP, on a shared socket (RFC 5761 section 4)."""
+    return len(data) >= RTCP_HEADER.size and data[0] >> 6 == RTP_VERSION and RTCP_SR <= data[1] <= RTCP_APP
+
+
+class AudioEncoder:
+    """The sender's side: one codec frame (audio_codec.py) per packet."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.ssrc = int.from_bytes(os.urandom(4), 'little')
+        self.seq = int.from_bytes(os.urandom(2), 'little')
+        self.timestamp = int.from_bytes(os.urandom(4), 'little')
+        self.marker = True
+        self.packets = 0
+        self.bytes = 0
+        self.octets = 0             # payload bytes, for sender reports
+
+    def encode(self, samples):
+        payload = self.codec.encode(samples)
+        packet = RTP_HEADER.pack(RTP_VERSION << 6, self.marker << 7 | self.codec.payload_type,
+                                 self.seq, self.timestamp, self.ssrc) + payload
+        self.marker = False
+        self.seq = (self.seq + 1) & U16
+        self.timestamp = (self.timestamp + len(samples)) & U32
+        self.packets += 1
+        self.bytes += len(packet)
+        self.octets += len(payload)
+        return packet
+
+    def skip(self, samples):
+        """
+        Samples not sent (a muted mic): the timestamp runs on over them and
+        the next packet starts a talk spurt, with the marker bit (RFC 3550 5.1).
+        """
+        self.timestamp = (self.timestamp + samples) & U32
+        self.marker = True
+
+
+class AudioDecoder:
+    """
+    decode() gives an RtpPacket, or None for one that isn't RTP version 2.
+    CSRCs, a header extension and padding (other RTP senders) are skipped.
+    """
+
+    def __init__(self):
+        self.accepted = 0
+        self.malformed = 0
+
+    def decode(self, data):
+        if len(data) < RTP_HEADER.size:
+            self.malformed += 1
+            return None
+        first, second, seq, timestamp, ssrc = RTP_HEADER.unpack_from(data)
+        start = RTP_HEADER.size + 4 * (first & 0x0F)
+        end = len(data)
+        if first & 0x10 and end >= start + 4:      # extension: 4 byte header, then words
+            start += 4 + 4 * int.from_bytes(data[start + 2:start + 4], 'big')
+        if first & 0x20 and end > start:            # padding: count in the last byte
+            end -= data[-1]
+        if first >> 6 != RTP_VERSION or end < start:
+            self.malformed += 1
+            return None
+        self.accepted += 1
+        return RtpPacket(second & 0x7F, bool(second & 0x80), seq, timestamp, ssrc, data[start:end])
+
+
+class SourceStats:
+    """
+    What's come in from one SSRC, as RFC 3550 appendix A keeps it: the
+    extended highest seq (A.1; a big jump is taken as a resync once the
+    packet after it follows on), expected against received packets for
+    the loss (A.3), and the interarrival jitter in timestamp units (A.8).
+    """
+
+    def __init__(self, ssrc, seq, clock_rate, arrival):
+        self.ssrc = ssrc
+        self.clock_rate = clock_rate
+        self.heard = arrival
+        self.jitter = 0.0
+        self.last_sr = 0            # middle of the NTP time in its last sender report...
+        self.last_sr_at = None      # ...and when that came in, on our clock
+        self.sender_clock = None    # (wall clock s, RTP timestamp) from that report
+        self._start(seq)
+
+    def _start(self, seq):
+        self.base_seq = seq
+        self.max_seq = seq
+        self.cycles = 0
+        self.received = 0
+        self._bad_seq = None
+        self._expected_prior = 0
+        self._received_prior = 0
+        self._transit = None
+
+    def update(self, seq, timestamp, arrival):
+        """False for a packet that isn't counted: a jump that might be a resync."""
+        delta = (seq - self.max_seq) & U16
+        if delta < MAX_DROPOUT:
+            if seq < self.max_seq:
+                self.cycles += U16 + 1
+            self.max_seq = seq
+        elif delta <= U16 + 1 - MAX_MISORDER:
+            if seq != self._bad_seq:
+                self._bad_seq = (seq + 1) & U16
+                return False
+            self._start(seq)        # two in a row: the sender restarted
+        self.received += 1
+        self.heard = arrival
+        transit = arrival * self.clock_rate - timestamp
+        if self._transit is not None:
+            d = (transit - self._transit + 0x80000000) % (U32 + 1) - 0x80000000
+            self.jitter += (abs(d) - self.jitter) / 16
+        self._transit = transit
+        return True
+
+    @property
+    def expected(self):
+        return self.cycles + self.max_seq - self.base_seq + 1
+
+    @property
+    def lost(self):
+        return self.expected - self.received     # duplicates make it go down
+
+    def interval(self):
+        """Fraction lost since the last call, 0-255 out of 256."""
+        expected = self.expected - self._expected_prior
+        received = self.received - self._received_prior
+        self._expected_prior = self.expected
+        self._received_prior = self.received
+        lost = expected - received
+        return 0 if expected <= 0 or lost <= 0 else min(255, (lost << 8) // expected)
+
+    def report_block(self, now):
+        lost = max(-0x800000, min(0x7FFFFF, self.lost)) & 0xFFFFFF
+        dlsr = 0 if self.last_sr_at is None else int((now - self.last_sr_at) * 65536)
+        return REPORT_BLOCK.pack(self.ssrc, self.interval() << 24 | lost, (self.cycles + self.max_seq) & U32,
+                                 int(self.jitter) & U32, self.last_sr, dlsr & U32)
+
+
+class RtpSession:
+    """
+    One end of the voice link on one socket: sends our stream (encoder,
+    an AudioEncoder; None to only listen), takes in the peer's, and
+    trades RTCP reports with it.
+
+    receive() sorts what comes in: the peer's RTP packets are counted in
+    a SourceStats and returned, RTCP is read and None returned. The
+    first SSRC heard is the peer; another one only takes over after it
+    has been quiet SOURCE_TIMEOUT, or said BYE. start() sends a report
+    every ~REPORT_INTERVAL: a sender report if we've sent since the last
+    one, else a receiver report, on what we're getting from the peer, and
+    our CNAME. From the peer's reports: how it hears us (peer_block) and
+    the round trip time. stats() has both sides.
+    """
+
+    def __init__(self, encoder=None, sock=None, address=None, sample_rate=48000, cname=None,
+                 clock=time.monotonic, wallclock=time.time):
+        self.encoder = encoder
+        self.sock = sock
+        self.address = address
+        self.sample_rate = sample_rate
+        self.ssrc = encoder.ssrc if encoder else int.from_bytes(os.urandom(4), 'little')
+        self.cname = (cname or f"{getpass.getuser()}@{socket.gethostname()}").encode()[:255]
+        self.clock = clock
+        self.wallclock = wallclock
+        self.decoder = AudioDecoder()
+        self.source = None          # SourceStats of the peer's stream
+        self.peer_block = None      # ReportBlock: the peer on our stream
+        self.rtt = None             # s
+        self.foreign = 0            # RTP packets from an SSRC that isn't the peer's
+        self.reports_sent = 0
+        self.reports_received = 0
+        self._lock = threading.Lock()
+        self._sent_at = None        # wall clock of the last packet we sent
+        self._reported_packets = 0
+
+    # -----------------------------
+    # Our stream
+    # -----------------------------
+    def encode(self, samples):
+        packet = self.encoder.encode(samples)
+        self._sent_at = self.wallclock()
+        return packet
+
+    def send(self, samples):
+        self.sock.sendto(self.encode(samples), self.address)
+
+    # -----------------------------
+    # The peer's
+    # -----------------------------
+    def receive(self, data, arrival=None):
+        arrival = self.clock() if arrival is None else arrival
+        if is_rtcp(data):
+            self._read_rtcp(data, arrival)
+            return None
+        packet = self.decoder.decode(data)
+        if packet is None:
+            return None
+        with self._lock:
+            if self.source is None or packet.ssrc != self.source.ssrc:
+                if self.source is not None and arrival - self.source.heard < SOURCE_TIMEOUT:
+                    self.foreign += 1
+                    return None
+                if self.source is not None:
+                    print(f"Audio: peer restarted (SSRC {self.source.ssrc:08x} -> {packet.ssrc:08x})")
+                self.source = SourceStats(packet.ssrc, packet.seq, self.sample_rate, arrival)
+            if not self.source.update(packet.seq, packet.timestamp, arrival):
+                return None
+        return packet
+
+    def source_time(self, timestamp):
+        """The peer's wall clock (time.time()) at an RTP timestamp of its stream, None before a sender report."""
+        source = self.source
+        if source is None or source.sender_clock is None:
+            return None
+        wall, reference = source.sender_clock
+        return wall + ((timestamp - reference + 0x80000000) % (U32 + 1) - 0x80000000) / self.sample_rate
+
+    # -----------------------------
+    # RTCP
+    # -----------------------------
+    def report(self):
+        """A compound RTCP packet: SR or RR, then SDES CNAME."""
+        with self._lock:
+            now, wall = self.clock(), self.wallclock()
+            blocks = b''
+            if self.source is not None and now - self.source.heard < SOURCE_TIMEOUT:
+                blocks = self.source.report_block(now)
+            count = len(blocks) // REPORT_BLOCK.size
+            encoder = self.encoder
+            if encoder is not None and encoder.packets > self._reported_packets:
+                self._reported_packets = encoder.packets
+                # Our RTP clock now: the next packet's timestamp is its first sample
+                timestamp = encoder.timestamp + int((wall - self._sent_at) * self.sample_rate)
+                body = SENDER_INFO.pack(*_ntp(wall), timestamp & U32, encoder.packets & U32,
+                                        encoder.octets & U32) + blocks
+                packet_type = RTCP_SR
+            else:
+                body, packet_type = blocks, RTCP_RR
+            out = RTCP_HEADER.pack(RTP_VERSION << 6 | count, packet_type, len(body) // 4 + 1, self.ssrc) + body
+            item = bytes([1, len(self.cname)]) + self.cname     # CNAME, then the end of the list
+            item += bytes(4 - len(item) % 4)
+            out += RTCP_HEADER.pack(RTP_VERSION << 6 | 1, RTCP_SDES, len(item) // 4 + 1, self.ssrc) + item
+            self.reports_sent += 1
+            return out
+
+    def bye(self):
+        return RTCP_HEADER.pack(RTP_VERSION << 6 | 1, RTCP_BYE, 1, self.ssrc)
+
+    def start(self, log_every=60):
+        """Report to the peer from a thread, and print stats every log_every s (0: never)."""
+        threading.Thread(target=self._report_loop, args=(log_every,), daemon=True).start()
+        return self
+
+    def _report_loop(self, log_every):
+        logged = self.clock()
+        while True:
+            time.sleep(REPORT_INTERVAL * random.uniform(0.5, 1.5))
+            if self.address is None:       # a receiver that hasn't heard from anyone yet
+                continue
+            try:
+                self.sock.sendto(self.report(), self.address)
+            except OSError as e:
+                print(f"Audio: RTCP report not sent ({e})")
+            if log_every and self.clock() - logged >= log_every:
+                print(self.format())
+                logged = self.clock()
+
+    def _read_rtcp(self, data, arrival):
+        offset = 0
+        while offset + RTCP_HEADER.size <= len(data):
+            first, packet_type, length, ssrc = RTCP_HEADER.unpack_from(data, offset)
+            end = offset + 4 * (length + 1)
+            if first >> 6 != RTP_VERSION or end > len(data):
+                self.decoder.malformed += 1
+                return
+            count = first & 0x1F
+            with self._lock:
+                source = self.source if self.source is not None and self.source.ssrc == ssrc else None
+                blocks = offset + RTCP_HEADER.size
+                if packet_type == RTCP_SR and blocks + SENDER_INFO.size <= end:
+                    seconds, fraction, timestamp, _, _ = SENDER_INFO.unpack_from(data, blocks)
+                    blocks += SENDER_INFO.size
+                    if source is not None:
+                        source.last_sr = (seconds & U16) << 16 | fraction >> 16
+                        source.last_sr_at = arrival
+                        source.sender_clock = (seconds - NTP_EPOCH + fraction / (1 << 32), timestamp)
+                if packet_type in (RTCP_SR, RTCP_RR) and blocks <= end:
+                    self.reports_received += 1
+                    for i in range(count):
+                        if blocks + REPORT_BLOCK.size * (i + 1) > end:
+                            break
+                        self._read_block(REPORT_BLOCK.unpack_from(data, blocks + REPORT_BLOCK.size * i))
+                elif packet_type == RTCP_BYE and self.source is not None:
+                    left = [int.from_bytes(data[blocks - 4 + 4 * i:blocks + 4 * i], 'big') for i in range(count)]
+                    if self.source.ssrc in left:
+                        print(f"Audio: peer {self.source.ssrc:08x} left")
+                        self.source = None
+            offset = end
+
+    def _read_block(self, fields):
+        ssrc, lost, highest, jitter, lsr, dlsr = fields
+        if ssrc != self.ssrc:
+            return
+        cumulative = lost & 0xFFFFFF
+        cumulative -= (cumulative & 0x800000) << 1
+        self.peer_block = ReportBlock(ssrc, (lost >> 24) / 256, cumulative, highest, jitter, lsr, dlsr)
+        if lsr:
+            rtt = ((_ntp_middle(self.wallclock()) - lsr - dlsr) & U32) / 65536
+            if rtt < 60:        # else a stale or mangled LSR
+                self.rtt = rtt
+
+    # -----------------------------
+    # Stats
+    # -----------------------------
+    def stats(self):
+        s = {'received': 0, 'expected': 0, 'lost': 0, 'loss_pct': 0.0, 'jitter_ms': 0.0,
+             'peer_loss_pct': None, 'peer_jitter_ms': None,
+             'rtt_ms': None if self.rtt is None else self.rtt * 1000,
+             'foreign': self.foreign, 'malformed': self.decoder.malformed,
+             'reports_sent': self.reports_sent, 'reports_received': self.reports_received}
+        source = self.source
+        if source is not None:
+            s.update(received=source.received, expected=source.expected, lost=max(0, source.lost),
+                     loss_pct=100 * max(0, source.lost) / max(1, source.expected),
+                     jitter_ms=source.jitter / self.sample_rate * 1000)
+        peer = self.peer_block
+        if peer is not None and self.encoder is not None:
+            s['peer_loss_pct'] = 100 * max(0, peer.lost) / max(1, self.encoder.packets)
+            s['peer_jitter_ms'] = peer.jitter / self.sample_rate * 1000
+        return s
+
+    def format(self, stats=None):
+        s = stats or self.stats()
+        out = (f"audio link: in {s['received']} packets, {s['loss_pct']:.1f}% lost, "
+               f"jitter {s['jitter_ms']:.1f} ms")
+        if s['peer_loss_pct'] is not None:
+            out += f"; peer hears {s['peer_loss_pct']:.1f}% lost, jitter {s['peer_jitter_ms']:.1f} ms"
+        if s['rtt_ms'] is not None:
+            out += f"; rtt {s['rtt_ms']:.0f} ms"
+        return out
@@ -1,21 +1,33 @@
 import sounddevice as sd
 import socket
-import numpy as np
+import threading
+from audio_codec import PcmCodec
+from audio_dsp import Capture
+from audio_protocol import MAX_PACKET, AudioEncoder, RtpSession
 
 UDP_IP = "192.168.192.103"  # <-- Mac's IP
 UDP_PORT = 7000
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.bind(("0.0.0.0", 0))    # any port: the receiver's RTCP reports come back to it
 
 samplerate = 48000
 framesize = 1024
 device_index = 1  # Check with `arecord -l` or `sd.query_devices()`
 
+# Uncompressed L16 over RTP
+audio_session = RtpSession(AudioEncoder(PcmCodec(samplerate)), sock, (UDP_IP, UDP_PORT), samplerate)
+mic = Capture(framesize)
+
 def callback(indata, frames, time, status):
     # if status:
     #     print(status)
-    mono = indata[:, 0].astype(np.int16)
-    sock.sendto(mono.tobytes(), (UDP_IP, UDP_PORT))
+    audio_session.send(mic.read(indata))
+
+def udp_listener():
+    while True:
+        data, _ = sock.recvfrom(MAX_PACKET)
+        audio_session.receive(data)
 
 with sd.InputStream(
     samplerate=samplerate,
@@ -26,4 +38,8 @@ with sd.InputStream(
     callback=callback
 ):
     print("🎤 Sending Pi mic audio to Mac...")
+    threading.Thread(target=udp_listener, daemon=True).start()
+    audio_session.start(log_every=10)
     input("Press Enter to stop.\n")
+    sock.sendto(audio_session.bye(), (UDP_IP, UDP_PORT))
+    print(audio_session.format())
@@ -0,0 +1,55 @@
+# bot_control.py
+# What bot_main.py hangs on the ControlEngine: the camera's pan/tilt
+# servos and the obstacle stop. sim_robot.py runs the same wiring on
+# simulated hardware.
+import time
+
+from control_engine import DRIVE_RATE, WATCHDOG_TIMEOUT, ControlEngine
+
+MAX_DIST = 90               # cm, no driving forward with anything closer
+SERVO_TILT = 1
+SERVO_PAN = 2
+SERVO_LIMITS = (10, 170)    # degrees
+
+
+class PanTilt:
+    """
+    on_command() for the ControlEngine: pan and tilt are absolute targets,
+    so a lost packet doesn't lose a step. A servo is only written when its
+    angle changes.
+    """
+
+    def __init__(self, kit, tilt=90, pan=90):
+        self.kit = kit
+        self.tilt = tilt
+        self.pan = pan
+        kit.servo[SERVO_TILT].angle = tilt
+        kit.servo[SERVO_PAN].angle = pan
+
+    def on_command(self, cmd):
+        low, high = SERVO_LIMITS
+        tilt = min(high, max(low, cmd.tilt))
+        if tilt != self.tilt:
+            self.tilt = tilt
+            self.kit.servo[SERVO_TILT].angle = tilt
+        pan = min(high, max(low, cmd.pan))
+        if pan != self.pan:
+            self.pan = pan
+            self.kit.servo[SERVO_PAN].angle = pan
+
+
+def obstacle_ahead(sonar, max_dist=MAX_DIST):
+    """
+    forward_blocked() for the ControlEngine: the sonar's latest reading at
+    every drive tick. Packets only come at the heartbeat rate while the
+    stick is steady, too slow to stop on.
+    """
+    return lambda: sonar.distance * 100 < max_dist
+
+
+def make_engine(sock, gpio, motors, pwm_left, pwm_right, kit, sonar, mixer=None,
+                timeout=WATCHDOG_TIMEOUT, rate=DRIVE_RATE, max_dist=MAX_DIST, clock=time.monotonic, **options):
+    mount = PanTilt(kit)
+    return ControlEngine(sock, gpio, motors, pwm_left, pwm_right, mixer=mixer, timeout=timeout, rate=rate,
+                         on_command=mount.on_command, forward_blocked=obstacle_ahead(sonar, max_dist),
+                         clock=clock, **options)
@@ -1,12 +1,22 @@
 # pi_controller_combined.py
 import socket, threading, time
-import RPi.GPIO as GPIO
-import smbus, math
-from gpiozero import DistanceSensor
-from adafruit_servokit import ServoKit
+import hal
 import sounddevice as sd
-import numpy as np
-import queue
+from audio_codec import PayloadDecoder, make_codec
+from audio_dsp import Capture, Playback
+from audio_protocol import MAX_PACKET, AudioEncoder, RtpSession
+from bot_control import make_engine
+from drive_mixer import DriveMixer
+from imu_calibration import BiasRefiner, CalibrationStore, calibrate
+from imu_service import ImuService
+from jitter_buffer import JitterBuffer
+from mpu6050 import MPU6050
+from sample_fifo import SampleFifo
+from sonar_service import SonarService
+
+# Real Pi parts, or simulated ones with ROBOT_HAL=sim
+hw = hal.load()
+GPIO = hw.GPIO
 
 
 # -----------------------------
@@ -19,6 +29,8 @@ MAC_PORT = 6001
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(("0.0.0.0", PI_PORT))
 
+WATCHDOG_TIMEOUT = 0.5      # seconds without a valid packet before the motors stop
+
 # -------------------------
 # Audio configaration
 # -------------------------
@@ -28,14 +40,29 @@ UDP_PORT = 7000
 INPUT_DEVICE =  0   # Voice HAT mic index (check with sd.query_devices())
 OUTPUT_DEVICE = 1   # USB PnP Sound Device index (check with sd.query_devices())
 
-FRAMESIZE = 1024
 SAMPLERATE = 48000
+AUDIO_CODEC = 'opus'        # or 'pcm', uncompressed (audio_codec.py)
+AUDIO_BITRATE = 24000       # bit/s, Opus
+AUDIO_FRAME_MS = 20         # per packet, 10 or 20 (less delay, more overhead); the ends needn't agree
+FRAMESIZE = SAMPLERATE * AUDIO_FRAME_MS // 1000     # samples per packet
+BLOCKSIZE = FRAMESIZE       # samples per sound card callback: any size (sample_fifo.py), 0 for the card's own
+AUDIO_REPORT_EVERY = 60     # s between link stats printouts; RTCP reports go every ~5 s
 GAIN = 4
 
 sock_audio = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock_audio.bind(("0.0.0.0", UDP_PORT))
 
-audio_queue = queue.Queue()
+# Received audio is put back in order and played at a delay that follows
+# the network's jitter (jitter_buffer.py)
+audio_buffer = JitterBuffer(FRAMESIZE, SAMPLERATE, decoder=PayloadDecoder(SAMPLERATE))
+audio_session = RtpSession(AudioEncoder(make_codec(AUDIO_CODEC, SAMPLERATE, AUDIO_FRAME_MS, bitrate=AUDIO_BITRATE)),
+                           sock_audio, (PEER_IP, UDP_PORT), SAMPLERATE).start(AUDIO_REPORT_EVERY)
+# Gain, saturation and stereo into buffers made once (audio_dsp.py)
+speaker = Playback(BLOCKSIZE, GAIN)
+mic = Capture(BLOCKSIZE)
+# Packets and sound card blocks needn't be the same size: these cut one into the other
+speaker_fifo = SampleFifo()
+mic_fifo = SampleFifo()
 
 # -----------------------------
 # Setup motors
@@ -53,147 +80,69 @@ GPIO.setup(12, GPIO.OUT)
 GPIO.setup(13, GPIO.OUT)
 
 PWM_freq = 1000
-angle_change = 5
 
-pwmA = GPIO.PWM(12, PWM_freq)
-pwmB = GPIO.PWM(13, PWM_freq)
+pwmA = GPIO.PWM(12, PWM_freq)   # left motor  (pins 22, 10)
+pwmB = GPIO.PWM(13, PWM_freq)   # right motor (pins 27, 17)
+pwmA.start(0)
+pwmB.start(0)
 
-rotation_duty = 80
-linier_duty = 60
+# -----------------------------
+# Drive mixer
+# -----------------------------
+# throttle/steer -> per wheel duty, with deadband, expo and slew limiting
+mixer = DriveMixer(deadband=0.08, expo=0.4, slew_rate=3.0, min_duty=25, max_duty=80)
+DRIVE_RATE = 50                 # Hz, PWM updates
 
 # -----------------------------
 # Servo setup
 # -----------------------------
-kit = ServoKit(channels=16)
+# Tilt on channel 1, pan on 2 (bot_control.py)
+kit = hw.ServoKit(channels=16)
 kit.frequency = 50
 
-SERVO1 = 1
-SERVO2 = 2
-
-vartical_angle = 90
-horizontal_angle = 90
-
-kit.servo[SERVO1].angle = vartical_angle
-kit.servo[SERVO2].angle = horizontal_angle
-
 
 # -----------------------------
 # Sonar & MPU6050 setup
 # -----------------------------
-ultra = DistanceSensor(echo=24, trigger=23)
+# Pinged on its own thread, echoes timed by edge callbacks; ultra.distance
+# is the latest median, in metres capped at 1 m as gpiozero's was
+SONAR_RATE = 10     # pings/s
+ultra = SonarService(GPIO, trigger=23, echo=24, rate=SONAR_RATE, max_distance=1.0,
+                     clock=hw.clock.monotonic, sleep=hw.clock.sleep).start()
 
-bus = smbus.SMBus(1)
+bus = hw.SMBus(1)
 ADDR = 0x68
-bus.write_byte_data(ADDR, 0x6B, 0)
-
-ACCEL_XOUT_H = 0x3B
-GYRO_XOUT_H  = 0x43
-
-obj_ditect = False
-max_dist = 90
-
-def read_word(reg):
-    high = bus.read_byte_data(ADDR, reg)
-    low = bus.read_byte_data(ADDR, reg + 1)
-    val = (high << 8) | low
-    if val > 32767: val -= 65536
-    return val
+MPU_RATE = 200      # Hz, the chip's output data rate
+mpu = MPU6050(bus, ADDR, sample_rate=MPU_RATE, clock=hw.clock.monotonic, sleep=hw.clock.sleep)
 
 # -----------------------------
 # MPU6050 Calibration
 # -----------------------------
-print("Calibrating MPU6050...")
-time.sleep(2)
-
-ax_off = ay_off = az_off = 0
-gx_off = gy_off = gz_off = 0
-samples = 200
-for i in range(samples):
-    ax_off += read_word(ACCEL_XOUT_H)
-    ay_off += read_word(ACCEL_XOUT_H+2)
-    az_off += read_word(ACCEL_XOUT_H+4)
-    gx_off += read_word(GYRO_XOUT_H)
-    gy_off += read_word(GYRO_XOUT_H+2)
-    gz_off += read_word(GYRO_XOUT_H+4)
-    time.sleep(0.005)
-
-ax_off /= samples
-ay_off /= samples
-az_off = (az_off / samples) - 16384 # remove gravity
-gx_off /= samples
-gy_off /= samples
-gz_off /= samples
+# Cached offsets if they still hold, a fresh calibration if not
+imu_calibration = CalibrationStore()
+offsets, source = calibrate(mpu, imu_calibration, clock=hw.clock.monotonic)
+print(f"Calibration complete ({source}).")
 
-print("Calibration complete.")
-
-pitch = 0.0
-roll  = 0.0
-yaw   = 0.0
-
-x = y = 0.0
-vx = vy = 0.0
-last_t = time.time()
+# Sampled at MPU_RATE on its own thread; the loops below read snapshots
+IMU_REPORT_INTERVAL = 60    # seconds between sampler jitter reports
+IMU_FILTER = 'complementary'    # or 'madgwick' / 'mahony' (fusion.py)
+imu = ImuService(mpu, offsets, filter=IMU_FILTER,
+                 clock=hw.clock.monotonic, sleep=hw.clock.sleep, report_interval=IMU_REPORT_INTERVAL,
+                 refiner=BiasRefiner(mpu, offsets, imu_calibration, clock=hw.clock.monotonic)).start()
 
 # -----------------------------
 # X, Y coordinates
 # -----------------------------
 def get_xy():
-    global pitch, roll, yaw
-    global x, y, vx, vy, last_t
-
-    now = time.time()
-    dt = now - last_t
-    last_t = now
-
-    ax = read_word(ACCEL_XOUT_H)   - ax_off
-    ay = read_word(ACCEL_XOUT_H+2) - ay_off
-    az = read_word(ACCEL_XOUT_H+4) - az_off
-    gx = read_word(GYRO_XOUT_H)    - gx_off
-    gy = read_word(GYRO_XOUT_H+2)  - gy_off
-    gz = read_word(GYRO_XOUT_H+4)  - gz_off
-
-    ax /= 16384.0; 
-    ay /= 16384.0; 
-    az /= 16384.0
-    gx /= 131.0;   
-    gy /= 131.0;   
-    gz /= 131.0
-
-    accel_pitch = math.degrees(math.atan2(ax, math.sqrt(ay**2 + az**2)))
-    accel_roll  = math.degrees(math.atan2(ay, math.sqrt(ax**2 + az**2)))
-
-    pitch += gx * dt
-    roll  += gy * dt
-    yaw   += gz * dt
-
-    alpha = 0.98
-    pitch = alpha*pitch + (1-alpha)*accel_pitch
-    roll  = alpha*roll  + (1-alpha)*accel_roll
-
-    pr = math.radians(pitch)
-    rr = math.radians(roll)
-
-    ax_world = ax * math.cos(pr) + az * math.sin(pr)
-    ay_world = ay * math.cos(rr) + az * math.sin(rr)
-
-    ax_ms = ax_world * 9.81
-    ay_ms = ay_world * 9.81
-
-    vx += ax_ms * dt
-    vy += ay_ms * dt
-    x += vx * dt
-    y += vy * dt
-
-    return x, y     # meters (approx!)
+    state = imu.snapshot()
+    return state.x, state.y     # meters (approx!)
 
 # -----------------------------
 # Telemetry Thread
 # -----------------------------
 def telemetry_loop():
-    global obj_ditect
     while True:
         dist = ultra.distance * 100
-#        obj_ditect = True if dist < max_dist else False
         x_val, y_val = get_xy()
         msg = f"{dist:.1f} {x_val:.2f} {y_val:.2f}"     # distance(cm) x(m) y(m)
         sock.sendto(msg.encode(), (MAC_IP, MAC_PORT))
@@ -204,29 +153,24 @@ def telemetry_loop():
 # -------------------------
 def udp_receiver():
     while True:
-        data, _ = sock_audio.recvfrom(FRAMESIZE * 2)
-        samples = np.frombuffer(data, dtype=np.int16)
-        audio_queue.put(samples)
+        data, _ = sock_audio.recvfrom(MAX_PACKET)
+        packet = audio_session.receive(data)
+        if packet is not None:
+            audio_buffer.put(packet.seq, packet.timestamp, packet, source=packet.ssrc, marker=packet.marker)
 
 # -------------------------
 # Playback callback
 # -------------------------
 def playback_callback(outdata, frames, time, status):
-    try:
-        chunk = audio_queue.get_nowait()
-        chunk = np.clip(chunk * GAIN, -32768, 32767).astype(np.int16)
-        stereo = np.column_stack([chunk, chunk]).astype(np.int16)
-        outdata[:] = stereo
-    except queue.Empty:
-        outdata.fill(0)
+    speaker.write(speaker_fifo.read(frames, source=audio_buffer.get), outdata)
 
 # -------------------------
 # Record callback
 # -------------------------
 def record_callback(indata, frames, time, status):
-    mono = indata[:, 0].astype(np.int16)
-    mono = np.clip(mono, -32768, 32767).astype(np.int16)
-    sock_audio.sendto(mono.tobytes(), (PEER_IP, UDP_PORT))
+    mic_fifo.write(mic.read(indata))
+    for packet in mic_fifo.blocks(FRAMESIZE):
+        audio_session.send(packet)
     
 # -------------------------
 # Start full-duplex streams
@@ -236,14 +180,14 @@ def audio_thread():
         samplerate=SAMPLERATE,
         channels=1,     # Voice HAT is mono
         dtype='int16',
-        blocksize=FRAMESIZE,
+        blocksize=BLOCKSIZE,
         device=INPUT_DEVICE,
         callback=record_callback
     ), sd.OutputStream(
         samplerate=SAMPLERATE,
         channels=2,     # USB DAC is stereo
         dtype='int16',
-        blocksize=FRAMESIZE,
+        blocksize=BLOCKSIZE,
         device=OUTPUT_DEVICE,
         callback=playback_callback
     ):
@@ -261,49 +205,9 @@ threading.Thread(target=audio_thread, daemon=True).start()
 # -----------------------------
 # Robot Control Thread
 # -----------------------------
-def control_loop():
-    global vartical_angle, horizontal_angle, obj_ditect
-    while True:
-        data, _ = sock.recvfrom(64)
-        cmd = data.decode().lower()
-        print("Command:", cmd)
-
-        dist = ultra.distance * 100
-        obj_ditect = True if dist < max_dist else False
-        if cmd == 'w' and not obj_ditect:
-            PWM_duty = linier_duty
-            pwmA.start(PWM_duty)
-            pwmB.start(PWM_duty)
-            GPIO.output(motors, (1,0,1,0))
-        elif cmd == 's':
-            PWM_duty = linier_duty
-            pwmA.start(PWM_duty)
-            pwmB.start(PWM_duty)
-            GPIO.output(motors, (0,1,0,1))
-        elif cmd == 'a':
-            PWM_duty = rotation_duty
-            pwmA.start(PWM_duty)
-            pwmB.start(PWM_duty)
-            GPIO.output(motors, (0,1,1,0))
-        elif cmd == 'd':
-            PWM_duty = rotation_duty
-            pwmA.start(PWM_duty)
-            pwmB.start(PWM_duty)
-            GPIO.output(motors, (1,0,0,1))
-            
-        if cmd == 'u':
-            vartical_angle = min(170, vartical_angle + angle_change)
-            kit.servo[SERVO1].angle = vartical_angle
-        elif cmd == 'b':
-            vartical_angle = max(10, vartical_angle - angle_change)
-            kit.servo[SERVO1].angle = vartical_angle
-        elif cmd == 'l':
-            horizontal_angle = min(170, horizontal_angle + angle_change)
-            kit.servo[SERVO2].angle = horizontal_angle
-        elif cmd == 'r':
-            horizontal_angle = max(10, horizontal_angle - angle_change)
-            kit.servo[SERVO2].angle = horizontal_angle
-        elif cmd == 'x':
-            GPIO.output(motors, (0,0,0,0))
-        
-control_loop()  # main blocking loop
+# Drive loop + dead-man watchdog: the motors ramp to a stop if no valid
+# packet arrives for WATCHDOG_TIMEOUT. Pan/tilt follow the packets, the
+# obstacle stop reads the sonar at every drive tick (bot_control.py).
+engine = make_engine(sock, GPIO, motors, pwmA, pwmB, kit, ultra, mixer=mixer,
+                     timeout=WATCHDOG_TIMEOUT, rate=DRIVE_RATE, clock=hw.clock.monotonic)
+engine.run()  # main blocking loop
@@ -0,0 +1,138 @@
+# control_engine.py
+# Robot side of the control link: receives packets, runs the drive mixer
+# at a fixed rate and stops the motors when the laptop goes quiet.
+import select as select_module
+import time
+
+from control_protocol import U32, ControlDecoder
+from drive_mixer import DriveMixer
+
+DRIVE_RATE = 50             # Hz, PWM updates
+# No valid packet for this long and the motors ramp to a stop. The laptop
+# sends a heartbeat every 0.2 s (controller/control_sender.py).
+WATCHDOG_TIMEOUT = 0.5
+
+DIRECTION_PINS = {1: (1, 0), -1: (0, 1), 0: (0, 0)}
+
+
+class ControlEngine:
+    """
+    One loop that never blocks for longer than a drive tick: select() on
+    the control socket with the time left to the next tick, then step the
+    mixer and the watchdog against the monotonic clock.
+
+    gpio is RPi.GPIO (or anything with output()), motors the four
+    direction pins, pwm_left/pwm_right the two GPIO.PWM objects.
+    on_command(cmd) is called for every accepted packet (camera, sensors),
+    forward_blocked() before every tick (obstacle in front). select is
+    select.select, or a simulated one that moves a virtual clock on.
+    """
+
+    def __init__(self, sock, gpio, motors, pwm_left, pwm_right, mixer=None,
+                 timeout=WATCHDOG_TIMEOUT, rate=DRIVE_RATE, on_command=None,
+                 forward_blocked=None, clock=time.monotonic, select=select_module.select):
+        self.sock = sock
+        if sock is not None:
+            # None when packets are fed to handle_packet() directly
+            sock.setblocking(False)
+        self.gpio = gpio
+        self.motors = motors
+        self.pwm_left = pwm_left
+        self.pwm_right = pwm_right
+        self.mixer = mixer if mixer is not None else DriveMixer()
+        self.timeout = timeout
+        self.period = 1.0 / rate
+        self.on_command = on_command
+        self.forward_blocked = forward_blocked
+        self.clock = clock
+        self.select = select
+        self.decoder = ControlDecoder()
+
+        self.target = (0.0, 0.0)    # throttle, steer
+        self.last_valid = None      # clock() of the last accepted packet
+        self.tripped = True         # nothing heard yet: stay still
+        self.trips = 0
+        self._pins = None
+        self._duty = [None, None]
+        self._last_tick = None
+
+    # -----------------------------
+    # Loop
+    # -----------------------------
+    def run(self, running=lambda: True):
+        next_tick = self.clock()
+        while running():
+            wait = next_tick - self.clock()
+            if wait > 0:
+                readable, _, _ = self.select([self.sock], [], [], wait)
+                if readable:
+                    self.receive()
+                    continue    # more packets may come before the tick
+            self.tick()
+            next_tick += self.period
+            if next_tick < self.clock():
+                # Fell behind (slow sensor or a busy Pi): don't burst to catch up
+                next_tick = self.clock() + self.period
+
+    def receive(self):
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.handle_packet(data)
+
+    def handle_packet(self, data, now=None):
+        if now is None:
+            now = self.clock()
+        cmd = self.decoder.decode(data, now_ms=int(now * 1000) & U32)
+        if cmd is None:
+            return None     # malformed, stale or out of order: doesn't feed the watchdog
+        self.last_valid = now
+        if self.tripped:
+            self.tripped = False
+            print("Control link up.")
+        self.target = (cmd.throttle, cmd.steer)
+        if self.on_command is not None:
+            self.on_command(cmd)
+        return cmd
+
+    def tick(self, now=None):
+        if now is None:
+            now = self.clock()
+        dt = self.period if self._last_tick is None else now - self._last_tick
+        self._last_tick = now
+
+        # Dead man: no valid packet for `timeout`, ramp down and hold
+        if not self.tripped and (self.last_valid is None or now - self.last_valid > self.timeout):
+            self.tripped = True
+            self.trips += 1
+            print(f"Control link lost for {self.timeout:.2f}s, stopping motors.")
+        throttle, steer = (0.0, 0.0) if self.tripped else self.target
+
+        if throttle > 0 and self.forward_blocked is not None and self.forward_blocked():
+            throttle = 0.0
+            if self.mixer.left + self.mixer.right > 0:
+                self.mixer.stop()   # no ramp down into the obstacle
+        left, right = self.mixer.update(throttle, steer, dt)
+        self.apply(left, right)
+
+    # -----------------------------
+    # Outputs
+    # -----------------------------
+    def apply(self, left, right):
+        """Write only what changed: direction pins, then duty."""
+        (left_duty, left_dir), (right_duty, right_dir) = left, right
+        pins = DIRECTION_PINS[left_dir] + DIRECTION_PINS[right_dir]
+        if pins != self._pins:
+            self.gpio.output(self.motors, pins)
+            self._pins = pins
+        if left_duty != self._duty[0]:
+            self.pwm_left.ChangeDutyCycle(left_duty)
+            self._duty[0] = left_duty
+        if right_duty != self._duty[1]:
+            self.pwm_right.ChangeDutyCycle(right_duty)
+            self._duty[1] = right_duty
+
+    def stopped(self):
+        return self.mixer.left == 0.0 and self.mixer.right == 0.0
@@ -0,0 +1,58 @@
+# control_protocol_bench.py
+# Encode/decode cost of the binary control packet against the old
+# single-char commands. Runs anywhere (no GPIO needed).
+#
+#   python control_protocol_bench.py
+import time
+
+from control_protocol import PACKET, ControlDecoder, ControlEncoder
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+ROUNDS = 200_000
+# -------------------------
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / ROUNDS * 1e9
+
+
+def old_encode():
+    for _ in range(ROUNDS):
+        'w'.encode()
+
+
+def old_decode():
+    data = b'W'
+    for _ in range(ROUNDS):
+        data.decode().lower()
+
+
+def new_encode():
+    encoder = ControlEncoder()
+    for i in range(ROUNDS):
+        encoder.encode(0.5, -0.25, 90, 45, time_ms=i)
+
+
+def new_decode():
+    encoder = ControlEncoder()
+    packets = [encoder.encode(0.5, -0.25, 90, 45, time_ms=i * 50) for i in range(ROUNDS)]
+    decoder = ControlDecoder()
+    start = time.perf_counter()
+    for i, packet in enumerate(packets):
+        decoder.decode(packet, now_ms=i * 50 + 7)
+    return (time.perf_counter() - start) / ROUNDS * 1e9
+
+
+print(f"packet size: {PACKET.size} bytes (old: 1 byte, no seq, time or analog values)")
+print(f"old encode  : {timed(old_encode):7.0f} ns")
+print(f"old decode  : {timed(old_decode):7.0f} ns")
+encode_ns = timed(new_encode)
+decode_ns = new_decode()
+print(f"new encode  : {encode_ns:7.0f} ns")
+print(f"new decode  : {decode_ns:7.0f} ns")
+print(f"at 20 packets/s that is {encode_ns * 20 / 1e3:.1f} us/s on the laptop, "
+      f"{decode_ns * 20 / 1e3:.1f} us/s on the Pi")
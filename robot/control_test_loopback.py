@@ -0,0 +1,104 @@
+# control_test_loopback.py
+# Loopback check of the control protocol over a real UDP socket on this
+# machine: packets are sent out of order, twice, late and corrupted, and
+# the robot side must only act on the fresh, newest ones.
+#
+#   python control_test_loopback.py
+import socket
+import time
+
+from control_protocol import PACKET, ControlDecoder, ControlEncoder, monotonic_ms
+
+PORT = 6100     # not the robot's 6000, so it can run next to bot_main.py
+
+rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+rx.bind(("127.0.0.1", PORT))
+rx.settimeout(1.0)
+tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+failures = 0
+
+
+def check(name, ok):
+    global failures
+    print(f"{'PASS' if ok else 'FAIL'}: {name}")
+    if not ok:
+        failures += 1
+
+
+def send_and_receive(packets):
+    """Send the packets in this order, return what the decoder accepted."""
+    for packet in packets:
+        tx.sendto(packet, ("127.0.0.1", PORT))
+    accepted = []
+    for _ in packets:
+        data, _ = rx.recvfrom(64)
+        cmd = decoder.decode(data)
+        if cmd is not None:
+            accepted.append(cmd)
+    return accepted
+
+
+encoder = ControlEncoder()
+decoder = ControlDecoder()
+
+# Round trip of the values
+cmd = send_and_receive([encoder.encode(0.5, -1.0, 135.5, 20)])[0]
+check("values survive the round trip",
+      abs(cmd.throttle - 0.5) < 1e-4 and cmd.steer == -1.0 and cmd.pan == 135.5 and cmd.tilt == 20)
+check("out of range values are clamped",
+      send_and_receive([encoder.encode(3.0, -3.0, 400, -5)])[0][2:] == (1.0, -1.0, 180.0, 0.0))
+
+# Reordered and duplicated packets
+a, b, c = (encoder.encode(i / 10, 0, 90, 90) for i in range(3))
+accepted = send_and_receive([a, c, b, c])
+check("older and duplicate packets are dropped", [x.seq for x in accepted] == [encoder.seq - 2, encoder.seq])
+
+# A packet that sat in a queue for longer than MAX_AGE
+late = encoder.encode(1.0, 0, 90, 90, time_ms=(monotonic_ms() - 1000) & 0xFFFFFFFF)
+check("stale packets are dropped", send_and_receive([late]) == [])
+check("fresh packets after a stale one are kept", len(send_and_receive([encoder.encode(0, 0, 90, 90)])) == 1)
+
+# A lasting step in latency (the link moves onto a relay): packets every
+# 0.2 s on virtual time, 20 ms on the way, then 400 ms from t = 10 s
+step_decoder = ControlDecoder()
+step_encoder = ControlEncoder()
+accepted_at = []
+for i in range(100):
+    sent_ms = 1000 + i * 200
+    latency_ms = 20 if sent_ms < 11000 else 400
+    if step_decoder.decode(step_encoder.encode(0.5, 0, 90, 90, time_ms=sent_ms), now_ms=sent_ms + latency_ms):
+        accepted_at.append(sent_ms + latency_ms)
+back = min(t for t in accepted_at if t > 11000) - 11400
+check(f"a lasting latency step is re-based after {back} ms, not tens of seconds",
+      back <= 1200 and step_decoder.rebased == 1 and accepted_at[-1] == 1000 + 99 * 200 + 400)
+burst = ControlDecoder()
+for i in range(50):
+    burst.decode(step_encoder.encode(0.5, 0, 90, 90, time_ms=1000 + i * 200), now_ms=1020 + i * 200)
+# Two packets out of a queue, then back to normal
+for i, delay in ((50, 400), (51, 300), (52, 20), (53, 20)):
+    burst.decode(step_encoder.encode(0.5, 0, 90, 90, time_ms=1000 + i * 200), now_ms=1000 + i * 200 + delay)
+check("...but a short burst of late packets isn't", burst.stale == 2 and burst.rebased == 0)
+
+# Garbage and the old single-char commands
+check("malformed packets are dropped",
+      send_and_receive([b'w', b'x' * PACKET.size, encoder.encode(0, 0, 90, 90)[:-1]]) == [])
+
+# A restarted controller starts its seq from 1 again
+restarted = ControlEncoder(session=(encoder.session + 1) & 0xFFFF)
+check("a new controller session is accepted", len(send_and_receive([restarted.encode(0, 0, 90, 90)])) == 1)
+
+# Loopback latency of the whole path
+times = []
+for _ in range(1000):
+    start = time.perf_counter()
+    send_and_receive([restarted.encode(0.3, 0.1, 90, 90)])
+    times.append(time.perf_counter() - start)
+times.sort()
+print(f"loopback send + decode: p50 {times[500] * 1e6:.0f} us, p99 {times[990] * 1e6:.0f} us")
+print(f"decoder counts: accepted {decoder.accepted}, reordered {decoder.reordered}, "
+      f"stale {decoder.stale}, malformed {decoder.malformed}")
+
+rx.close()
+tx.close()
+print("All checks passed" if not failures else f"{failures} check(s) failed")
@@ -0,0 +1,130 @@
+# control_test_watchdog.py
+# Dead-man watchdog check with simulated GPIO: a simulated laptop drives
+# full ahead over loopback UDP, then the link drops out for a short and a
+# long gap. The motors must keep going through the short one and ramp to
+# a stop on time in the long one. Runs anywhere (no Pi needed).
+#
+#   python control_test_watchdog.py
+import socket
+import threading
+import time
+
+from control_engine import ControlEngine
+from control_protocol import ControlEncoder
+from drive_mixer import DriveMixer
+
+PORT = 6102
+HEARTBEAT = 0.05
+TIMEOUT = 0.3
+RATE = 50
+SLEW_RATE = 4.0     # full scale -> 0 in 0.25 s
+
+
+class SimulatedGPIO:
+    def __init__(self):
+        self.pins = {}
+
+    def output(self, pins, values):
+        for pin, value in zip(pins, values):
+            self.pins[pin] = value
+
+
+class SimulatedPWM:
+    def __init__(self):
+        self.duty = 0.0
+        self.changes = []   # (time, duty)
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.changes.append((time.monotonic(), duty))
+
+
+failures = 0
+
+
+def check(name, ok, detail=""):
+    global failures
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{' (' + detail + ')' if detail else ''}")
+    if not ok:
+        failures += 1
+
+
+def stopped_at(pwm, after):
+    """First time the duty went to 0 after `after`, or None."""
+    for t, duty in pwm.changes:
+        if t >= after and duty == 0:
+            return t
+    return None
+
+
+rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+rx.bind(("127.0.0.1", PORT))
+tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+gpio = SimulatedGPIO()
+left, right = SimulatedPWM(), SimulatedPWM()
+motors = [22, 10, 27, 17]
+engine = ControlEngine(rx, gpio, motors, left, right, mixer=DriveMixer(slew_rate=SLEW_RATE),
+                       timeout=TIMEOUT, rate=RATE)
+running = True
+thread = threading.Thread(target=engine.run, args=(lambda: running,))
+thread.start()
+encoder = ControlEncoder()
+
+
+def drive(seconds, throttle=1.0, garbage=False):
+    """Send like the laptop's heartbeat for `seconds`; returns the last send time."""
+    end = time.monotonic() + seconds
+    last = None
+    while time.monotonic() < end:
+        if garbage:
+            tx.sendto(b'w', ("127.0.0.1", PORT))    # the old protocol, not valid any more
+        else:
+            tx.sendto(encoder.encode(throttle, 0.0, 90, 90), ("127.0.0.1", PORT))
+            last = time.monotonic()
+        time.sleep(HEARTBEAT)
+    return last
+
+
+# Nothing sent yet: stay still
+time.sleep(0.2)
+check("motors stay off before the first packet", left.duty == 0 and right.duty == 0)
+
+# Full ahead
+drive(0.6)
+check("full ahead with the link up", left.duty == 80 and right.duty == 80 and gpio.pins[22] == 1,
+      f"duty {left.duty:.0f}/{right.duty:.0f}")
+
+# Short gap: shorter than the timeout, nothing should happen
+drive(0.05)
+time.sleep(TIMEOUT * 0.6)
+check("short gap doesn't stop the motors", left.duty == 80 and engine.trips == 0)
+drive(0.3)
+
+# Long gap: the watchdog must fire and ramp down
+last = drive(0.05)
+time.sleep(TIMEOUT + 1 / SLEW_RATE + 0.2)
+stop = stopped_at(left, last)
+limit = TIMEOUT + 1 / SLEW_RATE + 2 / RATE
+check("long gap trips the watchdog", engine.trips == 1 and engine.tripped)
+check("motors stopped within timeout + ramp",
+      stop is not None and stop - last <= limit,
+      f"{(stop - last) * 1000:.0f} ms, limit {limit * 1000:.0f} ms" if stop else "never stopped")
+check("direction pins released", all(gpio.pins[p] == 0 for p in motors))
+ramp = [duty for t, duty in left.changes if last <= t <= stop] if stop else []
+check("ramped down instead of cutting", len(ramp) > 3, f"{len(ramp)} duty steps")
+
+# Link back
+drive(0.6)
+check("motors resume when the link is back", left.duty == 80 and not engine.tripped)
+
+# Garbage doesn't feed the watchdog
+drive(0.05)
+drive(TIMEOUT + 1 / SLEW_RATE + 0.2, garbage=True)
+check("invalid packets don't keep the motors running", engine.tripped and left.duty == 0)
+
+running = False
+thread.join()
+rx.close()
+tx.close()
+print("All checks passed" if not failures else f"{failures} check(s) failed")
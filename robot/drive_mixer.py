@@ -0,0 +1,75 @@
+# drive_mixer.py
+# Throttle/steer -> left/right wheel PWM duty and direction.
+import math
+
+
+def deadband(value, width):
+    """Zero inside +-width, then rescaled so the output still reaches 1."""
+    if abs(value) <= width:
+        return 0.0
+    return math.copysign((abs(value) - width) / (1.0 - width), value)
+
+
+def expo(value, amount):
+    """Softer around the centre for fine control, same at full stick."""
+    return (1.0 - amount) * value + amount * value ** 3
+
+
+class DriveMixer:
+    """
+    Differential drive mixer for the two motors.
+
+    update() is called at a fixed rate with the latest throttle/steer
+    (both -1..1, forward and right are +). Each wheel's output is slew
+    limited, so a full reverse ramps through zero instead of slamming the
+    motor driver, and the direction pins only flip once a wheel is at 0.
+    """
+
+    def __init__(self, deadband=0.08, expo=0.4, slew_rate=3.0, min_duty=25, max_duty=80):
+        self.deadband = deadband
+        self.expo = expo
+        self.slew_rate = slew_rate      # full scale per second
+        self.min_duty = min_duty        # below this the motors just hum
+        self.max_duty = max_duty
+        self.left = 0.0
+        self.right = 0.0
+
+    def mix(self, throttle, steer):
+        """Wheel targets, -1..1, before slew limiting."""
+        throttle = expo(deadband(throttle, self.deadband), self.expo)
+        steer = expo(deadband(steer, self.deadband), self.expo)
+        left = throttle + steer
+        right = throttle - steer
+        # Keep the turn ratio when both add up to more than full
+        scale = max(1.0, abs(left), abs(right))
+        return left / scale, right / scale
+
+    def update(self, throttle, steer, dt):
+        """((left duty, left direction), (right duty, right direction)), direction is 1, -1 or 0."""
+        left, right = self.mix(throttle, steer)
+        step = self.slew_rate * dt
+        self.left = self._slew(self.left, left, step)
+        self.right = self._slew(self.right, right, step)
+        return self._output(self.left), self._output(self.right)
+
+    def stop(self):
+        """Immediate stop, no ramp (obstacles, lost link)."""
+        self.left = self.right = 0.0
+
+    @staticmethod
+    def _slew(current, target, step):
+        if target > current:
+            value = min(target, current + step)
+        else:
+            value = max(target, current - step)
+        # Stop at zero on the way through, so the direction pins never
+        # flip while the wheel is driven
+        if value * current < 0:
+            return 0.0
+        return value
+
+    def _output(self, value):
+        if value == 0.0:
+            return 0.0, 0
+        duty = self.min_duty + abs(value) * (self.max_duty - self.min_duty)
+        return duty, 1 if value > 0 else -1
@@ -0,0 +1,263 @@
+# fusion.py
+# Attitude from the MPU6050, a batch of samples at a time (as they come
+# out of the FIFO) with NumPy. Every filter also has the per-sample
+# update() it has to agree with (fusion_bench.py checks that).
+#
+#   accel, gyro = to_units(raw, offsets, mpu.accel_scale, mpu.gyro_scale)
+#   attitude = Complementary(dt).update_batch(accel, gyro)     # (n, 3) pitch, roll, yaw
+#
+# Angles are in degrees, in get_xy()'s sense: pitch goes + with ax,
+# roll with ay, yaw with gz.
+import math
+
+import numpy as np
+
+ALPHA = 0.98                # complementary filter: gyro weight
+GRAVITY = 9.81
+# The complementary filter's closed form divides by alpha**k; in chunks
+# this long that stays well inside double precision
+CHUNK = 256
+
+
+def to_units(raw, offsets, accel_scale, gyro_scale):
+    """(n, 6) raw LSB -> accel (n, 3) in g and gyro (n, 3) in deg/s."""
+    data = np.asarray(raw, dtype=np.float64) - offsets
+    return data[:, :3] / accel_scale, data[:, 3:] / gyro_scale
+
+
+# -----------------------------
+# Complementary
+# -----------------------------
+class Complementary:
+    """
+    get_xy()'s filter: gyro integrated and pulled toward the accel
+    angles by 1 - alpha per sample. As in get_xy(), gx drives pitch and
+    gy drives roll.
+
+    pitch[k] = alpha * (pitch[k-1] + gx[k] dt) + (1 - alpha) * accel_pitch[k]
+    is linear, so a batch is one cumulative sum scaled by powers of alpha.
+    """
+
+    def __init__(self, dt, alpha=ALPHA):
+        self.dt = dt
+        self.alpha = alpha
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.yaw = 0.0
+
+    def update(self, ax, ay, az, gx, gy, gz):
+        accel_pitch = math.degrees(math.atan2(ax, math.sqrt(ay**2 + az**2)))
+        accel_roll  = math.degrees(math.atan2(ay, math.sqrt(ax**2 + az**2)))
+        self.pitch = self.alpha * (self.pitch + gx * self.dt) + (1 - self.alpha) * accel_pitch
+        self.roll  = self.alpha * (self.roll + gy * self.dt) + (1 - self.alpha) * accel_roll
+        self.yaw  += gz * self.dt
+        return self.pitch, self.roll, self.yaw
+
+    def update_batch(self, accel, gyro):
+        ax, ay, az = accel.T
+        accel_pitch = np.degrees(np.arctan2(ax, np.sqrt(ay**2 + az**2)))
+        accel_roll = np.degrees(np.arctan2(ay, np.sqrt(ax**2 + az**2)))
+        a, dt = self.alpha, self.dt
+        out = np.empty((len(accel), 3))
+        out[:, 0] = self._recurrence(a * dt * gyro[:, 0] + (1 - a) * accel_pitch, self.pitch)
+        out[:, 1] = self._recurrence(a * dt * gyro[:, 1] + (1 - a) * accel_roll, self.roll)
+        out[:, 2] = self.yaw + np.cumsum(gyro[:, 2] * dt)
+        if len(out):
+            self.pitch, self.roll, self.yaw = out[-1].tolist()
+        return out
+
+    def _recurrence(self, u, initial):
+        """y[k] = alpha * y[k-1] + u[k], y[-1] = initial."""
+        out = np.empty(len(u))
+        for start in range(0, len(u), CHUNK):
+            chunk = u[start:start + CHUNK]
+            powers = self.alpha ** np.arange(1, len(chunk) + 1)
+            out[start:start + len(chunk)] = powers * (initial + np.cumsum(chunk / powers))
+            initial = out[start + len(chunk) - 1]
+        return out
+
+
+# -----------------------------
+# Quaternion filters
+# -----------------------------
+class _QuaternionFilter:
+    """
+    Madgwick and Mahony keep an orientation quaternion, and each step
+    depends on the last one non-linearly, so there is no closed form over
+    a batch. update_batch() does the unit conversion, accel normalisation
+    and Euler angles with NumPy and runs only the quaternion step per
+    sample, on plain floats.
+    """
+
+    def __init__(self, dt):
+        self.dt = dt
+        self.q = None           # (q0, q1, q2, q3), set from the first accel sample
+
+    def update(self, ax, ay, az, gx, gy, gz):
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if norm > 0:
+            ax, ay, az = ax / norm, ay / norm, az / norm
+        if self.q is None:
+            self.q = _from_gravity(ax, ay, az)
+        self.q = self._step(self.q, ax, ay, az, math.radians(gx), math.radians(gy), math.radians(gz))
+        return _euler(*self.q)
+
+    def update_batch(self, accel, gyro):
+        norm = np.sqrt(np.sum(accel * accel, axis=1))
+        norm[norm == 0] = 1.0
+        accel = accel / norm[:, None]
+        gyro = np.radians(gyro)
+        if self.q is None and len(accel):
+            self.q = _from_gravity(*accel[0].tolist())
+        q = self.q
+        quaternions = np.empty((len(accel), 4))
+        step = self._step
+        for k, (a, g) in enumerate(zip(accel.tolist(), gyro.tolist())):
+            q = step(q, a[0], a[1], a[2], g[0], g[1], g[2])
+            quaternions[k] = q
+        self.q = q
+        return _euler_batch(quaternions)
+
+
+class Madgwick(_QuaternionFilter):
+    """Madgwick's gradient descent IMU filter; beta is the correction gain."""
+
+    def __init__(self, dt, beta=0.1):
+        super().__init__(dt)
+        self.beta = beta
+
+    def _step(self, q, ax, ay, az, gx, gy, gz):
+        q0, q1, q2, q3 = q
+        # Rate of change from the gyro
+        d0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        d1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        d2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        d3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+        if ax or ay or az:
+            # Gradient of the gravity error, normalised (accel already is)
+            s0 = 4 * q0 * q2 * q2 + 2 * q2 * ax + 4 * q0 * q1 * q1 - 2 * q1 * ay
+            s1 = (4 * q1 * q3 * q3 - 2 * q3 * ax + 4 * q0 * q0 * q1 - 2 * q0 * ay - 4 * q1
+                  + 8 * q1 * q1 * q1 + 8 * q1 * q2 * q2 + 4 * q1 * az)
+            s2 = (4 * q0 * q0 * q2 + 2 * q0 * ax + 4 * q2 * q3 * q3 - 2 * q3 * ay - 4 * q2
+                  + 8 * q2 * q1 * q1 + 8 * q2 * q2 * q2 + 4 * q2 * az)
+            s3 = 4 * q1 * q1 * q3 - 2 * q1 * ax + 4 * q2 * q2 * q3 - 2 * q2 * ay
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm > 0:
+                beta = self.beta / norm
+                d0 -= beta * s0
+                d1 -= beta * s1
+                d2 -= beta * s2
+                d3 -= beta * s3
+        dt = self.dt
+        return _normalise(q0 + d0 * dt, q1 + d1 * dt, q2 + d2 * dt, q3 + d3 * dt)
+
+
+class Mahony(_QuaternionFilter):
+    """Mahony's PI filter on the gravity error; kp/ki the gains."""
+
+    def __init__(self, dt, kp=1.0, ki=0.0):
+        super().__init__(dt)
+        self.kp = kp
+        self.ki = ki
+        self.integral = [0.0, 0.0, 0.0]
+
+    def _step(self, q, ax, ay, az, gx, gy, gz):
+        q0, q1, q2, q3 = q
+        dt = self.dt
+        if ax or ay or az:
+            # Gravity as the quaternion sees it (halved), crossed with the accel
+            vx = q1 * q3 - q0 * q2
+            vy = q0 * q1 + q2 * q3
+            vz = q0 * q0 - 0.5 + q3 * q3
+            ex = ay * vz - az * vy
+            ey = az * vx - ax * vz
+            ez = ax * vy - ay * vx
+            if self.ki > 0:
+                integral = self.integral
+                integral[0] += 2 * self.ki * ex * dt
+                integral[1] += 2 * self.ki * ey * dt
+                integral[2] += 2 * self.ki * ez * dt
+                gx += integral[0]
+                gy += integral[1]
+                gz += integral[2]
+            gx += 2 * self.kp * ex
+            gy += 2 * self.kp * ey
+            gz += 2 * self.kp * ez
+        gx *= 0.5 * dt
+        gy *= 0.5 * dt
+        gz *= 0.5 * dt
+        return _normalise(q0 - q1 * gx - q2 * gy - q3 * gz,
+                          q1 + q0 * gx + q2 * gz - q3 * gy,
+                          q2 + q0 * gy - q1 * gz + q3 * gx,
+                          q3 + q0 * gz + q1 * gy - q2 * gx)
+
+
+FILTERS = {'complementary': Complementary, 'madgwick': Madgwick, 'mahony': Mahony}
+
+
+def _normalise(q0, q1, q2, q3):
+    norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / norm, q1 / norm, q2 / norm, q3 / norm
+
+
+def _from_gravity(ax, ay, az):
+    """The level-heading quaternion whose gravity is this (normalised) accel."""
+    roll = math.atan2(ay, az)
+    pitch = math.atan2(-ax, math.sqrt(ay * ay + az * az))
+    cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+    cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+    return cr * cp, sr * cp, cr * sp, -sr * sp
+
+
+def _euler(q0, q1, q2, q3):
+    # Aerospace roll/pitch/yaw; pitch flips sign to go + with ax like get_xy()
+    roll = math.atan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2)
+    pitch = math.asin(max(-1.0, min(1.0, -2.0 * (q1 * q3 - q0 * q2))))
+    yaw = math.atan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3)
+    return -math.degrees(pitch), math.degrees(roll), math.degrees(yaw)
+
+
+def _euler_batch(q):
+    q0, q1, q2, q3 = q.T
+    out = np.empty((len(q), 3))
+    out[:, 0] = -np.degrees(np.arcsin(np.clip(-2.0 * (q1 * q3 - q0 * q2), -1.0, 1.0)))
+    out[:, 1] = np.degrees(np.arctan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2))
+    out[:, 2] = np.degrees(np.arctan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3))
+    return out
+
+
+# -----------------------------
+# Position
+# -----------------------------
+class DeadReckoning:
+    """get_xy()'s x/y: accel rotated by pitch/roll, integrated twice (drifts)."""
+
+    def __init__(self, dt):
+        self.dt = dt
+        self.x = self.y = 0.0
+        self.vx = self.vy = 0.0
+
+    def update(self, ax, ay, az, pitch, roll):
+        pr = math.radians(pitch)
+        rr = math.radians(roll)
+        ax_world = ax * math.cos(pr) + az * math.sin(pr)
+        ay_world = ay * math.cos(rr) + az * math.sin(rr)
+        self.vx += ax_world * GRAVITY * self.dt
+        self.vy += ay_world * GRAVITY * self.dt
+        self.x += self.vx * self.dt
+        self.y += self.vy * self.dt
+        return self.x, self.y
+
+    def update_batch(self, accel, attitude):
+        """(n, 4): x, y, vx, vy after each sample."""
+        pr = np.radians(attitude[:, 0])
+        rr = np.radians(attitude[:, 1])
+        ax, ay, az = accel.T
+        out = np.empty((len(accel), 4))
+        out[:, 2] = self.vx + np.cumsum((ax * np.cos(pr) + az * np.sin(pr)) * (GRAVITY * self.dt))
+        out[:, 3] = self.vy + np.cumsum((ay * np.cos(rr) + az * np.sin(rr)) * (GRAVITY * self.dt))
+        out[:, 0] = self.x + np.cumsum(out[:, 2] * self.dt)
+        out[:, 1] = self.y + np.cumsum(out[:, 3] * self.dt)
+        if len(out):
+            self.x, self.y, self.vx, self.vy = out[-1].tolist()
+        return out
@@ -0,0 +1,106 @@
+# fusion_bench.py
+# The batch (NumPy) fusion in fusion.py against the per-sample path:
+# checks that both give the same angles and measures samples/s, on one
+# CPU core like the Pi Zero has. Synthetic samples: the robot tilting
+# and turning, with sensor noise. Runs anywhere.
+#
+#   python fusion_bench.py
+import math
+import os
+import time
+
+import numpy as np
+
+from fusion import FILTERS, DeadReckoning, to_units
+from imu_service import VECTOR_MIN
+from mpu6050 import ACCEL_SCALES, GYRO_SCALES
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SAMPLES = 20000
+ODR = 1000                  # Hz
+BATCHES = (2, 10, 50, 250)  # samples per FIFO read (10 = 1 kHz read every 10 ms)
+TOLERANCE = 1e-6            # deg
+# -------------------------
+
+
+def true_angles(n):
+    """Pitch (about y) and roll (about x) in radians, swinging +-20 and +-15 deg."""
+    t = np.arange(n) / ODR
+    return np.radians(20 * np.sin(2 * np.pi * 0.5 * t)), np.radians(15 * np.sin(2 * np.pi * 0.3 * t))
+
+
+def synthetic(n, seed=3):
+    """Raw (n, 6) LSB: the true_angles() swings, a slow turn, noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / ODR
+    pitch, roll = true_angles(n)
+    accel = np.column_stack([-np.sin(pitch), np.sin(roll) * np.cos(pitch), np.cos(roll) * np.cos(pitch)])
+    gyro = np.column_stack([np.gradient(roll, t), np.gradient(pitch, t), np.full(n, math.radians(30))])
+    accel += rng.normal(0, 0.006, accel.shape)
+    gyro = np.degrees(gyro) + rng.normal(0, 0.05, gyro.shape)
+    raw = np.column_stack([accel * ACCEL_SCALES[0], gyro * GYRO_SCALES[0]])
+    return np.clip(np.round(raw), -32768, 32767).astype(np.int16)
+
+
+def per_sample(name, raw):
+    # What imu_service.py did before: per sample, math module, Python floats
+    fusion = FILTERS[name](1.0 / ODR)
+    position = DeadReckoning(1.0 / ODR)
+    out = []
+    start = time.perf_counter()
+    for sample in raw.tolist():
+        ax, ay, az = (v / ACCEL_SCALES[0] for v in sample[:3])
+        gx, gy, gz = (v / GYRO_SCALES[0] for v in sample[3:])
+        pitch, roll, yaw = fusion.update(ax, ay, az, gx, gy, gz)
+        position.update(ax, ay, az, pitch, roll)
+        out.append((pitch, roll, yaw))
+    return np.array(out), time.perf_counter() - start
+
+
+def batched(name, raw, batch):
+    fusion = FILTERS[name](1.0 / ODR)
+    position = DeadReckoning(1.0 / ODR)
+    out = []
+    start = time.perf_counter()
+    for i in range(0, len(raw), batch):
+        accel, gyro = to_units(raw[i:i + batch], 0, ACCEL_SCALES[0], GYRO_SCALES[0])
+        attitude = fusion.update_batch(accel, gyro)
+        position.update_batch(accel, attitude)
+        out.append(attitude)
+    return np.concatenate(out), time.perf_counter() - start
+
+
+def wrapped(difference):
+    return (difference + 180) % 360 - 180      # yaw goes round
+
+
+if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+print(f"{SAMPLES} samples at {ODR} Hz, one core; filter + dead reckoning")
+failures = 0
+for name in FILTERS:
+    reference, seconds = per_sample(name, synthetic(SAMPLES))
+    print(f"{name:<14} per sample   {SAMPLES / seconds:9.0f} samples/s  "
+          f"{seconds / SAMPLES * 1e6:6.1f} us/sample  {seconds / SAMPLES * ODR * 100:5.1f}% of a core at {ODR} Hz")
+    for batch in BATCHES:
+        result, seconds = batched(name, synthetic(SAMPLES), batch)
+        error = np.max(np.abs(wrapped(result - reference)))
+        ok = error < TOLERANCE
+        failures += not ok
+        print(f"{'':<14} batch {batch:<5}  {SAMPLES / seconds:9.0f} samples/s  "
+              f"{seconds / SAMPLES * 1e6:6.1f} us/sample  {seconds / SAMPLES * ODR * 100:5.1f}% of a core  "
+              f"max diff {error:.1e} deg {'PASS' if ok else 'FAIL'}")
+
+# How close each gets to the true tilt, after settling. get_xy()'s pitch
+# goes + with ax, so it is minus the pitch about y. The complementary
+# filter keeps get_xy()'s pairing of gx with pitch and gy with roll.
+pitch, roll = true_angles(SAMPLES)
+truth = np.column_stack([-np.degrees(pitch), np.degrees(roll)])[SAMPLES // 2:]
+for name in FILTERS:
+    attitude = batched(name, synthetic(SAMPLES), 250)[0][SAMPLES // 2:, :2]
+    rms = np.sqrt(np.mean((attitude - truth) ** 2, axis=0))
+    print(f"{name:<14} pitch error RMS {rms[0]:4.2f} deg, roll {rms[1]:4.2f} deg")
+print(f"(imu_service.py vectorizes reads of {VECTOR_MIN} samples or more)")
+print("All checks passed" if not failures else f"{failures} check(s) failed")
@@ -0,0 +1,94 @@
+# hal.py
+# The robot's hardware in one place: the real Pi parts, or simulated ones
+# (hal_sim.py) so the control and telemetry code runs off the Pi.
+#
+#   python bot_main.py                  real hardware
+#   ROBOT_HAL=sim python bot_main.py    simulated, real time
+#
+#   hw = hal.load('sim', clock=SimClock())   faster than real time (see sim_robot.py)
+import os
+
+BACKEND = os.environ.get('ROBOT_HAL', 'pi')
+
+MPU_ADDRESS = 0x68
+MPU_INT_PIN = 4             # the MPU6050's INT, if wired (otherwise INT_STATUS is polled)
+
+
+class Hardware:
+    """
+    What bot_main.py needs, with the same names as the real libraries:
+      GPIO               RPi.GPIO
+      SMBus(bus)         smbus.SMBus
+      ServoKit(...)      adafruit_servokit.ServoKit
+      DistanceSensor(..) gpiozero.DistanceSensor
+      clock              monotonic() / time() / sleep()
+    The simulated backend also has mpu (SimMPU6050) and sonars.
+    """
+
+    def __init__(self, name, GPIO, SMBus, ServoKit, DistanceSensor, clock):
+        self.name = name
+        self.GPIO = GPIO
+        self.SMBus = SMBus
+        self.ServoKit = ServoKit
+        self.DistanceSensor = DistanceSensor
+        self.clock = clock
+        self.simulated = name == 'sim'
+
+
+def load(backend=None, clock=None):
+    backend = backend or BACKEND
+    if backend == 'pi':
+        return _load_pi()
+    if backend == 'sim':
+        return _load_sim(clock)
+    raise ValueError(f"Unknown ROBOT_HAL backend {backend!r} (use 'pi' or 'sim')")
+
+
+def _load_pi():
+    # Only imported here, so the rest of the code loads without them
+    import RPi.GPIO as GPIO
+    import smbus
+    from adafruit_servokit import ServoKit
+    from gpiozero import DistanceSensor
+
+    from hal_sim import RealClock
+    return Hardware('pi', GPIO, smbus.SMBus, ServoKit, DistanceSensor, RealClock())
+
+
+def _load_sim(clock=None):
+    import hal_sim
+
+    clock = clock or hal_sim.RealClock()
+    gpio = hal_sim.SimGPIO(clock)
+    mpu = hal_sim.SimMPU6050(clock)
+    gpio.inputs[MPU_INT_PIN] = mpu.int_level
+    kits = []
+    sonars = {}
+
+    def SMBus(bus=1):
+        return hal_sim.SimSMBus(clock, {MPU_ADDRESS: mpu}, bus)
+
+    def ServoKit(channels=16, **kwargs):
+        kit = hal_sim.SimServoKit(clock, channels)
+        kits.append(kit)
+        return kit
+
+    def sonar(trigger, echo):
+        """The simulated HC-SR04 wired to these pins, made on first use."""
+        model = sonars.get((trigger, echo))
+        if model is None:
+            model = sonars[(trigger, echo)] = hal_sim.SimSonar(clock)
+            gpio.watchers[trigger] = model.trigger_level
+            gpio.inputs[echo] = model.echo_level
+            model.on_edge = lambda level: gpio.input_changed(echo, level)
+        return model
+
+    def DistanceSensor(echo, trigger, max_distance=1.0, **kwargs):
+        return hal_sim.SimDistanceSensor(sonar(trigger, echo), echo, trigger, max_distance)
+
+    hw = Hardware('sim', gpio, SMBus, ServoKit, DistanceSensor, clock)
+    hw.mpu = mpu
+    hw.sonars = sonars
+    hw.sonar = sonar
+    hw.servo_kits = kits
+    return hw
@@ -0,0 +1,556 @@
+# hal_sim.py
+# Simulated robot hardware for hal.py: GPIO/PWM, the PCA9685 servo kit,
+# the MPU6050 on I2C and the HC-SR04 sonar. Every call is recorded, and
+# with a SimClock the whole thing runs faster than real time.
+import collections
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+
+
+# -----------------------------
+# Clocks
+# -----------------------------
+class RealClock:
+    def __init__(self):
+        self._events = []
+        self._order = itertools.count()
+        self._wake = threading.Condition()
+        self._thread = None
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def call_at(self, when, fn):
+        """
+        fn() at monotonic time `when`, on one event thread (like the GPIO
+        library's edge thread); scheduling never blocks the caller.
+        """
+        with self._wake:
+            heapq.heappush(self._events, (when, next(self._order), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_events, name='sim-events', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def _run_events(self):
+        while True:
+            with self._wake:
+                while not self._events or self._events[0][0] > time.monotonic():
+                    self._wake.wait(self._events[0][0] - time.monotonic() if self._events else None)
+                _, _, fn = heapq.heappop(self._events)
+            fn()
+
+
+class SimClock:
+    """Virtual time: sleep() just moves the clock on, running what call_at() set up on the way."""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+        self.epoch = 1.7e9 - start
+        self._events = []
+        self._order = itertools.count()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def sleep(self, seconds):
+        self.advance(max(0.0, seconds))
+
+    def advance(self, seconds):
+        end = self.now + seconds
+        while self._events and self._events[0][0] <= end:
+            when, _, fn = heapq.heappop(self._events)
+            self.now = max(self.now, when)
+            fn()
+        self.now = end
+
+    def call_at(self, when, fn):
+        heapq.heappush(self._events, (when, next(self._order), fn))
+
+
+class Recorder:
+    """Last calls (time, name, args) plus a count per name."""
+
+    def __init__(self, clock, keep=10000):
+        self.clock = clock
+        self.calls = collections.deque(maxlen=keep)
+        self.counts = collections.Counter()
+
+    def record(self, name, *args):
+        self.calls.append((self.clock.monotonic(), name, args))
+        self.counts[name] += 1
+
+
+# -----------------------------
+# GPIO (RPi.GPIO look-alike)
+# -----------------------------
+class SimPWM:
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0.0
+        self.running = False
+
+    def start(self, duty):
+        self.running = True
+        self.duty = duty
+        self.gpio.record('pwm.start', self.pin, duty)
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.gpio.record('pwm.duty', self.pin, duty)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        self.gpio.record('pwm.frequency', self.pin, frequency)
+
+    def stop(self):
+        self.running = False
+        self.gpio.record('pwm.stop', self.pin)
+
+
+class SimGPIO(Recorder):
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    # wait_for_edge() looks at the pin this often
+    poll_interval = 0.0001
+
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.pwms = {}
+        # Devices that drive input pins: pin -> callable(now) -> level
+        self.inputs = {}
+        # Devices watching output pins: pin -> callable(level, now)
+        self.watchers = {}
+        # add_event_detect(): pin -> (edge, callback)
+        self.detects = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+        self.record('setmode', mode)
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pins, direction, pull_up_down=None, initial=None):
+        for pin in _pins(pins):
+            self.directions[pin] = direction
+            if direction == self.OUT:
+                self.levels[pin] = initial or 0
+        self.record('setup', pins, direction)
+
+    def output(self, pins, values):
+        pins = _pins(pins)
+        if not isinstance(values, (list, tuple)):
+            values = [values] * len(pins)
+        now = self.clock.monotonic()
+        for pin, value in zip(pins, values):
+            value = int(bool(value))
+            previous = self.levels.get(pin, 0)
+            self.levels[pin] = value
+            watcher = self.watchers.get(pin)
+            if watcher is not None and value != previous:
+                watcher(value, now)
+        self.record('output', tuple(pins), tuple(values))
+
+    def input(self, pin):
+        source = self.inputs.get(pin)
+        if source is not None:
+            return source(self.clock.monotonic())
+        return self.levels.get(pin, 0)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.detects[channel] = (edge, callback)
+        self.record('add_event_detect', channel, edge)
+
+    def remove_event_detect(self, channel):
+        self.detects.pop(channel, None)
+        self.record('remove_event_detect', channel)
+
+    def input_changed(self, pin, level):
+        """An input device changed the pin: runs the add_event_detect() callback."""
+        detect = self.detects.get(pin)
+        if detect is None:
+            return
+        edge, callback = detect
+        if callback is not None and (edge == self.BOTH or (edge == self.RISING) == bool(level)):
+            callback(pin)
+
+    def wait_for_edge(self, channel, edge, bouncetime=None, timeout=None):
+        """Polls the pin on the clock; the channel, or None after timeout ms."""
+        self.record('wait_for_edge', channel, edge)
+        deadline = None if timeout is None else self.clock.monotonic() + timeout / 1000
+        level = self.input(channel)
+        while deadline is None or self.clock.monotonic() < deadline:
+            self.clock.sleep(self.poll_interval)
+            new = self.input(channel)
+            if new != level and (edge == self.BOTH or (edge == self.RISING) == bool(new)):
+                return channel
+            level = new
+        return None
+
+    def PWM(self, pin, frequency):
+        pwm = self.pwms[pin] = SimPWM(self, pin, frequency)
+        return pwm
+
+    def cleanup(self, pins=None):
+        self.record('cleanup', pins)
+
+
+def _pins(pins):
+    return list(pins) if isinstance(pins, (list, tuple)) else [pins]
+
+
+# -----------------------------
+# Servos (adafruit_servokit.ServoKit look-alike)
+# -----------------------------
+class SimServo:
+    def __init__(self, kit, channel):
+        self.kit = kit
+        self.channel = channel
+        self._angle = None
+
+    @property
+    def angle(self):
+        return self._angle
+
+    @angle.setter
+    def angle(self, value):
+        if value is not None and not 0 <= value <= 180:
+            raise ValueError("Angle out of range")
+        self._angle = value
+        self.kit.record('servo.angle', self.channel, value)
+
+
+class SimServoKit(Recorder):
+    def __init__(self, clock, channels=16):
+        super().__init__(clock)
+        self.frequency = 50
+        self.servo = [SimServo(self, channel) for channel in range(channels)]
+
+
+# -----------------------------
+# I2C (smbus.SMBus look-alike)
+# -----------------------------
+class SimSMBus(Recorder):
+    """
+    Every transaction takes the time it would on the wire at `speed`
+    (the Pi's default is 100 kHz) on the clock: 9 bits per byte plus
+    start/stop, with the address and register byte (the address twice
+    for a read) in front. The count and total are kept too.
+    """
+
+    def __init__(self, clock, devices, bus=1, speed=100000):
+        super().__init__(clock)
+        self.bus = bus
+        self.devices = devices
+        self.speed = speed
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_time = 0.0
+
+    def _transfer(self, read, length):
+        header = 3 if read else 2      # address, register (, address again)
+        self.transactions += 1
+        self.bytes += length
+        duration = (9 * (header + length) + 3) / self.speed
+        self.bus_time += duration
+        self.clock.sleep(duration)
+
+    def _device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            raise OSError(121, "Remote I/O error")
+        return device
+
+    def write_byte_data(self, address, register, value):
+        self.record('write_byte_data', address, register)
+        self._transfer(False, 1)
+        self._device(address).write(register, [value & 0xFF])
+
+    def read_byte_data(self, address, register):
+        self.record('read_byte_data', address, register)
+        self._transfer(True, 1)
+        return self._device(address).read(register, 1)[0]
+
+    def write_i2c_block_data(self, address, register, data):
+        self.record('write_i2c_block_data', address, register, len(data))
+        self._transfer(False, len(data))
+        self._device(address).write(register, list(data))
+
+    def read_i2c_block_data(self, address, register, length=32):
+        self.record('read_i2c_block_data', address, register, length)
+        self._transfer(True, length)
+        return self._device(address).read(register, length)
+
+    def close(self):
+        pass
+
+
+class SimMPU6050:
+    """
+    MPU6050 register model. Readings are the true motion (set_motion())
+    plus a fixed bias, a slow bias random walk and white noise, at the
+    datasheet's typical levels, quantised at the configured full scale
+    and refreshed at the configured sample rate.
+
+    The data-ready flag (INT_STATUS, and the INT pin through int_level())
+    and the FIFO follow the sample rate too, so a driver can be run
+    against it at the chip's ODR.
+    """
+
+    PWR_MGMT_1 = 0x6B
+    WHO_AM_I = 0x75
+    SMPLRT_DIV = 0x19
+    CONFIG = 0x1A
+    GYRO_CONFIG = 0x1B
+    ACCEL_CONFIG = 0x1C
+    FIFO_EN = 0x23
+    INT_PIN_CFG = 0x37
+    INT_ENABLE = 0x38
+    INT_STATUS = 0x3A
+    ACCEL_XOUT_H = 0x3B
+    USER_CTRL = 0x6A
+    FIFO_COUNT_H = 0x72
+    FIFO_R_W = 0x74
+    FIFO_SIZE = 1024
+    # FIFO_EN bit -> data registers it puts in the FIFO, in FIFO order
+    FIFO_SOURCES = ((0x08, 0x3B, 6), (0x80, 0x41, 2), (0x40, 0x43, 2), (0x20, 0x45, 2), (0x10, 0x47, 2))
+    ACCEL_SCALES = (16384.0, 8192.0, 4096.0, 2048.0)     # LSB per g
+    GYRO_SCALES = (131.0, 65.5, 32.8, 16.4)             # LSB per deg/s
+
+    def __init__(self, clock, accel_bias=(0.02, -0.015, 0.03), gyro_bias=(1.5, -0.8, 0.4),
+                 accel_noise=0.006, gyro_noise=0.05, gyro_bias_walk=0.002, temperature=28.0, seed=1):
+        self.clock = clock
+        self.registers = bytearray(128)
+        self.registers[self.WHO_AM_I] = 0x68
+        self.registers[self.PWR_MGMT_1] = 0x40     # asleep after power up
+        self.accel_bias = list(accel_bias)      # g
+        self.gyro_bias = list(gyro_bias)        # deg/s
+        self.accel_noise = accel_noise          # g RMS
+        self.gyro_noise = gyro_noise            # deg/s RMS
+        self.gyro_bias_walk = gyro_bias_walk    # deg/s per sqrt(s)
+        self.temperature = temperature
+        self.accel = (0.0, 0.0, 1.0)            # true, g (level and still)
+        self.gyro = (0.0, 0.0, 0.0)             # true, deg/s
+        self.motion = None      # callable(t) -> (accel, gyro), for motion that changes per sample
+        self.random = random.Random(seed)
+        self._sample_index = None
+        self.samples = 0
+        self.int_status = 0
+        self.fifo = bytearray()
+        self.fifo_overflows = 0
+
+    def set_motion(self, accel=None, gyro=None):
+        if accel is not None:
+            self.accel = tuple(accel)
+        if gyro is not None:
+            self.gyro = tuple(gyro)
+
+    @property
+    def sample_rate(self):
+        # 8 kHz gyro output with the low pass filter off, else 1 kHz
+        base = 8000.0 if self.registers[self.CONFIG] & 0x07 in (0, 7) else 1000.0
+        return base / (1 + self.registers[self.SMPLRT_DIV])
+
+    def write(self, register, values):
+        for i, value in enumerate(values):
+            register_i = (register + i) & 0x7F
+            if register_i == self.USER_CTRL and value & 0x04:     # FIFO_RESET, clears itself
+                self.fifo.clear()
+                self.int_status &= ~0x10
+                value &= ~0x04
+            self.registers[register_i] = value
+
+    def read(self, register, length):
+        self._update()
+        if register == self.FIFO_R_W:
+            # Burst reads of FIFO_R_W keep reading the FIFO
+            values = list(self.fifo[:length])
+            del self.fifo[:length]
+            values += [0] * (length - len(values))
+        else:
+            self.registers[self.INT_STATUS] = self.int_status
+            self.registers[self.FIFO_COUNT_H] = len(self.fifo) >> 8
+            self.registers[self.FIFO_COUNT_H + 1] = len(self.fifo) & 0xFF
+            values = [self.registers[(register + i) & 0x7F] for i in range(length)]
+        if register <= self.INT_STATUS < register + length or self.registers[self.INT_PIN_CFG] & 0x10:
+            self.int_status = 0     # cleared by reading it (or by any read with INT_RD_CLEAR)
+        return values
+
+    def int_level(self, now):
+        """The INT pin: data ready, latched or as a 50 us pulse."""
+        if not self.registers[self.INT_ENABLE] & 0x01:
+            return 0
+        self._update()
+        if self.registers[self.INT_PIN_CFG] & 0x20:
+            return 1 if self.int_status & 0x01 else 0
+        return 1 if (now * self.sample_rate) % 1 < 50e-6 * self.sample_rate else 0
+
+    def _update(self):
+        index = int(self.clock.monotonic() * self.sample_rate)
+        if index == self._sample_index:
+            return
+        new = 1 if self._sample_index is None else index - self._sample_index
+        elapsed = 0.0 if self._sample_index is None else new / self.sample_rate
+        self._sample_index = index
+        if self.registers[self.PWR_MGMT_1] & 0x40:
+            self.registers[0x3B:0x49] = bytes(14)     # asleep: no data
+            return
+        fifo = self.registers[self.USER_CTRL] & 0x40 and self.registers[self.FIFO_EN]
+        # Every sample since the last look goes to the FIFO; past a full
+        # FIFO's worth the older ones would be overwritten anyway
+        count = min(new, self.FIFO_SIZE // 2 + 1) if fifo else 1
+        for k in range(count):
+            if self.motion is not None:
+                self.accel, self.gyro = self.motion((index - count + 1 + k) / self.sample_rate)
+            self.samples += 1
+            self._sample()
+            if fifo:
+                self._push_fifo()
+        self.int_status |= 0x01
+        # Gyro bias wanders a little over time
+        step = self.gyro_bias_walk * math.sqrt(min(elapsed, 1.0))
+        self.gyro_bias = [b + self.random.gauss(0, step) for b in self.gyro_bias]
+
+    def _push_fifo(self):
+        enabled = self.registers[self.FIFO_EN]
+        for bit, register, length in self.FIFO_SOURCES:
+            if enabled & bit:
+                self.fifo += self.registers[register:register + length]
+        if len(self.fifo) > self.FIFO_SIZE:
+            del self.fifo[:len(self.fifo) - self.FIFO_SIZE]     # oldest data lost
+            self.int_status |= 0x10
+            self.fifo_overflows += 1
+
+    def _sample(self):
+        accel_scale = self.ACCEL_SCALES[(self.registers[self.ACCEL_CONFIG] >> 3) & 3]
+        gyro_scale = self.GYRO_SCALES[(self.registers[self.GYRO_CONFIG] >> 3) & 3]
+        gauss = self.random.gauss
+        words = [(a + b + gauss(0, self.accel_noise)) * accel_scale
+                 for a, b in zip(self.accel, self.accel_bias)]
+        words.append((self.temperature - 36.53) * 340)
+        words += [(g + b + gauss(0, self.gyro_noise)) * gyro_scale
+                  for g, b in zip(self.gyro, self.gyro_bias)]
+        for i, word in enumerate(words):
+            word = max(-32768, min(32767, int(round(word)))) & 0xFFFF
+            self.registers[0x3B + 2 * i] = word >> 8
+            self.registers[0x3C + 2 * i] = word & 0xFF
+
+
+# -----------------------------
+# Sonar (HC-SR04)
+# -----------------------------
+SPEED_OF_SOUND = 343.0      # m/s
+
+
+class SimSonar:
+    """
+    HC-SR04 at the pin level: a trigger pulse on the trigger pin starts a
+    measurement, the echo pin goes high echo_delay later and stays high
+    for the round trip time. Past max_range the echo stays high for
+    no_echo_pulse (38 ms on the real module).
+
+    outlier_rate of the pings see a stray reflection at a random
+    distance and drop_rate get no echo pulse at all (a fault: the echo
+    pin never goes high). on_edge(level) is called at each echo edge.
+    """
+
+    def __init__(self, clock, distance_cm=100.0, noise_cm=0.3, echo_delay=0.0005,
+                 max_range_cm=400.0, no_echo_pulse=0.038, outlier_rate=0.0, drop_rate=0.0, seed=2):
+        self.clock = clock
+        self.distance_cm = distance_cm      # a number, or callable(now) -> cm
+        self.noise_cm = noise_cm
+        self.echo_delay = echo_delay
+        self.max_range_cm = max_range_cm
+        self.no_echo_pulse = no_echo_pulse
+        self.outlier_rate = outlier_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.echo_start = None
+        self.echo_end = None
+        self.triggers = 0
+        self.on_edge = None
+
+    def true_distance(self, now=None):
+        if callable(self.distance_cm):
+            return self.distance_cm(self.clock.monotonic() if now is None else now)
+        return self.distance_cm
+
+    def measure(self, now=None):
+        """Distance as the module would report it, cm (None past max range)."""
+        distance = self.true_distance(now)
+        if distance > self.max_range_cm:
+            return None
+        return max(2.0, distance + self.random.gauss(0, self.noise_cm))
+
+    def echo_time(self, distance_cm):
+        return 2 * distance_cm / 100 / SPEED_OF_SOUND
+
+    def trigger_level(self, level, now):
+        if level == 0:      # measurement starts on the falling edge
+            self.triggers += 1
+            if self.random.random() < self.drop_rate:
+                self.echo_start = self.echo_end = None
+                return
+            distance = self.measure(now)
+            if distance is not None and self.random.random() < self.outlier_rate:
+                distance = self.random.uniform(2.0, self.max_range_cm)
+            width = self.no_echo_pulse if distance is None else self.echo_time(distance)
+            self.echo_start = now + self.echo_delay
+            self.echo_end = self.echo_start + width
+            if self.on_edge is not None:
+                self.clock.call_at(self.echo_start, lambda: self.on_edge(1))
+                self.clock.call_at(self.echo_end, lambda: self.on_edge(0))
+
+    def echo_level(self, now):
+        if self.echo_start is None:
+            return 0
+        return 1 if self.echo_start <= now < self.echo_end else 0
+
+
+class SimDistanceSensor:
+    """gpiozero.DistanceSensor look-alike: .distance in metres, capped at max_distance."""
+
+    def __init__(self, sonar, echo=None, trigger=None, max_distance=1.0):
+        self.sonar = sonar
+        self.echo = echo
+        self.trigger = trigger
+        self.max_distance = max_distance
+
+    @property
+    def distance(self):
+        measured = self.sonar.measure()
+        if measured is None:
+            return self.max_distance
+        return min(measured / 100, self.max_distance)
+
+    def close(self):
+        pass
@@ -0,0 +1,235 @@
+# imu_calibration.py
+# MPU6050 offsets kept between runs, so start up doesn't have to stand
+# still for a fresh calibration every time:
+#
+#   offsets, source = calibrate(mpu)        # cached: ~0.2 s, fresh: ~1 s
+#
+# The file holds offsets per sensor and per temperature (the gyro bias
+# moves with it). A cached entry is checked against a short burst when
+# the robot is still and only redone if it's out of tolerance.
+# BiasRefiner then keeps the gyro offsets up to date whenever the robot
+# stands still (imu_service.py) and writes them back.
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+CALIBRATION_FILE = os.environ.get('ROBOT_IMU_CALIBRATION',
+                                  os.path.expanduser('~/.robot/imu_calibration.json'))
+FORMAT_VERSION = 1
+
+FULL_SAMPLES = 200          # fresh calibration, as bot_main.py always did
+CHECK_SAMPLES = 40          # checking a cached entry
+STILL_TIMEOUT = 5.0         # s to wait for the robot to stand still for a fresh one
+TEMPERATURE_TOLERANCE = 5.0     # deg C between the sensor and a cached entry
+GYRO_TOLERANCE = 1.5        # deg/s between a cached gyro offset and the burst
+ACCEL_TOLERANCE = 0.05      # g
+# Standing still: noise no bigger than this (standard deviation), 1 g
+# of accel, and the gyro mean no further from the offsets than
+STILL_GYRO = 0.5            # deg/s
+STILL_ACCEL = 0.02          # g
+MOVING_GYRO = 5.0           # deg/s from a cached offset: turning, not a changed bias
+MAX_GYRO_BIAS = 10.0        # deg/s from 0 for a fresh calibration
+
+
+def sensor_key(mpu):
+    """The MPU6050 has no serial number: bus, address and ranges instead."""
+    bus = getattr(mpu.bus, 'bus', 1)
+    return f"mpu6050/{bus}/{mpu.address:#04x}/a{mpu.accel_range}g{mpu.gyro_range}"
+
+
+class CalibrationStore:
+    """The JSON file; written whole to a temporary file and renamed into place."""
+
+    def __init__(self, path=CALIBRATION_FILE):
+        self.path = path
+        self.sensors = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"IMU calibration: can't read {self.path} ({e}), starting afresh.")
+            return
+        if data.get('version') != FORMAT_VERSION:
+            print(f"IMU calibration: {self.path} is version {data.get('version')}, ignoring it.")
+            return
+        self.sensors = data.get('sensors', {})
+
+    def lookup(self, sensor, temperature):
+        """The entry nearest this temperature, or None."""
+        entries = self.sensors.get(sensor, [])
+        if not entries:
+            return None
+        return min(entries, key=lambda entry: abs(entry['temperature'] - temperature))
+
+    def update(self, sensor, temperature, offsets, samples):
+        """Replace the entry within TEMPERATURE_TOLERANCE / 2, or add one."""
+        entry = {'temperature': round(temperature, 1), 'offsets': [round(o, 2) for o in offsets],
+                 'samples': samples, 'updated': round(time.time())}
+        with self._lock:
+            entries = [e for e in self.sensors.get(sensor, [])
+                       if abs(e['temperature'] - temperature) > TEMPERATURE_TOLERANCE / 2]
+            self.sensors[sensor] = sorted(entries + [entry], key=lambda e: e['temperature'])
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({'version': FORMAT_VERSION, 'sensors': self.sensors}, indent=1)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(data)
+        os.replace(temporary, self.path)
+
+
+# -----------------------------
+# Start up
+# -----------------------------
+def measure(mpu, n):
+    """Mean and standard deviation per axis of n samples (raw LSB), from the FIFO."""
+    samples = np.array(mpu.collect(n), dtype=np.float64)
+    return samples.mean(axis=0), samples.std(axis=0)
+
+
+def still(mpu, mean, std, gyro_offsets=(0, 0, 0), limit=MAX_GYRO_BIAS):
+    """A steady turn is as quiet as standing still: hence the limit on the mean."""
+    gravity = sum(m * m for m in mean[:3]) ** 0.5 / mpu.accel_scale
+    return (max(std[3:]) / mpu.gyro_scale < STILL_GYRO and
+            max(std[:3]) / mpu.accel_scale < STILL_ACCEL and
+            abs(gravity - 1.0) < STILL_ACCEL * 5 and
+            max(abs(m - o) for m, o in zip(mean[3:], gyro_offsets)) / mpu.gyro_scale < limit)
+
+
+def offsets_from(mpu, mean):
+    offsets = mean.tolist()
+    offsets[2] -= mpu.accel_scale      # remove gravity
+    return offsets
+
+
+def calibrate(mpu, store=None, clock=time.monotonic):
+    """
+    The offsets (ax, ay, az, gx, gy, gz in LSB) and where they came from:
+    'cached', 'cached, unchecked' (the robot was moving), or 'measured'.
+    """
+    store = store if store is not None else CalibrationStore()
+    sensor = sensor_key(mpu)
+    mpu.read_raw()
+    temperature = mpu.temperature
+    entry = store.lookup(sensor, temperature)
+    near = entry is not None and abs(entry['temperature'] - temperature) <= TEMPERATURE_TOLERANCE
+
+    if near:
+        cached = entry['offsets']
+        mean, std = measure(mpu, CHECK_SAMPLES)
+        if not still(mpu, mean, std, cached[3:], MOVING_GYRO):
+            return cached, 'cached, unchecked'
+        measured = offsets_from(mpu, mean)
+        gyro_error = max(abs(a - b) for a, b in zip(cached[3:], measured[3:])) / mpu.gyro_scale
+        accel_error = max(abs(a - b) for a, b in zip(cached[:3], measured[:3])) / mpu.accel_scale
+        if gyro_error <= GYRO_TOLERANCE and accel_error <= ACCEL_TOLERANCE:
+            return cached, 'cached'
+        print(f"IMU calibration: cached offsets out by {gyro_error:.2f} deg/s, "
+              f"{accel_error:.3f} g; recalibrating.")
+
+    # Fresh calibration: needs the robot still
+    print("Calibrating MPU6050... keep the robot still.")
+    deadline = clock() + STILL_TIMEOUT
+    while True:
+        mean, std = measure(mpu, FULL_SAMPLES)
+        if still(mpu, mean, std):
+            break
+        if clock() >= deadline:
+            if entry is not None:
+                print("IMU calibration: robot not still, using the nearest cached offsets.")
+                return entry['offsets'], 'cached, unchecked'
+            print("IMU calibration: robot not still, offsets may be off.")
+            break
+    offsets = offsets_from(mpu, mean)
+    store.update(sensor, temperature, offsets, FULL_SAMPLES)
+    try:
+        store.save()
+    except OSError as e:
+        print(f"IMU calibration: can't save ({e})")
+    return offsets, 'measured'
+
+
+# -----------------------------
+# Online refinement
+# -----------------------------
+class BiasRefiner:
+    """
+    Fed the raw samples as they come in. Over each window of `window`
+    samples it checks the robot stood still, and if so moves the gyro
+    offsets `rate` of the way toward the window's mean. A mean further
+    than GYRO_TOLERANCE from the offsets is taken for a slow turn, not
+    bias, and left alone. The accel offsets are never touched: standing
+    on a slope looks the same as an accel offset. Changes are written to
+    the store at most every save_interval seconds, on a thread of its own.
+    """
+
+    def __init__(self, mpu, offsets, store=None, window=200, rate=0.2, save_interval=60.0,
+                 clock=time.monotonic):
+        self.mpu = mpu
+        self.offsets = list(offsets)
+        self.store = store if store is not None else CalibrationStore()
+        self.sensor = sensor_key(mpu)
+        self.window = window
+        self.rate = rate
+        self.save_interval = save_interval
+        self.clock = clock
+        self.refinements = 0
+        self._sum = np.zeros(6)
+        self._sum_sq = np.zeros(6)
+        self._count = 0
+        self._dirty = False
+        self._saved_at = clock()
+
+    def add(self, raw):
+        """raw is (n, 6) LSB; True when the offsets changed."""
+        if not len(raw):
+            return False
+        data = np.asarray(raw, dtype=np.float64)
+        self._sum += data.sum(axis=0)
+        self._sum_sq += (data * data).sum(axis=0)
+        self._count += len(data)
+        if self._count < self.window:
+            return False
+        mean = self._sum / self._count
+        std = np.sqrt(np.maximum(self._sum_sq / self._count - mean * mean, 0.0))
+        self._sum[:] = 0
+        self._sum_sq[:] = 0
+        samples, self._count = self._count, 0
+        if not still(self.mpu, mean, std, self.offsets[3:], GYRO_TOLERANCE):
+            return False
+        for axis in (3, 4, 5):
+            self.offsets[axis] += self.rate * (mean[axis] - self.offsets[axis])
+        self.refinements += 1
+        self._dirty = True
+        if self.clock() - self._saved_at >= self.save_interval:
+            self.save(samples)
+        return True
+
+    def save(self, samples=0, wait=False):
+        if not self._dirty:
+            return
+        self.mpu.read_raw()     # the temperature now
+        self.store.update(self.sensor, self.mpu.temperature, self.offsets, samples)
+        self._dirty = False
+        self._saved_at = self.clock()
+        if wait:
+            self._write()
+        else:
+            threading.Thread(target=self._write, daemon=True).start()
+
+    def _write(self):
+        try:
+            self.store.save()
+        except OSError as e:
+            print(f"IMU calibration: can't save ({e})")
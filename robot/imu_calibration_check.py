@@ -0,0 +1,119 @@
+# imu_calibration_check.py
+# The calibration cache (imu_calibration.py) on the simulated MPU6050 and
+# a virtual clock: start up time with and without a cached entry, when
+# it gets redone, and the online bias refinement. Uses a temporary file.
+# Runs anywhere.
+#
+#   python imu_calibration_check.py
+import os
+import tempfile
+
+import hal
+from hal_sim import SimClock
+from imu_calibration import BiasRefiner, CalibrationStore, calibrate
+from imu_service import ImuService
+from mpu6050 import MPU6050
+
+failures = 0
+
+
+def check(name, ok, detail=""):
+    global failures
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{' (' + detail + ')' if detail else ''}")
+    if not ok:
+        failures += 1
+
+
+def start(path, temperature=28.0, gyro_bias=(1.5, -0.8, 0.4), gyro=(0.0, 0.0, 0.0)):
+    """A fresh boot: the sensor, and calibrate() timed on the virtual clock."""
+    clock = SimClock()
+    hw = hal.load('sim', clock=clock)
+    hw.mpu.temperature = temperature
+    hw.mpu.gyro_bias = list(gyro_bias)
+    hw.mpu.set_motion(gyro=gyro)
+    mpu = MPU6050(hw.SMBus(1), hal.MPU_ADDRESS, clock=clock.monotonic, sleep=clock.sleep)
+    begin = clock.monotonic()
+    offsets, source = calibrate(mpu, CalibrationStore(path), clock=clock.monotonic)
+    return clock, hw, mpu, offsets, source, clock.monotonic() - begin
+
+
+def gyro_error(mpu, offsets, bias):
+    """Worst gyro axis: offset against the simulated bias, deg/s."""
+    return max(abs(o / mpu.gyro_scale - b) for o, b in zip(offsets[3:], bias))
+
+
+def old_start():
+    # bot_main.py before: 2 s, then 200 x (12 single reads + 5 ms)
+    clock = SimClock()
+    hw = hal.load('sim', clock=clock)
+    bus = hw.SMBus(1)
+    begin = clock.monotonic()
+    clock.sleep(2)
+    for _ in range(200):
+        for register in range(0x3B, 0x47, 2):
+            bus.read_byte_data(hal.MPU_ADDRESS, register)
+            bus.read_byte_data(hal.MPU_ADDRESS, register + 1)
+        clock.sleep(0.005)
+    return clock.monotonic() - begin
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'imu_calibration.json')
+    old = old_start()
+    print(f"old start up calibration: {old:.2f} s")
+
+    clock, hw, mpu, offsets, source, took = start(path)
+    check("no file: full calibration", source == 'measured', f"{took:.2f} s")
+    check("offsets match the bias", gyro_error(mpu, offsets, hw.mpu.gyro_bias) < 0.05,
+          f"{gyro_error(mpu, offsets, hw.mpu.gyro_bias):.3f} deg/s")
+    check("file written", os.path.exists(path))
+
+    clock, hw, mpu, offsets, source, took = start(path)
+    check("next start: cached", source == 'cached', f"{took:.2f} s, {old / took:.0f}x quicker than before")
+
+    clock, hw, mpu, offsets, source, took = start(path, temperature=45.0)
+    check("15 deg C warmer: full calibration", source == 'measured', f"{took:.2f} s")
+    check("an entry per temperature", len(CalibrationStore(path).sensors[next(iter(CalibrationStore(path).sensors))]) == 2)
+
+    clock, hw, mpu, offsets, source, took = start(path, gyro_bias=(4.0, -0.8, 0.4))
+    check("bias out of tolerance: recalibrated", source == 'measured',
+          f"error now {gyro_error(mpu, offsets, hw.mpu.gyro_bias):.3f} deg/s")
+
+    clock, hw, mpu, offsets, source, took = start(path, gyro=(0.0, 0.0, 25.0))
+    check("turning at start up: cached, not checked", source == 'cached, unchecked', f"{took:.2f} s")
+
+    # Online: the bias drifts 0.6 deg/s after start up, the robot stands still
+    clock, hw, mpu, offsets, source, took = start(path)
+    hw.mpu.gyro_bias = [b + 0.6 for b in hw.mpu.gyro_bias]
+    hw.mpu.gyro_bias_walk = 0.0
+    store = CalibrationStore(path)
+    refiner = BiasRefiner(mpu, offsets, store, clock=clock.monotonic, save_interval=10)
+    imu = ImuService(mpu, offsets, clock=clock.monotonic, sleep=clock.sleep, refiner=refiner)
+    mpu.start_fifo()
+    before = gyro_error(mpu, imu.offsets, hw.mpu.gyro_bias)
+    for _ in range(3000):        # 30 s
+        clock.advance(imu.poll_interval)
+        imu.poll()
+    after = gyro_error(mpu, imu.offsets, hw.mpu.gyro_bias)
+    check("standing still: bias refined", after < 0.05,
+          f"{before:.2f} -> {after:.3f} deg/s, {refiner.refinements} refinements")
+    yaw = imu.snapshot().yaw
+    for _ in range(1000):
+        clock.advance(imu.poll_interval)
+        imu.poll()
+    drift = abs(imu.snapshot().yaw - yaw) / 10
+    check("yaw drift after refinement", drift < 0.05, f"{drift:.3f} deg/s")
+
+    # A turn isn't bias
+    refinements = refiner.refinements
+    hw.mpu.set_motion(gyro=(0.0, 0.0, 20.0))
+    for _ in range(1000):
+        clock.advance(imu.poll_interval)
+        imu.poll()
+    check("turning: offsets left alone", refiner.refinements == refinements)
+    imu.stop()
+    entry = CalibrationStore(path).lookup(refiner.sensor, 28.0)
+    check("refined offsets saved", abs(entry['offsets'][3] - imu.offsets[3]) < 0.01,
+          f"gx {entry['offsets'][3]:.1f} LSB")
+
+print("All checks passed" if not failures else f"{failures} check(s) failed")
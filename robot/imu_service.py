@@ -0,0 +1,204 @@
+# imu_service.py
+# The MPU6050 sampled at its own rate on a thread of its own. Every
+# sample goes through the attitude filter (fusion.py) with its real dt,
+# and the latest state is published for the telemetry and control loops
+# to read without waiting on the sampler (or on I2C).
+#
+#   imu = ImuService(mpu, offsets)
+#   imu.start()
+#   state = imu.snapshot()      # ImuState, any thread, never blocks
+import collections
+import threading
+import time
+
+from fusion import FILTERS, DeadReckoning, to_units
+
+POLL_INTERVAL = 0.01        # s between FIFO reads
+REPORT_KEEP = 2000          # wake ups kept for the jitter report
+# Below this many samples per read NumPy's per-call overhead costs more
+# than it saves, so they go through the per-sample path (fusion_bench.py)
+VECTOR_MIN = 32
+
+ImuState = collections.namedtuple(
+    'ImuState',
+    'time samples pitch roll yaw ax ay az gx gy gz x y vx vy')
+ImuState.__doc__ = """\
+time: monotonic time of the newest sample, samples: count so far.
+pitch/roll/yaw in degrees, accel in g, gyro in deg/s (offsets removed),
+x/y in m and vx/vy in m/s (dead reckoning, approximate)."""
+
+EMPTY = ImuState(None, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+class SamplerStats:
+    """How the sampling thread keeps time: wake-up jitter, batch sizes, cost."""
+
+    def __init__(self, interval, sample_rate, keep=REPORT_KEEP):
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.wakes = collections.deque(maxlen=keep)     # (wake time, samples, busy seconds)
+        self.samples = 0
+        self.started = None
+        self.late = 0       # wake ups more than one interval late
+
+    def wake(self, now, samples, busy):
+        if self.started is None:
+            self.started = now
+        elif now - self.wakes[-1][0] > 2 * self.interval:
+            self.late += 1
+        self.wakes.append((now, samples, busy))
+        self.samples += samples
+
+    def report(self):
+        wakes = list(self.wakes)
+        if len(wakes) < 2:
+            return None
+        jitter = sorted(abs(b[0] - a[0] - self.interval) for a, b in zip(wakes, wakes[1:]))
+        batches = [n for _, n, _ in wakes]
+        busy = sum(b for _, _, b in wakes)
+        elapsed = wakes[-1][0] - self.started
+        return {
+            'sample_rate': self.sample_rate,
+            'samples_per_s': self.samples / elapsed if elapsed > 0 else 0.0,
+            'wakes': len(wakes),
+            'late_wakes': self.late,
+            'jitter_p50_ms': _percentile(jitter, 50) * 1000,
+            'jitter_p99_ms': _percentile(jitter, 99) * 1000,
+            'jitter_max_ms': jitter[-1] * 1000,
+            'batch_mean': sum(batches) / len(batches),
+            'batch_max': max(batches),
+            'cost_per_sample_us': busy / max(1, sum(batches)) * 1e6,
+            'busy_percent': busy / (wakes[-1][0] - wakes[0][0]) * 100,
+        }
+
+    def format(self, report):
+        return (f"IMU: {report['samples_per_s']:.0f}/{report['sample_rate']:.0f} samples/s, "
+                f"wake jitter p50 {report['jitter_p50_ms']:.2f} ms p99 {report['jitter_p99_ms']:.2f} ms "
+                f"max {report['jitter_max_ms']:.2f} ms, {report['late_wakes']} late, "
+                f"batch {report['batch_mean']:.1f} (max {report['batch_max']}), "
+                f"{report['cost_per_sample_us']:.0f} us/sample, {report['busy_percent']:.1f}% busy")
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ImuService:
+    """
+    Drains the MPU6050 FIFO every poll_interval, so samples come at the
+    chip's own rate whatever the Pi is doing, and runs the batch through
+    the filter (fusion.FILTERS: complementary, madgwick or mahony) with
+    dt = 1/sample_rate, vectorized once the batch is big enough. The state's time is the wake-up time on the
+    monotonic clock, when the newest sample was read.
+
+    offsets are the raw (LSB) values to subtract, as bot_main.py's
+    calibration makes them: ax, ay, az, gx, gy, gz. With a refiner
+    (imu_calibration.BiasRefiner) the gyro ones follow the bias drift.
+
+    The state is double buffered: the sampler fills the back buffer and
+    then flips, and snapshot() copies the front one and retries if a flip
+    got in between (a sequence count, like a seqlock), so neither side
+    ever takes a lock.
+    """
+
+    def __init__(self, mpu, offsets=(0, 0, 0, 0, 0, 0), filter='complementary',
+                 poll_interval=POLL_INTERVAL, clock=time.monotonic, sleep=time.sleep,
+                 report_interval=None, refiner=None, **filter_options):
+        self.mpu = mpu
+        self.offsets = tuple(offsets)
+        self.dt = 1.0 / mpu.sample_rate
+        self.filter = FILTERS[filter](self.dt, **filter_options)
+        self.position = DeadReckoning(self.dt)
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.report_interval = report_interval
+        self.refiner = refiner
+        self.stats = SamplerStats(poll_interval, mpu.sample_rate)
+
+        self._buffers = [list(EMPTY), list(EMPTY)]
+        self._seq = 0           # publishes so far; the front buffer is _buffers[_seq & 1]
+        self._samples = 0
+        self._thread = None
+        self.running = False
+
+    # -----------------------------
+    # Readers
+    # -----------------------------
+    def snapshot(self):
+        while True:
+            seq = self._seq
+            state = ImuState._make(self._buffers[seq & 1])
+            if self._seq == seq:
+                return state
+
+    # -----------------------------
+    # Sampler
+    # -----------------------------
+    def start(self):
+        self.mpu.start_fifo()
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name='imu', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.mpu.stop_fifo()
+        if self.refiner is not None:
+            self.refiner.save(wait=True)
+
+    def run(self):
+        next_wake = self.clock()
+        next_report = next_wake + (self.report_interval or 0)
+        while self.running:
+            next_wake += self.poll_interval
+            delay = next_wake - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            else:
+                next_wake = self.clock()    # fell behind: don't burst to catch up
+            self.poll()
+            if self.report_interval and self.clock() >= next_report:
+                next_report += self.report_interval
+                report = self.stats.report()
+                if report:
+                    print(self.stats.format(report))
+
+    def poll(self):
+        """Read what the FIFO holds, filter it and publish; the number of samples."""
+        now = self.clock()
+        raw = self.mpu.read_fifo_array()
+        n = len(raw)
+        if n >= VECTOR_MIN:
+            accel, gyro = to_units(raw, self.offsets, self.mpu.accel_scale, self.mpu.gyro_scale)
+            attitude = self.filter.update_batch(accel, gyro)
+            position = self.position.update_batch(accel, attitude)
+            self._samples += n
+            self._publish((now, self._samples) + tuple(attitude[-1].tolist()) + tuple(accel[-1].tolist())
+                          + tuple(gyro[-1].tolist()) + tuple(position[-1].tolist()))
+        elif n:
+            self._per_sample(raw.tolist(), now)
+        if self.refiner is not None and self.refiner.add(raw):
+            self.offsets = tuple(self.refiner.offsets)
+        self.stats.wake(now, n, self.clock() - now)
+        return n
+
+    def _per_sample(self, raw, now):
+        a, g = self.mpu.accel_scale, self.mpu.gyro_scale
+        o = self.offsets
+        for sample in raw:
+            ax, ay, az = (sample[0] - o[0]) / a, (sample[1] - o[1]) / a, (sample[2] - o[2]) / a
+            gx, gy, gz = (sample[3] - o[3]) / g, (sample[4] - o[4]) / g, (sample[5] - o[5]) / g
+            pitch, roll, yaw = self.filter.update(ax, ay, az, gx, gy, gz)
+            self.position.update(ax, ay, az, pitch, roll)
+        self._samples += len(raw)
+        p = self.position
+        self._publish((now, self._samples, pitch, roll, yaw, ax, ay, az, gx, gy, gz, p.x, p.y, p.vx, p.vy))
+
+    def _publish(self, state):
+        back = self._buffers[(self._seq + 1) & 1]
+        back[:] = state
+        self._seq += 1
@@ -0,0 +1,134 @@
+# imu_service_bench.py
+# The IMU sampling thread (imu_service.py) on the simulated MPU6050:
+#
+# 1. Attitude: the robot pitches back and forth; the old get_xy() read
+#    every 200 ms (dt = 0.2 s) against the service at the chip's rate.
+#    Virtual clock, so exact and quick.
+# 2. Sampler: the thread in real time with a 50 Hz control loop and a
+#    5 Hz telemetry loop reading snapshots, and its jitter/throughput
+#    report. Its busy time includes the simulated I2C transfers, which
+#    take their wire time. Runs anywhere.
+#
+#   python imu_service_bench.py [seconds]
+import math
+import sys
+import threading
+import time
+
+import hal
+from hal_sim import RealClock, SimClock
+from fusion import ALPHA
+from imu_service import ImuService
+from mpu6050 import MPU6050
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+RATES = (200, 1000)         # Hz, ODRs to try
+SWING = 20.0                # deg, pitch amplitude
+SWING_HZ = 0.5
+I2C_SPEED = 400000
+# -------------------------
+
+
+def motion(t):
+    """True pitch angle and what the sensor feels: (accel g, gyro deg/s)."""
+    angle = math.radians(SWING * math.sin(2 * math.pi * SWING_HZ * t))
+    rate = SWING * 2 * math.pi * SWING_HZ * math.cos(2 * math.pi * SWING_HZ * t)
+    return (math.sin(angle), 0.0, math.cos(angle)), (rate, 0.0, 0.0)
+
+
+def true_pitch(t):
+    return SWING * math.sin(2 * math.pi * SWING_HZ * t)
+
+
+def setup(clock, rate):
+    hw = hal.load('sim', clock=clock)
+    hw.mpu.gyro_bias = [0.0, 0.0, 0.0]          # calibrated
+    hw.mpu.accel_bias = [0.0, 0.0, 0.0]
+    hw.mpu.motion = motion
+    bus = hw.SMBus(1)
+    bus.speed = I2C_SPEED
+    mpu = MPU6050(bus, hal.MPU_ADDRESS, sample_rate=rate, clock=clock.monotonic, sleep=clock.sleep)
+    return hw, mpu
+
+
+def old_get_xy(seconds):
+    # bot_main.py before: one read per telemetry message, dt = 0.2 s
+    clock = SimClock()
+    hw, mpu = setup(clock, 200)
+    pitch = 0.0
+    errors = []
+    last_t = clock.monotonic()
+    while clock.monotonic() < 1000 + seconds:
+        clock.advance(0.2)
+        now = clock.monotonic()
+        dt, last_t = now - last_t, now
+        ax, ay, az, gx, gy, gz = mpu.read()
+        accel_pitch = math.degrees(math.atan2(ax, math.sqrt(ay**2 + az**2)))
+        pitch = ALPHA * (pitch + gx * dt) + (1 - ALPHA) * accel_pitch
+        errors.append(pitch - true_pitch(now))
+    return errors
+
+
+def service(seconds, rate):
+    clock = SimClock()
+    hw, mpu = setup(clock, rate)
+    imu = ImuService(mpu, clock=clock.monotonic, sleep=clock.sleep)
+    mpu.start_fifo()
+    errors = []
+    while clock.monotonic() < 1000 + seconds:
+        clock.advance(imu.poll_interval)
+        imu.poll()
+        state = imu.snapshot()
+        if state.time is not None:
+            errors.append(state.pitch - true_pitch(state.time))
+    return errors
+
+
+def summary(errors):
+    errors = errors[len(errors) // 5:]      # after the filter settles
+    rms = math.sqrt(sum(e * e for e in errors) / len(errors))
+    return f"pitch error RMS {rms:5.2f} deg, max {max(abs(e) for e in errors):5.2f} deg"
+
+
+def threaded(seconds, rate):
+    clock = RealClock()
+    hw, mpu = setup(clock, rate)
+    imu = ImuService(mpu).start()
+    reads = []      # (seconds in snapshot(), age of the state)
+    running = True
+
+    def reader(period):
+        while running:
+            start = time.monotonic()
+            state = imu.snapshot()
+            done = time.monotonic()
+            if state.time is not None:
+                reads.append((done - start, done - state.time))
+            time.sleep(period)
+
+    threads = [threading.Thread(target=reader, args=(period,)) for period in (1 / 50, 1 / 5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    running = False
+    for thread in threads:
+        thread.join()
+    imu.stop()
+    print(imu.stats.format(imu.stats.report()))
+    print(f"{'':5}snapshot(): {len(reads)} reads, max {max(r[0] for r in reads) * 1e6:.0f} us, "
+          f"state age max {max(r[1] for r in reads) * 1000:.1f} ms, "
+          f"{hw.mpu.fifo_overflows} FIFO overflows")
+
+
+print(f"Attitude, {SWING:.0f} deg pitch swing at {SWING_HZ} Hz, 60 s simulated")
+print(f"  get_xy() every 200 ms : {summary(old_get_xy(60))}")
+for rate in RATES:
+    print(f"  service at {rate:4d} Hz   : {summary(service(60, rate))}")
+
+print(f"\nSampler thread, {SECONDS:.0f} s real time, readers at 50 Hz and 5 Hz")
+for rate in RATES:
+    print(f"  {rate} Hz ODR:")
+    threaded(SECONDS, rate)
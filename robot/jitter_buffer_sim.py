@@ -0,0 +1,156 @@
+# jitter_buffer_sim.py
+# Replays network traces through the old unbounded queue.Queue and
+# through JitterBuffer (jitter_buffer.py), one sound card callback per
+# frame on the receiver's clock: loss, reordering, jitter bursts and a
+# sender clock running fast or slow, and a sender that mutes its mic
+# (skipping the timestamp on, the marker bit on the next packet).
+# Reports the mouth-to-ear latency through the buffer and the glitches:
+# callbacks with nothing real to play (silence, or a concealed frame)
+# while the sender is talking and, for the queue, packets played out of
+# order. Silence for a mute is counted apart, as paused.
+# Runs anywhere, on virtual time.
+#
+#   python jitter_buffer_sim.py [seconds]
+import collections
+import sys
+import time
+
+import numpy as np
+
+from jitter_buffer import JitterBuffer
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 600
+FRAMESIZE = 1024
+SAMPLERATE = 48000
+FRAME_TIME = FRAMESIZE / SAMPLERATE
+MUTE_EVERY = 30             # s, the sender mutes at 10 s, 40 s, ...
+PAUSE_SLACK = 0.2           # s after a mute that the receiver may still be silent for it
+# -------------------------
+
+Trace = collections.namedtuple('Trace', 'name base jitter spikes loss reorder ppm mute', defaults=(0,))
+# base: one way delay (s); jitter: mean of an exponential on top (s);
+# spikes: chance per packet of a 5 packet burst 60-150 ms late; loss and
+# reorder: chance per packet; ppm: how fast the sender's clock runs;
+# mute: s the sender sends nothing, every MUTE_EVERY s
+TRACES = [
+    Trace('LAN', 0.002, 0.0003, 0.0, 0.0, 0.0, 0),
+    Trace('Wi-Fi', 0.005, 0.004, 0.002, 0.01, 0.005, 0),
+    Trace('ZeroTier', 0.030, 0.008, 0.01, 0.02, 0.01, 0),
+    Trace('10% loss', 0.005, 0.002, 0.0, 0.10, 0.0, 0),
+    Trace('5% reorder', 0.005, 0.002, 0.0, 0.0, 0.05, 0),
+    Trace('sender +300 ppm', 0.005, 0.002, 0.0, 0.0, 0.0, 300),
+    Trace('sender -300 ppm', 0.005, 0.002, 0.0, 0.0, 0.0, -300),
+    Trace('ZeroTier +300 ppm', 0.030, 0.008, 0.01, 0.02, 0.01, 300),
+    Trace('Wi-Fi, 2 s mutes', 0.005, 0.004, 0.002, 0.01, 0.005, 0, 2),
+    Trace('Wi-Fi, 4 s mutes', 0.005, 0.004, 0.002, 0.01, 0.005, 0, 4),
+]
+
+
+def arrivals(trace, seconds, seed=5):
+    """
+    (arrival time, seq, frame, marker) of every packet that gets there, by
+    arrival, and the send times by seq. `frame` is the timestamp in
+    frames: it runs on through a mute, seq doesn't.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds / FRAME_TIME)
+    send = np.arange(n) * FRAME_TIME / (1 + trace.ppm * 1e-6)
+    muted = (send - 10) % MUTE_EVERY < trace.mute if trace.mute else np.zeros(n, dtype=bool)
+    frames = np.flatnonzero(~muted)
+    marker = np.concatenate([[True], np.diff(frames) > 1])
+    send, n = send[frames], len(frames)
+    delay = trace.base + rng.exponential(trace.jitter, n)
+    spike = 0.0
+    left = 0
+    for i in range(n):
+        if left == 0 and rng.random() < trace.spikes:
+            spike, left = rng.uniform(0.06, 0.15), 5
+        if left:
+            delay[i] += spike * left / 5     # the queue drains over the burst
+            left -= 1
+        if rng.random() < trace.reorder:
+            delay[i] += FRAME_TIME * rng.uniform(1.2, 2.5)
+    keep = rng.random(n) >= trace.loss
+    out = [(send[i] + delay[i], i, frames[i], marker[i]) for i in range(n) if keep[i]]
+    out.sort()
+    return out, send
+
+
+def pauses(trace):
+    """paused(now): whether silence at the receiver then is down to the sender's mute."""
+    def paused(now):
+        return trace.mute > 0 and (now - 10) % MUTE_EVERY < trace.mute + PAUSE_SLACK
+    return paused
+
+
+def callbacks(seconds):
+    # The receiver's sound card, starting at a random phase
+    return np.arange(int(seconds / FRAME_TIME) - 10) * FRAME_TIME + 0.0037
+
+
+def run_queue(packets, send, seconds, paused):
+    queue = collections.deque()
+    latency, dry, silent, out_of_order, newest = [], 0, 0, 0, -1
+    i = 0
+    for now in callbacks(seconds):
+        while i < len(packets) and packets[i][0] <= now:
+            queue.append(packets[i][1])
+            i += 1
+        if not queue:
+            if paused(now):
+                silent += 1
+            else:
+                dry += 1
+            continue
+        seq = queue.popleft()
+        out_of_order += seq < newest
+        newest = max(newest, seq)
+        latency.append(now - send[seq])
+    return latency, dry + out_of_order, {'empty': dry, 'out of order': out_of_order, 'paused': silent}
+
+
+def run_buffer(packets, send, seconds, paused):
+    buffer = JitterBuffer(FRAMESIZE, SAMPLERATE)
+    samples = np.zeros(FRAMESIZE, dtype=np.int16)
+    latency, dry, silent = [], 0, 0
+    i = 0
+    for now in callbacks(seconds):
+        while i < len(packets) and packets[i][0] <= now:
+            arrival, seq, frame, marker = packets[i]
+            buffer.put(seq & 0xFFFF, (frame * FRAMESIZE) & 0xFFFFFFFF, samples, arrival=arrival, marker=marker)
+            i += 1
+        buffer.get(now)
+        if buffer.playing is None:
+            if paused(now):
+                silent += 1
+            else:
+                dry += buffer.played > 0
+            continue
+        latency.append(now - send[buffer.playing])
+    s = buffer.stats()
+    extra = {k: s[k] for k in ('lost', 'late', 'underruns', 'shrunk', 'spurts', 'muted', 'target')}
+    return latency, dry, dict(extra, paused=silent)
+
+
+def summary(latency, seconds):
+    latency = np.array(latency) * 1000
+    tail = latency[-int(10 / FRAME_TIME):]
+    return (f"latency p50 {np.percentile(latency, 50):6.1f} p95 {np.percentile(latency, 95):6.1f} ms, "
+            f"last 10 s {tail.mean():6.1f} ms")
+
+
+print(f"{SECONDS:.0f} s per trace, {FRAMESIZE} sample frames at {SAMPLERATE} Hz "
+      f"({FRAME_TIME * 1000:.1f} ms), latency is capture to playback")
+start = time.perf_counter()
+for trace in TRACES:
+    packets, send = arrivals(trace, SECONDS)
+    paused = pauses(trace)
+    print(f"{trace.name} ({len(send) - len(packets)} of {len(send)} packets lost on the way):")
+    for name, run in (('queue.Queue', run_queue), ('JitterBuffer', run_buffer)):
+        latency, dry, extra = run(packets, send, SECONDS, paused)
+        details = ', '.join(f"{k} {v}" for k, v in extra.items())
+        print(f"  {name:<13} {summary(latency, SECONDS)}, {dry:4d} glitches ({details})")
+print(f"({time.perf_counter() - start:.1f} s)")
@@ -0,0 +1,215 @@
+# mpu6050.py
+# MPU6050 driver. A sample is one 14 byte burst read instead of twelve
+# single byte transactions, and the chip's FIFO and data-ready interrupt
+# let the caller take every sample at the chip's own output data rate.
+#
+#   mpu = MPU6050(bus, sample_rate=200)
+#   ax, ay, az, gx, gy, gz = mpu.read_raw()     # latest sample, raw LSB
+#   sample = mpu.read()                         # in g and deg/s
+#   mpu.wait(); mpu.read_raw()                  # the next sample, at the ODR
+#   samples = mpu.collect(200)                  # 200 consecutive samples via the FIFO
+import struct
+import time
+from collections import namedtuple
+
+# -----------------------------
+# Registers
+# -----------------------------
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+GYRO_CONFIG = 0x1B
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
+INT_PIN_CFG = 0x37
+INT_ENABLE = 0x38
+INT_STATUS = 0x3A
+ACCEL_XOUT_H = 0x3B
+GYRO_XOUT_H = 0x43
+USER_CTRL = 0x6A
+PWR_MGMT_1 = 0x6B
+FIFO_COUNT_H = 0x72
+FIFO_R_W = 0x74
+WHO_AM_I = 0x75
+
+# Bits
+DATA_RDY = 0x01             # INT_ENABLE / INT_STATUS
+FIFO_OFLOW = 0x10           # INT_STATUS
+LATCH_INT = 0x20            # INT_PIN_CFG: INT stays high until cleared
+INT_RD_CLEAR = 0x10         # INT_PIN_CFG: ... by any read
+FIFO_ENABLE = 0x40          # USER_CTRL
+FIFO_RESET = 0x04           # USER_CTRL
+FIFO_ACCEL_GYRO = 0x78      # FIFO_EN: accel xyz + gyro xyz
+CLOCK_PLL_XGYRO = 0x01      # PWR_MGMT_1: awake, clocked from the X gyro
+
+FIFO_SIZE = 1024
+ACCEL_SCALES = (16384.0, 8192.0, 4096.0, 2048.0)    # LSB per g, +-2/4/8/16 g
+GYRO_SCALES = (131.0, 65.5, 32.8, 16.4)            # LSB per deg/s, +-250/500/1000/2000
+
+DATA = struct.Struct('>7h')             # ACCEL_XOUT_H..GYRO_ZOUT_L: accel, temperature, gyro
+FIFO_SAMPLE = struct.Struct('>6h')      # accel, gyro (what FIFO_ACCEL_GYRO puts in)
+# SMBus block reads stop at 32 bytes: read the FIFO in whole samples
+FIFO_CHUNK = 32 // FIFO_SAMPLE.size * FIFO_SAMPLE.size
+
+Raw = namedtuple('Raw', 'ax ay az gx gy gz')           # LSB
+Sample = namedtuple('Sample', 'ax ay az gx gy gz')     # g, deg/s
+
+
+class MPU6050:
+    """
+    bus is an smbus.SMBus (or hal.py's). sample_rate is the output data
+    rate asked of the chip; the nearest one its divider can do is in
+    self.sample_rate. dlpf is the CONFIG low pass setting (3 = 44 Hz).
+
+    With gpio and int_pin (the chip's INT wired to a GPIO input) wait()
+    sleeps on the interrupt edge, otherwise it polls INT_STATUS.
+    """
+
+    def __init__(self, bus, address=0x68, sample_rate=200, dlpf=3, accel_range=0, gyro_range=0,
+                 gpio=None, int_pin=None, clock=time.monotonic, sleep=time.sleep):
+        self.bus = bus
+        self.address = address
+        self.dlpf = dlpf
+        self.accel_range = accel_range
+        self.gyro_range = gyro_range
+        self.accel_scale = ACCEL_SCALES[accel_range]
+        self.gyro_scale = GYRO_SCALES[gyro_range]
+        self.gpio = gpio
+        self.int_pin = int_pin
+        self.clock = clock
+        self.sleep = sleep
+        self.temperature_raw = 0
+        self.overflows = 0
+        self.configure(sample_rate)
+
+    def configure(self, sample_rate):
+        write = self.bus.write_byte_data
+        write(self.address, PWR_MGMT_1, CLOCK_PLL_XGYRO)
+        write(self.address, CONFIG, self.dlpf)
+        base = 8000.0 if self.dlpf in (0, 7) else 1000.0
+        divider = max(0, min(255, round(base / sample_rate) - 1))
+        write(self.address, SMPLRT_DIV, divider)
+        self.sample_rate = base / (1 + divider)
+        write(self.address, GYRO_CONFIG, self.gyro_range << 3)
+        write(self.address, ACCEL_CONFIG, self.accel_range << 3)
+        # Latched data-ready, cleared by the next read of anything
+        write(self.address, INT_PIN_CFG, LATCH_INT | INT_RD_CLEAR)
+        write(self.address, INT_ENABLE, DATA_RDY)
+        if self.int_pin is not None:
+            self.gpio.setup(self.int_pin, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+
+    # -----------------------------
+    # Data registers
+    # -----------------------------
+    def read_raw(self):
+        """The latest sample in one burst read of the 14 data registers."""
+        data = self.bus.read_i2c_block_data(self.address, ACCEL_XOUT_H, DATA.size)
+        ax, ay, az, self.temperature_raw, gx, gy, gz = DATA.unpack(bytes(data))
+        return Raw(ax, ay, az, gx, gy, gz)
+
+    def read(self):
+        return self.scale(self.read_raw())
+
+    def scale(self, raw):
+        a, g = self.accel_scale, self.gyro_scale
+        return Sample(raw[0] / a, raw[1] / a, raw[2] / a, raw[3] / g, raw[4] / g, raw[5] / g)
+
+    @property
+    def temperature(self):
+        """Die temperature of the last read_raw(), deg C."""
+        return self.temperature_raw / 340.0 + 36.53
+
+    # -----------------------------
+    # Data ready
+    # -----------------------------
+    def data_ready(self):
+        """A sample came in since the last read (any read clears the flag)."""
+        status = self.bus.read_byte_data(self.address, INT_STATUS)
+        if status & FIFO_OFLOW:
+            self.overflows += 1
+        return bool(status & DATA_RDY)
+
+    def wait(self, timeout=1.0):
+        """Block until the next sample is ready; False on timeout."""
+        if self.int_pin is not None:
+            if self.gpio.input(self.int_pin):
+                return True     # already latched
+            edge = self.gpio.wait_for_edge(self.int_pin, self.gpio.RISING, timeout=int(timeout * 1000))
+            return edge is not None
+        deadline = self.clock() + timeout
+        poll = 0.25 / self.sample_rate
+        while not self.data_ready():
+            if self.clock() >= deadline:
+                return False
+            self.sleep(poll)
+        return True
+
+    # -----------------------------
+    # FIFO
+    # -----------------------------
+    def start_fifo(self):
+        write = self.bus.write_byte_data
+        write(self.address, USER_CTRL, FIFO_RESET)
+        write(self.address, FIFO_EN, FIFO_ACCEL_GYRO)
+        write(self.address, USER_CTRL, FIFO_ENABLE)
+
+    def stop_fifo(self):
+        self.bus.write_byte_data(self.address, FIFO_EN, 0)
+        self.bus.write_byte_data(self.address, USER_CTRL, FIFO_RESET)
+
+    def reset_fifo(self):
+        self.bus.write_byte_data(self.address, USER_CTRL, FIFO_ENABLE | FIFO_RESET)
+
+    def fifo_count(self):
+        high, low = self.bus.read_i2c_block_data(self.address, FIFO_COUNT_H, 2)
+        return high << 8 | low
+
+    def read_fifo(self, max_samples=None):
+        """
+        The whole samples waiting in the FIFO, oldest first, as Raw.
+        A full FIFO has dropped data and is no longer aligned to samples,
+        so it is reset and [] returned (counted in self.overflows).
+        """
+        data = self._read_fifo_bytes(max_samples)
+        return [Raw._make(values) for values in FIFO_SAMPLE.iter_unpack(data)]
+
+    def read_fifo_array(self, max_samples=None):
+        """read_fifo() as an (n, 6) int16 NumPy array, for fusion.py."""
+        import numpy as np
+        data = self._read_fifo_bytes(max_samples)
+        return np.frombuffer(bytes(data), dtype='>i2').reshape(-1, 6).astype(np.int16)
+
+    def _read_fifo_bytes(self, max_samples):
+        count = self.fifo_count()
+        if count >= FIFO_SIZE:
+            self.overflows += 1
+            self.reset_fifo()
+            return b''
+        n = count // FIFO_SAMPLE.size
+        if max_samples is not None:
+            n = min(n, max_samples)
+        data = bytearray()
+        remaining = n * FIFO_SAMPLE.size
+        while remaining:
+            chunk = min(FIFO_CHUNK, remaining)
+            data += bytes(self.bus.read_i2c_block_data(self.address, FIFO_R_W, chunk))
+            remaining -= chunk
+        return data
+
+    def collect(self, n, timeout=None):
+        """n consecutive samples at the ODR through the FIFO (calibration)."""
+        if timeout is None:
+            timeout = 2.0 * n / self.sample_rate + 0.5
+        deadline = self.clock() + timeout
+        # Drain at half full, well before it can overflow
+        half_full = FIFO_SIZE // FIFO_SAMPLE.size / 2 / self.sample_rate
+        samples = []
+        self.start_fifo()
+        try:
+            while len(samples) < n:
+                if self.clock() >= deadline:
+                    raise TimeoutError(f"MPU6050: {len(samples)} of {n} samples in {timeout:.1f}s")
+                self.sleep(min(half_full, (n - len(samples)) / self.sample_rate))
+                samples += self.read_fifo(n - len(samples))
+        finally:
+            self.stop_fifo()
+        return samples
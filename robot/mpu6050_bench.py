@@ -0,0 +1,122 @@
+# mpu6050_bench.py
+# The old read_word() sampling (12 single byte reads) against the burst
+# read, the data-ready wait and the FIFO, on the simulated MPU6050
+# (hal_sim.py). Counts I2C transactions and their time on the bus (which
+# the simulated clock also spends): that is what limits the sample rate
+# on the Pi Zero. Runs anywhere.
+#
+#   python mpu6050_bench.py
+import time
+
+import hal
+from hal_sim import SimClock
+from mpu6050 import ACCEL_XOUT_H, GYRO_XOUT_H, MPU6050
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SAMPLES = 2000
+ODR = 1000          # Hz, for the data-ready and FIFO runs
+# The Pi's default is 100 kHz; 400 kHz with dtparam=i2c_arm_baudrate=400000
+# in /boot/config.txt (at 100 kHz even the FIFO can't keep up with 1 kHz)
+I2C_SPEED = 400000
+# -------------------------
+
+
+def setup(sample_rate=ODR):
+    clock = SimClock()
+    hw = hal.load('sim', clock=clock)
+    bus = hw.SMBus(1)
+    bus.speed = I2C_SPEED
+    mpu = MPU6050(bus, hal.MPU_ADDRESS, sample_rate=sample_rate, clock=clock.monotonic, sleep=clock.sleep)
+    bus.transactions, bus.bus_time = 0, 0.0     # leave out the configuration writes
+    return clock, hw, bus, mpu
+
+
+def read_word(bus, reg):
+    # As MPU.py / bot_main.py did it
+    high = bus.read_byte_data(hal.MPU_ADDRESS, reg)
+    low = bus.read_byte_data(hal.MPU_ADDRESS, reg + 1)
+    val = (high << 8) | low
+    if val > 32767: val -= 65536
+    return val
+
+
+def report(name, bus, samples, wall):
+    per_sample = bus.bus_time / samples
+    print(f"{name:<22} {bus.transactions / samples:5.2f} txn/sample  "
+          f"{per_sample * 1e6:6.0f} us on the bus  (max {1 / per_sample:5.0f} samples/s)  "
+          f"{wall / samples * 1e6:5.1f} us Python here")
+
+
+def old_reads():
+    clock, hw, bus, mpu = setup()
+    start = time.perf_counter()
+    for _ in range(SAMPLES):
+        [read_word(bus, ACCEL_XOUT_H + i) for i in (0, 2, 4)] + [read_word(bus, GYRO_XOUT_H + i) for i in (0, 2, 4)]
+        clock.advance(1.0 / ODR)
+    report("read_word x6", bus, SAMPLES, time.perf_counter() - start)
+
+
+def burst_reads():
+    clock, hw, bus, mpu = setup()
+    # Same values either way, with the bus time taken out (otherwise the
+    # twelve single reads can straddle a new sample: a torn reading)
+    bus.speed = float('inf')
+    first = tuple(read_word(bus, ACCEL_XOUT_H + i) for i in (0, 2, 4, 8, 10, 12))
+    assert tuple(mpu.read_raw()) == first, "burst read differs from read_word()"
+    bus.speed = I2C_SPEED
+    bus.transactions, bus.bus_time = 0, 0.0
+    start = time.perf_counter()
+    for _ in range(SAMPLES):
+        mpu.read_raw()
+        clock.advance(1.0 / ODR)
+    report("burst read", bus, SAMPLES, time.perf_counter() - start)
+
+
+def data_ready(int_pin=None):
+    clock, hw, bus, mpu = setup()
+    if int_pin is not None:
+        mpu.gpio, mpu.int_pin = hw.GPIO, int_pin
+    begin = clock.monotonic()
+    start = time.perf_counter()
+    for _ in range(SAMPLES):
+        assert mpu.wait(), "no data ready"
+        mpu.read_raw()
+    wall = time.perf_counter() - start
+    rate = SAMPLES / (clock.monotonic() - begin)
+    report("data ready + burst" if int_pin is None else "INT pin + burst", bus, SAMPLES, wall)
+    print(f"{'':<22} {rate:.0f} samples/s of {mpu.sample_rate:.0f} Hz ODR, {hw.mpu.samples} made by the chip")
+
+
+def fifo():
+    clock, hw, bus, mpu = setup()
+    start = time.perf_counter()
+    samples = mpu.collect(SAMPLES)
+    wall = time.perf_counter() - start
+    report("FIFO", bus, len(samples), wall)
+    print(f"{'':<22} {len(samples)} samples, {mpu.overflows} overflows, "
+          f"{len(samples) - len(set(samples))} repeats")
+
+
+def calibration():
+    # bot_main.py's start up: 200 samples, read_word with 5 ms sleeps before
+    clock, hw, bus, mpu = setup(200)
+    begin = clock.monotonic()
+    for _ in range(200):
+        [read_word(bus, ACCEL_XOUT_H + i) for i in (0, 2, 4, 8, 10, 12)]
+        clock.advance(0.005)
+    old = clock.monotonic() - begin
+    begin = clock.monotonic()
+    mpu.collect(200)
+    new = clock.monotonic() - begin
+    print(f"calibration (200 samples): {old:.2f} s with read_word, {new:.2f} s from the FIFO at 200 Hz")
+
+
+print(f"{SAMPLES} samples, simulated MPU6050 at {ODR} Hz, I2C at {I2C_SPEED / 1000:.0f} kHz")
+old_reads()
+burst_reads()
+data_ready()
+data_ready(int_pin=hal.MPU_INT_PIN)
+fifo()
+calibration()
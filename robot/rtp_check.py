@@ -0,0 +1,212 @@
+# rtp_check.py
+# Two RtpSessions (audio_protocol.py), the robot and the laptop, talking
+# over a simulated network on virtual time: what each one reports about
+# the other's stream (loss, interarrival jitter, round trip) against
+# what the network really did, sequence number wrap, a peer restarting,
+# and the RTCP packets' layout.
+# Runs anywhere.
+#
+#   python rtp_check.py
+import heapq
+import struct
+
+import numpy as np
+
+from audio_codec import PcmCodec
+from audio_protocol import (RTCP_BYE, RTCP_RR, RTCP_SDES, RTCP_SR, SOURCE_TIMEOUT, AudioEncoder,
+                            RtpSession, is_rtcp)
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SAMPLERATE = 48000
+FRAME = 960                 # 20 ms
+FRAME_TIME = FRAME / SAMPLERATE
+SECONDS = 120
+EPOCH = 1.7e9               # the virtual wall clock starts here
+# -------------------------
+
+
+class Network:
+    """Both directions of the link: sendto() delivers after delay(), or not at all."""
+
+    def __init__(self, seed=3):
+        self.now = 0.0
+        self.rng = np.random.default_rng(seed)
+        self.events = []
+        self.sessions = {}
+        self._order = 0
+
+    def socket(self, name, delay, loss=0.0, duplicate=0.0):
+        network = self
+
+        class Sock:
+            sent = 0
+            dropped = 0
+            duplicated = 0
+
+            def sendto(self, data, address):
+                is_audio = not is_rtcp(data)
+                self.sent += is_audio
+                if is_audio and network.rng.random() < loss:
+                    self.dropped += 1
+                    return
+                copies = 1
+                if is_audio and network.rng.random() < duplicate:
+                    copies, self.duplicated = 2, self.duplicated + 1
+                for _ in range(copies):
+                    network._order += 1
+                    heapq.heappush(network.events, (network.now + delay(), network._order, address, data))
+        return Sock()
+
+    def run_until(self, t):
+        while self.events and self.events[0][0] <= t:
+            when, _, address, data = heapq.heappop(self.events)
+            self.now = when
+            self.sessions[address].receive(data, arrival=when)
+        self.now = t
+
+
+def session(network, name, peer, delay, **options):
+    s = RtpSession(AudioEncoder(PcmCodec(SAMPLERATE)), network.socket(name, delay, **options), peer,
+                   SAMPLERATE, cname=name, clock=lambda: network.now, wallclock=lambda: EPOCH + network.now)
+    network.sessions[name] = s
+    return s
+
+
+def talk(network, sessions, seconds, start=0.0):
+    """Each session sends a frame every FRAME_TIME and a report every 5 s, for `seconds`."""
+    frame = np.zeros(FRAME, dtype=np.int16)
+    t = start
+    for i in range(int(seconds / FRAME_TIME)):
+        t = start + i * FRAME_TIME
+        network.run_until(t)
+        for s in sessions:
+            s.send(frame)
+        if i % int(5 / FRAME_TIME) == int(2.5 / FRAME_TIME):
+            for s in sessions:
+                s.sock.sendto(s.report(), s.address)
+    network.run_until(t + 1)
+
+
+failures = 0
+
+
+def check(name, ok, detail=''):
+    global failures
+    failures += not ok
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail else ''}")
+
+
+# -----------------------------
+# Loss, duplicates and jitter, both ways
+# -----------------------------
+print(f"{SECONDS} s each way, 20 ms packets:")
+net = Network()
+rng = net.rng
+one_way = 0.030
+spread = 0.012              # uniform on top of one_way: mean |difference| is spread / 3
+robot = session(net, 'robot', 'laptop', lambda: one_way + rng.uniform(0, spread), loss=0.08, duplicate=0.02)
+laptop = session(net, 'laptop', 'robot', lambda: one_way + rng.uniform(0, spread), loss=0.02)
+talk(net, (robot, laptop), SECONDS)
+
+heard = laptop.stats()
+truth = 100 * (robot.sock.dropped - robot.sock.duplicated) / robot.sock.sent
+check("loss at the laptop, as RFC 3550 counts it (duplicates offset it)", abs(heard['loss_pct'] - truth) < 0.05,
+      f"{heard['loss_pct']:.2f}% reported, {truth:.2f}% dropped less duplicated")
+check("lost packets, exactly", heard['lost'] == robot.sock.dropped - robot.sock.duplicated,
+      f"{heard['lost']} vs {robot.sock.dropped} - {robot.sock.duplicated}")
+check("interarrival jitter", abs(heard['jitter_ms'] - spread / 3 * 1000) < 0.25 * spread / 3 * 1000,
+      f"{heard['jitter_ms']:.2f} ms, {spread / 3 * 1000:.2f} ms expected")
+s = robot.stats()
+check("the robot's loss from the laptop's reports", abs(s['peer_loss_pct'] - heard['loss_pct']) < 0.3,
+      f"{s['peer_loss_pct']:.2f}% vs {heard['loss_pct']:.2f}%")
+check("the robot's view of the laptop's jitter", abs(s['peer_jitter_ms'] - heard['jitter_ms']) < 2,
+      f"{s['peer_jitter_ms']:.2f} vs {heard['jitter_ms']:.2f} ms (one report old)")
+check("loss at the robot", abs(s['loss_pct'] - 100 * laptop.sock.dropped / laptop.sock.sent) < 0.05,
+      f"{s['loss_pct']:.2f}% vs {100 * laptop.sock.dropped / laptop.sock.sent:.2f}%")
+check("round trip from LSR/DLSR", robot.rtt is not None and 2 * one_way <= robot.rtt <= 2 * (one_way + spread) + 0.001,
+      f"{robot.rtt * 1000:.1f} ms, {2 * one_way * 1000:.0f}-{2 * (one_way + spread) * 1000:.0f} ms possible")
+check("reports both ways", s['reports_sent'] > 0 and s['reports_received'] == laptop.stats()['reports_sent'],
+      f"{s['reports_sent']} sent, {s['reports_received']} received")
+print("  " + robot.format())
+print("  " + laptop.format())
+
+# The sender report ties the robot's RTP timestamps to its wall clock
+stamps = []
+laptop_receive = laptop.receive
+
+
+def receive(data, arrival=None):
+    packet = laptop_receive(data, arrival)
+    if packet is not None:
+        stamps.append((laptop.source_time(packet.timestamp), arrival))
+    return packet
+
+
+laptop.receive = receive
+net.sessions['laptop'] = laptop
+talk(net, (robot, laptop), 10, start=SECONDS)     # carrying on, the sound card doesn't stop
+# A packet goes out a frame after its first sample was captured
+lag = np.array([arrival + EPOCH - sent for sent, arrival in stamps]) - FRAME_TIME
+check("source_time() is the robot's wall clock at capture", one_way - 0.001 <= lag.min() and lag.max() <= one_way + spread + 0.001,
+      f"arrival - capture - {FRAME_TIME * 1000:.0f} ms {lag.min() * 1000:.1f}-{lag.max() * 1000:.1f} ms")
+
+# -----------------------------
+# Sequence number wrap, reordering
+# -----------------------------
+print("Wrap and reordering:")
+net = Network(seed=4)
+rng = net.rng
+robot = session(net, 'robot', 'laptop', lambda: 0.005 + (FRAME_TIME * 2.5 if rng.random() < 0.05 else 0))
+laptop = session(net, 'laptop', 'robot', lambda: 0.005)
+robot.encoder.seq = 65000
+talk(net, (robot,), 60)
+heard = laptop.stats()
+check("65536 wrap", laptop.source.cycles == 65536 and heard['expected'] == robot.encoder.packets,
+      f"{heard['expected']} expected, {robot.encoder.packets} sent")
+check("5% reordered isn't loss", heard['lost'] == 0 and heard['received'] == robot.encoder.packets)
+
+# -----------------------------
+# The peer restarting
+# -----------------------------
+print("Restarts:")
+old = robot.ssrc
+restarted = session(net, 'robot', 'laptop', lambda: 0.005)
+talk(net, (restarted,), 1, start=60.5)
+check("a second sender is ignored while the first one is live", laptop.source.ssrc == old and laptop.foreign > 0,
+      f"{laptop.foreign} packets ignored")
+talk(net, (restarted,), 1, start=62 + SOURCE_TIMEOUT)
+check("then takes over once the first is quiet", laptop.source.ssrc == restarted.ssrc)
+again = session(net, 'robot', 'laptop', lambda: 0.005)
+restarted.sock.sendto(restarted.bye(), 'laptop')
+talk(net, (again,), 1, start=70)
+check("BYE hands over at once", laptop.source.ssrc == again.ssrc and laptop.stats()['received'] == again.encoder.packets)
+
+# -----------------------------
+# Layout
+# -----------------------------
+print("RTCP layout:")
+talk(net, (again, laptop), 4, start=72)
+data = again.report()
+types, offset = [], 0
+while offset < len(data):
+    first, packet_type, length = struct.unpack_from('!BBH', data, offset)
+    types.append(packet_type)
+    offset += 4 * (length + 1)
+check("compound SR + SDES, lengths add up", types == [RTCP_SR, RTCP_SDES] and offset == len(data), f"{types}")
+check("a report block on the peer's stream", data[0] & 0x1F == 1 and struct.unpack_from('!I', data, 28)[0] == laptop.ssrc)
+check("RR when we haven't sent since the last report", again.report()[1] == RTCP_RR)
+check("BYE", again.bye()[1] == RTCP_BYE and len(again.bye()) == 8)
+fresh = AudioEncoder(PcmCodec(SAMPLERATE))
+audio = [fresh.encode(np.zeros(FRAME, dtype=np.int16)) for _ in range(2)]
+check("RTP with the marker bit isn't taken for RTCP", not any(is_rtcp(p) for p in audio) and audio[0][1] & 0x80)
+start = fresh.timestamp
+fresh.skip(2 * FRAME)                   # muted for two frames
+after = fresh.encode(np.zeros(FRAME, dtype=np.int16))
+check("skip(): the timestamp runs on, the marker bit starts the next talk spurt",
+      not audio[1][1] & 0x80 and after[1] & 0x80
+      and struct.unpack_from('!I', after, 4)[0] == (start + 2 * FRAME) & 0xFFFFFFFF
+      and struct.unpack_from('!H', after, 2)[0] == (struct.unpack_from('!H', audio[1], 2)[0] + 1) & 0xFFFF)
+
+print("All checks passed" if not failures else f"{failures} check(s) failed")
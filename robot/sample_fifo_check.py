@@ -0,0 +1,196 @@
+# sample_fifo_check.py
+# SampleFifo (sample_fifo.py) on its own: odd write and read sizes,
+# wrap around, underrun, overflow, pulling from a source. Then the whole
+# audio path on virtual time with packets, sender blocks and receiver
+# blocks all different sizes, and a short datagram in the middle:
+# mic blocks -> SampleFifo -> RTP (PCM) -> JitterBuffer -> SampleFifo ->
+# speaker blocks. The samples are a ramp, so a glitch anywhere shows.
+# Runs anywhere.
+#
+#   python sample_fifo_check.py
+import heapq
+
+import numpy as np
+
+from audio_codec import PayloadDecoder, PcmCodec
+from audio_dsp import Playback
+from audio_protocol import AudioEncoder, RtpSession
+from jitter_buffer import JitterBuffer
+from sample_fifo import SampleFifo
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SAMPLERATE = 48000
+SECONDS = 20
+DELAY = 0.012               # one way, s, plus up to JITTER
+JITTER = 0.004
+SETTLE = 1.0                # s of output not checked: the jitter buffer finding its delay
+# After that every glitch has to be the jitter buffer's own (a packet
+# late past the delay it settled on), not the FIFO's
+# (sender's sound card block, packet, receiver's sound card block), samples
+RUNS = [
+    (960, 960, 960),        # as bot_main and control_main are set up
+    (1024, 480, 1024),      # the old 1024 blocks, 10 ms packets
+    (1024, 960, 256),
+    (256, 960, 1024),
+    (441, 240, 4096),       # block sizes that fit nothing
+    (4096, 120, 333),
+]
+# -------------------------
+
+failures = 0
+
+
+def check(name, ok, detail=''):
+    global failures
+    failures += not ok
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail else ''}")
+
+
+def ramp(start, n):
+    return ((np.arange(start, start + n) % 30000) + 1).astype(np.int16)
+
+
+def breaks(samples):
+    """Places where the ramp doesn't go up by one (or wrap back to 1)."""
+    step = np.diff(samples.astype(np.int32))
+    return np.flatnonzero((step != 1) & (step != -29999))
+
+
+def glitches(samples, gap):
+    """Runs of breaks, a run ending `gap` samples after its last break."""
+    places = breaks(samples)
+    return int(len(places) > 0) + int(np.count_nonzero(np.diff(places) > gap))
+
+
+# -----------------------------
+# The FIFO alone
+# -----------------------------
+print("SampleFifo:")
+rng = np.random.default_rng(2)
+fifo = SampleFifo(capacity=1000)
+written = read = 0
+out = []
+for _ in range(5000):
+    n = int(rng.integers(0, 400))
+    if fifo.available + n <= fifo.capacity:
+        fifo.write(ramp(written, n))
+        written += n
+    m = int(rng.integers(1, 400))
+    if m <= fifo.available:
+        out.append(fifo.read(m).copy())
+        read += m
+out = np.concatenate(out)
+check("random write and read sizes, wrapping a 1000 sample ring", np.array_equal(out, ramp(0, read)),
+      f"{read} samples through")
+check("no underruns or overflows counted", fifo.underruns == 0 and fifo.overflows == 0)
+
+fifo = SampleFifo(capacity=1000)
+fifo.write(ramp(0, 300))
+block = fifo.read(512)
+check("an underrun is the samples there, then silence",
+      np.array_equal(block[:300], ramp(0, 300)) and not block[300:].any() and fifo.underruns == 1)
+fifo.write(ramp(0, 700))
+fifo.write(ramp(700, 500))
+check("an overflow drops the oldest", fifo.available == 1000 and fifo.overflows == 200
+      and np.array_equal(fifo.read(1000), ramp(200, 1000)))
+fifo.write(ramp(0, 2500))
+check("a write bigger than the ring keeps its end", np.array_equal(fifo.read(1000), ramp(1500, 1000)))
+
+sizes = iter([480, 137, 960, 0, 2000])
+pulled = []
+
+
+def source():
+    n = next(sizes, None)
+    if n is None:
+        return None
+    pulled.append(n)
+    return ramp(sum(pulled) - n, n)
+
+
+fifo = SampleFifo()
+first = fifo.read(1024, source=source).copy()
+check("read() pulls packets of any size from a source until it has enough",
+      np.array_equal(first, ramp(0, 1024)) and pulled == [480, 137, 960] and fifo.available == 553)
+second = fifo.read(1024, source=source).copy()
+check("...and stops at an empty one: an underrun",
+      pulled == [480, 137, 960, 0] and np.array_equal(second[:553], ramp(1024, 553)) and fifo.underruns == 1)
+fifo = SampleFifo()
+fifo.write(ramp(0, 2500))
+check("blocks() cuts exact sizes and leaves the rest",
+      [len(b) for b in fifo.blocks(960)] == [960, 960] and fifo.available == 580)
+
+
+# -----------------------------
+# The audio path, sizes all different
+# -----------------------------
+def run(sender_block, packet, receiver_block, short=None, seed=1):
+    """
+    Output samples, the receiver's blocks' sizes, the jitter buffer and
+    the frames it concealed after SETTLE.
+    """
+    rng = np.random.default_rng(seed)
+    session = RtpSession(AudioEncoder(PcmCodec(SAMPLERATE)), sample_rate=SAMPLERATE)
+    receiver = RtpSession(sample_rate=SAMPLERATE)
+    buffer = JitterBuffer(960, SAMPLERATE, decoder=PayloadDecoder(SAMPLERATE))
+    mic_fifo, speaker_fifo = SampleFifo(), SampleFifo()
+    speaker = Playback(receiver_block, gain=1)
+    events = []
+    for k in range(int(SECONDS * SAMPLERATE / sender_block)):
+        events.append(((k + 1) * sender_block / SAMPLERATE, 0, k))
+    for k in range(int(SECONDS * SAMPLERATE / receiver_block)):
+        events.append((k * receiver_block / SAMPLERATE + 0.0031, 2, k))
+    heapq.heapify(events)
+    out, sizes, sent, settled = [], [], 0, None
+    while events:
+        now, kind, k = heapq.heappop(events)
+        if kind == 0:           # mic callback: a block in, packets out
+            mic_fifo.write(ramp(k * sender_block, sender_block))
+            for samples in mic_fifo.blocks(packet):
+                data = session.encode(samples)
+                if sent == short:
+                    data = data[:len(data) - packet]     # half the samples
+                sent += 1
+                heapq.heappush(events, (now + DELAY + rng.uniform(0, JITTER), 1, data))
+        elif kind == 1:         # a packet arrives
+            p = receiver.receive(k, arrival=now)
+            buffer.put(p.seq, p.timestamp, p, arrival=now, source=p.ssrc, marker=p.marker)
+        else:                   # speaker callback
+            if settled is None and now >= SETTLE:
+                settled = buffer.underruns + buffer.lost + buffer.shrunk
+            outdata = np.zeros((receiver_block, 2), dtype=np.int16)
+            speaker.write(speaker_fifo.read(receiver_block, source=lambda: buffer.get(now)), outdata)
+            sizes.append(len(outdata))
+            out.append(outdata[:, 0].copy())
+    return np.concatenate(out), sizes, buffer, buffer.underruns + buffer.lost + buffer.shrunk - settled
+
+
+print(f"mic -> packets -> jitter buffer -> speaker, {SECONDS} s each, {DELAY * 1000:.0f}-"
+      f"{(DELAY + JITTER) * 1000:.0f} ms one way:")
+for sender_block, packet, receiver_block in RUNS:
+    out, sizes, buffer, concealed = run(sender_block, packet, receiver_block)
+    found = glitches(out[int(SETTLE * SAMPLERATE):], 2 * packet)
+    start = np.flatnonzero(out)[0]
+    check(f"{sender_block:4d} sample blocks, {packet:4d} sample packets, {receiver_block:4d} sample blocks",
+          found <= concealed and set(sizes) == {receiver_block},
+          f"first sound at {start / SAMPLERATE * 1000:3.0f} ms, {found} glitches after {SETTLE:.0f} s, "
+          f"{concealed} frames concealed by the jitter buffer then")
+
+out, sizes, buffer, concealed = run(1024, 480, 1024, short=500)
+found = glitches(out[int(SETTLE * SAMPLERATE):], 2 * 480)
+check("a short datagram is a short frame, not an exception", found == 1 and concealed == 0 and set(sizes) == {1024},
+      f"{found} glitch")
+
+# What playback_callback did with one before
+chunk = ramp(0, 240)
+try:
+    outdata = np.zeros((480, 2), dtype=np.int16)
+    outdata[:] = np.column_stack([chunk, chunk]).astype(np.int16)
+    before = "no error"
+except ValueError as e:
+    before = f"ValueError: {e}"
+print(f"  (the old playback_callback on a 240 sample packet and a 480 sample block: {before})")
+
+print("All checks passed" if not failures else f"{failures} check(s) failed")
@@ -0,0 +1,188 @@
+# sim_robot.py
+# The robot loop on simulated hardware (hal.py / hal_sim.py), on a
+# virtual clock, so it runs headless and much faster than real time.
+#
+# A scripted laptop drives toward a wall with heartbeats, pans the
+# camera, then drops the link. The robot side is bot_main.py's: the
+# ControlEngine's own loop with bot_control.py's wiring, select()ing on a
+# simulated socket. The run checks that the obstacle stop holds the robot
+# off the wall and the dead-man watchdog acts, and prints what the
+# hardware saw.
+#
+#   python sim_robot.py [seconds]
+import sys
+import time
+
+import hal
+from bot_control import MAX_DIST, make_engine
+from control_protocol import ControlEncoder
+from drive_mixer import DriveMixer
+from hal_sim import SimClock
+from imu_service import ImuService
+from mpu6050 import MPU6050
+from sonar_service import SonarService
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+DRIVE_RATE = 50
+SONAR_RATE = 10             # pings/s, as in bot_main.py
+STEP = 0.002                # s, the world moves on this much at a time
+START = 1000.0              # virtual clock at the start
+TELEMETRY_INTERVAL = 0.2
+HEARTBEAT = 0.2
+LAPTOP_POLL = 0.02          # s between looks at the stick, as control_main.py's loop
+LINK_LATENCY = 0.02         # laptop -> Pi, one way
+TOP_SPEED = 0.5             # m/s at full duty
+WALL_CM = 400               # wall in front of the robot at the start
+# cm the robot may go past MAX_DIST at top speed: the sonar's median lags
+# two pings (window 5) and the next ping is up to one more away
+STOP_MARGIN = TOP_SPEED * 100 * 3 / SONAR_RATE
+# -------------------------
+
+motors = [22, 10, 27, 17]
+
+
+def script(t):
+    """What the driver does at time t: (throttle, steer, pan, tilt), None for no link."""
+    phase = t % 30
+    if phase < 12:
+        return 1.0, 0.0, 90, 90             # full ahead (toward the wall)
+    if phase < 15:
+        return 0.0, 0.0, 60 + phase * 5, 80     # stop and look around
+    if phase < 20:
+        return -0.6, 0.3, 90, 90            # back off in an arc
+    if phase < 22:
+        return 0.5, 0.0, 90, 90
+    return None                             # link dropped (8 s)
+
+
+class SimLink:
+    """
+    The control socket and everything on the far side of it: the laptop
+    sending the script, and the world moving between drive ticks. The
+    engine's own run() loop select()s on it, and select() moves the
+    virtual clock on a STEP at a time until a packet is due or the wait
+    is over.
+    """
+
+    def __init__(self, clock, encoder, world):
+        self.clock = clock
+        self.encoder = encoder
+        self.world = world          # world(now, dt), every STEP
+        self.in_flight = []         # (arrival time, packet)
+        self.last_sent = None
+        self.last_state = None
+        self.next_poll = START
+
+    def setblocking(self, flag):
+        pass
+
+    def recvfrom(self, size):
+        if self.in_flight and self.in_flight[0][0] <= self.clock.monotonic():
+            return self.in_flight.pop(0)[1], ('laptop', 6001)
+        raise BlockingIOError
+
+    def select(self, rlist, wlist, xlist, timeout):
+        end = self.clock.monotonic() + timeout
+        while True:
+            now = self.clock.monotonic()
+            self._laptop(now)
+            if self.in_flight and self.in_flight[0][0] <= now:
+                return rlist, [], []
+            if now >= end:
+                return [], [], []
+            dt = min(STEP, end - now)
+            self.clock.advance(dt)
+            self.world(self.clock.monotonic(), dt)
+
+    def _laptop(self, now):
+        # Send on change plus heartbeat, like control_sender.py
+        if now < self.next_poll:
+            return
+        self.next_poll += LAPTOP_POLL
+        command = script(now - START)
+        if command is not None and (command != self.last_state or now - self.last_sent >= HEARTBEAT):
+            packet = self.encoder.encode(*command, time_ms=int(now * 1000) & 0xFFFFFFFF)
+            self.in_flight.append((now + LINK_LATENCY, packet))
+            self.last_sent, self.last_state = now, command
+
+
+def main():
+    clock = SimClock(start=START)
+    hw = hal.load('sim', clock=clock)
+    GPIO = hw.GPIO
+    GPIO.setmode(GPIO.BCM)
+    for pin in motors:
+        GPIO.setup(pin, GPIO.OUT)
+    pwm_left, pwm_right = GPIO.PWM(12, 1000), GPIO.PWM(13, 1000)
+    pwm_left.start(0)
+    pwm_right.start(0)
+    kit = hw.ServoKit(channels=16)
+    ultra = SonarService(GPIO, trigger=23, echo=24, rate=SONAR_RATE, max_distance=1.0,
+                         clock=clock.monotonic, sleep=clock.sleep)
+    bus = hw.SMBus(1)
+    mpu = MPU6050(bus, hal.MPU_ADDRESS, clock=clock.monotonic, sleep=clock.sleep)
+    imu = ImuService(mpu, clock=clock.monotonic, sleep=clock.sleep)
+    mpu.start_fifo()
+
+    # The robot's position along the line to the wall
+    position = [0.0]
+    sonar = hw.sonar(23, 24)
+    sonar.distance_cm = lambda now: WALL_CM - position[0] * 100
+
+    state = {'blocked': False, 'obstacle_stops': 0, 'telemetry': 0, 'min_distance': WALL_CM,
+             'telemetry_due': START}
+
+    def world(now, dt):
+        imu.poll()      # the sampling threads' work, once per step here
+        ultra.poll()
+
+        # Wheels -> motion (both wheels forward moves toward the wall)
+        speed = sum(duty * direction for duty, direction in
+                    ((pwm_left.duty, _direction(GPIO, 22, 10)), (pwm_right.duty, _direction(GPIO, 27, 17))))
+        position[0] += speed / 2 / 80 * TOP_SPEED * dt
+        state['min_distance'] = min(state['min_distance'], sonar.true_distance(now))
+
+        # The engine holding the robot back from the wall
+        blocked = not engine.tripped and engine.target[0] > 0 and engine.forward_blocked()
+        if blocked and not state['blocked']:
+            state['obstacle_stops'] += 1
+        state['blocked'] = blocked
+
+        # Telemetry: sonar and the MPU6050, as bot_main.py reads them
+        if now >= state['telemetry_due']:
+            state['telemetry_due'] += TELEMETRY_INTERVAL
+            ultra.distance
+            imu.snapshot()
+            state['telemetry'] += 1
+
+    link = SimLink(clock, ControlEncoder(), world)
+    engine = make_engine(link, GPIO, motors, pwm_left, pwm_right, kit, ultra, mixer=DriveMixer(),
+                         rate=DRIVE_RATE, clock=clock.monotonic, select=link.select)
+
+    wall_start = time.perf_counter()
+    engine.run(running=lambda: clock.monotonic() - START < SECONDS)
+
+    wall = time.perf_counter() - wall_start
+    print(f"simulated {SECONDS:.0f} s in {wall:.2f} s ({SECONDS / wall:.0f}x real time)")
+    print(f"GPIO calls: {dict(GPIO.counts)}")
+    print(f"servo writes: {kit.counts['servo.angle']}, I2C transactions: {bus.transactions}, "
+          f"IMU samples: {imu.snapshot().samples}, sonar pings: {ultra.pings}, telemetry messages: {state['telemetry']}")
+    print(f"packets accepted: {engine.decoder.accepted}, watchdog trips: {engine.trips}, "
+          f"obstacle stops: {state['obstacle_stops']}, closest to the wall: {state['min_distance']:.0f} cm "
+          f"(stop at {MAX_DIST} cm)")
+
+    ok = (engine.trips >= 1 and state['obstacle_stops'] >= 1
+          and state['min_distance'] > MAX_DIST - STOP_MARGIN)
+    print("PASS: obstacle stop and watchdog worked" if ok else "FAIL")
+    return ok
+
+
+def _direction(GPIO, forward_pin, back_pin):
+    return GPIO.levels.get(forward_pin, 0) - GPIO.levels.get(back_pin, 0)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
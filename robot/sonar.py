@@ -1,38 +1,24 @@
 import RPi.GPIO as GPIO
 import time
 
+from sonar_service import SonarService
+
 TRIG = 23
 ECHO = 24
 
 GPIO.setmode(GPIO.BCM)
-GPIO.setup(TRIG, GPIO.OUT)
-GPIO.setup(ECHO, GPIO.IN)
-
-def get_distance():
-    GPIO.output(TRIG, False)
-    time.sleep(0.0002)
-
-    GPIO.output(TRIG, True)
-    time.sleep(0.00001)
-    GPIO.output(TRIG, False)
-
-    while GPIO.input(ECHO) == 0:
-        pulse_start = time.time()
 
-    while GPIO.input(ECHO) == 1:
-        pulse_end = time.time()
-
-    pulse_duration = pulse_end - pulse_start
-
-    distance = pulse_duration * 17150
-    return distance
+# Echoes are timed by edge callbacks (sonar_service.py), no busy-wait loops,
+# and a missing echo times out instead of hanging
+sonar = SonarService(GPIO, trigger=TRIG, echo=ECHO, rate=10, max_distance=4.0).start()
 
 try:
     while True:
-        dist = get_distance()
-        print(f"Distance: {dist:.2f} cm")
+        reading = sonar.reading()
+        print(f"Distance: {reading.distance_cm:.2f} cm (last ping {reading.raw_cm or 0:.2f} cm, "
+              f"{reading.timeouts} timeouts{', stale' if reading.stale else ''})")
         time.sleep(0.2)
 
 except KeyboardInterrupt:
+    sonar.stop()
     GPIO.cleanup()
-
@@ -0,0 +1,194 @@
+# sonar_service.py
+# The HC-SR04 pinged at a steady rate with the echo timed by GPIO edge
+# callbacks instead of spinning on GPIO.input(), so a ping costs a few
+# microseconds of CPU rather than the whole echo, and a lost echo costs a
+# timeout rather than the thread (sonar.py's loops never came back).
+# Readings go through a median over the last few, and the latest is kept
+# for any thread to read without waiting.
+#
+#   ultra = SonarService(GPIO, trigger=23, echo=24).start()
+#   ultra.distance                  # metres, as gpiozero.DistanceSensor
+#   reading = ultra.reading()       # SonarReading, never blocks
+import collections
+import statistics
+import threading
+import time
+
+SPEED_OF_SOUND = 343.0      # m/s, about 20 deg C
+CM_PER_SECOND = SPEED_OF_SOUND * 100 / 2     # echo width -> distance (17150)
+MIN_INTERVAL = 0.06         # s between pings: the HC-SR04 needs ~60 ms for echoes to die down
+TRIGGER_PULSE = 0.00001     # s, 10 us
+ECHO_DELAY = 0.005          # s the module may take to raise echo, on top of the round trip
+MIN_RANGE_CM = 2.0
+OUTLIER_CM = 30.0           # a reading this far from the median is counted as an outlier
+STALE_AFTER = 0.5           # s without a good reading before reading().stale
+
+SonarReading = collections.namedtuple(
+    'SonarReading',
+    'time distance_cm raw_cm pings timeouts outliers stale')
+SonarReading.__doc__ = """\
+time: monotonic time of the last good echo (None before the first).
+distance_cm: median of the last `window` readings, max_range_cm when
+nothing is in range. raw_cm: that last reading on its own. pings,
+timeouts (no echo edge), outliers: counts so far. stale: no good echo
+for STALE_AFTER seconds, the distance is old."""
+
+
+class SonarService:
+    """
+    Pings every 1/rate seconds (never closer than MIN_INTERVAL) on a
+    thread of its own. The echo pin's edges are timestamped in the GPIO
+    library's callback (RPi.GPIO's edge thread on the Pi), and the thread
+    sleeps on an Event until the falling one, or until `timeout`, which
+    defaults to the round trip to max_range_cm plus ECHO_DELAY. A wider
+    echo, or the HC-SR04's 38 ms "nothing there" pulse, counts as out of
+    range. A ping is skipped while echo is still high from the last one,
+    so a late falling edge is never taken for the next rising one.
+
+    The median over a ring buffer of `window` readings rides out single
+    stray reflections: one outlier in five never reaches distance_cm,
+    and a real change gets through after window // 2 + 1 pings.
+
+    On a virtual clock (hal_sim.SimClock) call poll() from the loop
+    instead of start(), as sim_robot.py does with ImuService.
+    """
+
+    def __init__(self, gpio, trigger=23, echo=24, rate=10.0, window=5, max_distance=1.0,
+                 max_range_cm=400.0, timeout=None, clock=time.monotonic, sleep=time.sleep):
+        self.gpio = gpio
+        self.trigger = trigger
+        self.echo = echo
+        self.interval = max(MIN_INTERVAL, 1.0 / rate)
+        self.max_distance = max_distance
+        self.max_range_cm = max_range_cm
+        self.timeout = timeout if timeout is not None else max_range_cm / CM_PER_SECOND + ECHO_DELAY
+        self.clock = clock
+        self.sleep = sleep
+        self.readings = collections.deque(maxlen=window)
+
+        self.pings = 0
+        self.timeouts = 0
+        self.outliers = 0
+        self.busy = 0           # pings skipped with echo still high
+        self._rise = None
+        self._fall = None
+        self._armed = False
+        self._pinged_at = None
+        self._next_ping = clock()
+        self._done = threading.Event()
+        self._latest = SonarReading(None, max_range_cm, None, 0, 0, 0, True)
+        self._thread = None
+        self.running = False
+
+        gpio.setup(trigger, gpio.OUT, initial=0)
+        gpio.setup(echo, gpio.IN)
+        gpio.add_event_detect(echo, gpio.BOTH, callback=self._edge)
+
+    # -----------------------------
+    # Readers
+    # -----------------------------
+    def reading(self):
+        latest = self._latest
+        if latest.time is not None and not latest.stale and self.clock() - latest.time > STALE_AFTER:
+            return latest._replace(stale=True)
+        return latest
+
+    @property
+    def distance(self):
+        """Metres, capped at max_distance (gpiozero.DistanceSensor's)."""
+        return min(self._latest.distance_cm / 100, self.max_distance)
+
+    @property
+    def distance_cm(self):
+        return self._latest.distance_cm
+
+    # -----------------------------
+    # Pinging
+    # -----------------------------
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name='sonar', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.gpio.remove_event_detect(self.echo)
+
+    close = stop
+
+    def run(self):
+        while self.running:
+            delay = self._next_ping - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            if not self.ping():
+                continue
+            self._done.wait(self.timeout)
+            self.finish()
+
+    def poll(self):
+        """One step without blocking: finish an echo that is in, or ping when it's time."""
+        now = self.clock()
+        if self._armed and (self._done.is_set() or now - self._pinged_at >= self.timeout):
+            self.finish()
+        if not self._armed and now >= self._next_ping:
+            self.ping()
+
+    def ping(self):
+        """Send the trigger pulse; False if echo is still high from the last one."""
+        now = self.clock()
+        self._next_ping = max(self._next_ping + self.interval, now)
+        if self.gpio.input(self.echo):
+            self.busy += 1
+            return False
+        self._rise = self._fall = None
+        self._done.clear()
+        self._armed = True
+        self._pinged_at = now
+        self.pings += 1
+        self.gpio.output(self.trigger, 1)
+        self.sleep(TRIGGER_PULSE)
+        self.gpio.output(self.trigger, 0)
+        return True
+
+    def _edge(self, channel):
+        # Edge thread: a timestamp and nothing else. BOTH doesn't say which
+        # edge it was, but after a ping with echo low the first is the rise.
+        now = self.clock()
+        if not self._armed:
+            return
+        if self._rise is None:
+            self._rise = now
+        elif self._fall is None:
+            self._fall = now
+            self._done.set()
+
+    def finish(self):
+        """Turn the echo (or its absence) into a reading and publish it."""
+        self._armed = False
+        rise, fall = self._rise, self._fall
+        if rise is None:
+            self.timeouts += 1       # the module never answered
+            self._publish(None)
+            return None
+        distance = (fall - rise) * CM_PER_SECOND if fall is not None else None
+        if distance is None or distance > self.max_range_cm:
+            distance = self.max_range_cm     # nothing in range
+        distance = max(MIN_RANGE_CM, distance)
+        if self.readings and abs(distance - self._latest.distance_cm) > OUTLIER_CM:
+            self.outliers += 1
+        self.readings.append(distance)
+        self._publish(distance)
+        return distance
+
+    def _publish(self, raw):
+        latest = self._latest
+        if raw is None:
+            stale = latest.time is None or self.clock() - latest.time > STALE_AFTER
+            self._latest = latest._replace(pings=self.pings, timeouts=self.timeouts, stale=stale)
+            return
+        self._latest = SonarReading(self._fall or self._rise, statistics.median(self.readings), raw, self.pings,
+                                    self.timeouts, self.outliers, False)
@@ -0,0 +1,128 @@
+# sonar_service_bench.py
+# sonar.py's busy-wait ranging against SonarService (sonar_service.py) on
+# the simulated HC-SR04 (hal_sim.SimSonar): CPU used at the same ping
+# rate in real time, what a lost echo does to each, and how the median
+# copes with stray reflections (virtual clock). Runs anywhere.
+#
+#   python sonar_service_bench.py [seconds]
+import statistics
+import sys
+import threading
+import time
+
+import hal
+from hal_sim import SimClock
+from sonar_service import SonarService
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+RATE = 10                   # pings/s, both ways
+DISTANCES = (30, 100, 300)  # cm
+TRIG = 23
+ECHO = 24
+OUTLIER_RATE = 0.1
+# -------------------------
+
+
+def get_distance(GPIO):
+    # sonar.py's, unchanged apart from the GPIO module
+    GPIO.output(TRIG, False)
+    time.sleep(0.0002)
+
+    GPIO.output(TRIG, True)
+    time.sleep(0.00001)
+    GPIO.output(TRIG, False)
+
+    while GPIO.input(ECHO) == 0:
+        pulse_start = time.time()
+
+    while GPIO.input(ECHO) == 1:
+        pulse_end = time.time()
+
+    pulse_duration = pulse_end - pulse_start
+
+    distance = pulse_duration * 17150
+    return distance
+
+
+def busy_wait(distance_cm):
+    hw = hal.load('sim')
+    hw.sonar(TRIG, ECHO).distance_cm = distance_cm
+    hw.GPIO.setup(TRIG, hw.GPIO.OUT)
+    hw.GPIO.setup(ECHO, hw.GPIO.IN)
+    readings = []
+    cpu, wall = time.process_time(), time.perf_counter()
+    next_ping = wall
+    while time.perf_counter() - wall < SECONDS:
+        readings.append(get_distance(hw.GPIO))
+        next_ping += 1.0 / RATE
+        time.sleep(max(0.0, next_ping - time.perf_counter()))
+    return time.process_time() - cpu, time.perf_counter() - wall, readings
+
+
+def service(distance_cm):
+    hw = hal.load('sim')
+    hw.sonar(TRIG, ECHO).distance_cm = distance_cm
+    cpu, wall = time.process_time(), time.perf_counter()
+    sonar = SonarService(hw.GPIO, TRIG, ECHO, rate=RATE, max_distance=4.0).start()
+    time.sleep(SECONDS)
+    sonar.stop()
+    reading = sonar.reading()
+    return time.process_time() - cpu, time.perf_counter() - wall, reading
+
+
+print(f"{RATE} pings/s for {SECONDS:.0f} s each, real time, simulated HC-SR04")
+print("(the service's CPU includes the simulator's edge event thread)")
+for distance in DISTANCES:
+    cpu, wall, readings = busy_wait(distance)
+    print(f"{distance:4d} cm  busy wait  {cpu / wall * 100:5.1f}% CPU  "
+          f"{cpu / len(readings) * 1000:6.2f} ms CPU/ping  reads {statistics.median(readings):6.1f} cm")
+    cpu, wall, reading = service(distance)
+    print(f"{'':7}  service    {cpu / wall * 100:5.1f}% CPU  "
+          f"{cpu / max(1, reading.pings) * 1000:6.2f} ms CPU/ping  reads {reading.distance_cm:6.1f} cm")
+
+# A module that never raises echo (loose wire, brown out). The service
+# first: the busy wait never comes back and keeps spinning in the background.
+hw = hal.load('sim')
+hw.sonar(TRIG, ECHO).drop_rate = 1.0
+cpu = time.process_time()
+sonar = SonarService(hw.GPIO, TRIG, ECHO, rate=RATE).start()
+time.sleep(1.0)
+sonar.stop()
+reading = sonar.reading()
+print(f"no echo: service    {reading.timeouts} of {reading.pings} pings timed out, stale={reading.stale}, "
+      f"{(time.process_time() - cpu) * 100:.1f}% CPU")
+hw = hal.load('sim')
+hw.sonar(TRIG, ECHO).drop_rate = 1.0
+hw.GPIO.setup(TRIG, hw.GPIO.OUT)
+hw.GPIO.setup(ECHO, hw.GPIO.IN)
+stuck = threading.Thread(target=get_distance, args=(hw.GPIO,), daemon=True)
+cpu = time.process_time()
+stuck.start()
+stuck.join(1.0)
+print(f"no echo: busy wait  {'still spinning after 1 s' if stuck.is_alive() else 'returned'}, "
+      f"{(time.process_time() - cpu) * 100:.0f}% CPU")
+
+# Stray reflections, on the virtual clock: raw readings against the median
+clock = SimClock()
+hw = hal.load('sim', clock=clock)
+hw.sonar(TRIG, ECHO).outlier_rate = OUTLIER_RATE
+sonar = SonarService(hw.GPIO, TRIG, ECHO, rate=RATE, max_distance=4.0,
+                     clock=clock.monotonic, sleep=clock.sleep)
+raw, filtered = [], []
+for _ in range(int(60 / 0.005)):      # a minute
+    pings = sonar.pings
+    sonar.poll()
+    clock.advance(0.005)
+    reading = sonar.reading()
+    if sonar.pings != pings and len(sonar.readings) == sonar.readings.maxlen:
+        raw.append(abs(reading.raw_cm - 100))
+        filtered.append(abs(reading.distance_cm - 100))
+raw.sort()
+filtered.sort()
+print(f"{OUTLIER_RATE:.0%} stray reflections, {len(raw)} pings: error p99 / max  "
+      f"raw {raw[len(raw) * 99 // 100]:.1f} / {raw[-1]:.1f} cm, "
+      f"median {filtered[len(filtered) * 99 // 100]:.1f} / {filtered[-1]:.1f} cm, "
+      f"{sonar.outliers} outliers counted")